@@ -1,16 +1,34 @@
 # In /backend/main.py
 
+import os
 import asyncio
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi_cache import FastAPICache
-from fastapi_cache.backends.inmemory import InMemoryBackend
 
 # Import all application routers
 from routes import auth, oracle, vault, mint, transactions, protocol, admin, liquidations, health, collateral, ai
 
 # Import the background task
 from tasks import sync_user_vaults
+from services.web3_client import close_async_web3_provider
+from services.cache_backend import create_cache_backend, build_cache_key
+from services.position_mirror import POSITION_MIRROR_ENABLED
+from services.vault_writer import user_vault_writer, UserVaultWriteError
+from services.job_lease import run_exclusive
+
+# Set to false when a separate worker service (worker.py) runs the periodic jobs, so the
+# web workers only serve requests.
+RUN_BACKGROUND_JOBS = os.getenv("RUN_BACKGROUND_JOBS", "true").lower() == "true"
+
+# The event loop only keeps weak references to tasks, so the long-running ones are held here
+background_tasks = set()
+
+def start_background_task(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
 
 # --- Initialize FastAPI App ---
 app = FastAPI(
@@ -22,11 +40,36 @@ app = FastAPI(
 # --- Startup Event Handler ---
 @app.on_event("startup")
 async def startup_event():
-    FastAPICache.init(InMemoryBackend(), prefix="fastapi-cache")
-    print("FastAPI cache initialized with in-memory backend.")
+    # The backend is shared by all gunicorn workers unless CACHE_BACKEND_URL is unset
+    backend = create_cache_backend()
+    FastAPICache.init(backend, prefix="fastapi-cache", key_builder=build_cache_key)
+    print(f"FastAPI cache initialized with {type(backend).__name__}.")
     
-    print("Starting background task for user vault synchronization...")
-    asyncio.create_task(sync_user_vaults())
+    # Flushes the user_vaults rows buffered by the vault routes
+    start_background_task(user_vault_writer.run())
+
+    if not RUN_BACKGROUND_JOBS:
+        print("Background jobs are left to the worker service (worker.py).")
+    elif POSITION_MIRROR_ENABLED:
+        print("User vaults are kept in sync by the event listener's position mirror.")
+    else:
+        # Every gunicorn worker competes for the job's lease, so exactly one of them runs it
+        print("Starting background task for user vault synchronization (one worker at a time)...")
+        start_background_task(run_exclusive("sync_user_vaults", sync_user_vaults))
+
+# --- Shutdown Event Handler ---
+@app.on_event("shutdown")
+async def shutdown_event():
+    for task in list(background_tasks):
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    # Rows still buffered would otherwise be lost on every deploy or restart
+    try:
+        written = await user_vault_writer.flush()
+        print(f"Flushed {written} buffered user_vaults rows on shutdown.")
+    except UserVaultWriteError as e:
+        print(f"Could not flush buffered user_vaults rows on shutdown: {e}")
+    await close_async_web3_provider()
 
 # --- CORS Middleware ---
 origins = [
@@ -1,12 +1,13 @@
 # /backend/routes/admin.py
 import os
+import asyncio
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel, validator
 from typing import Dict, Any, List
 from web3 import Web3
-from web3.middleware import geth_poa_middleware
 
-from services.web3_client import get_web3_provider
+from services.web3_client import get_web3_provider, get_async_web3_provider
 from services.supabase_client import get_supabase_admin_client
 from utils.utils import is_admin_user, load_contract_abi
 from services.web3_service import send_admin_transaction
@@ -152,13 +153,12 @@ async def get_contract_status():
     Fetches the current global status of the CollateralVault contract.
     """
     try:
-        w3 = get_web3_provider()
-        w3.middleware_onion.inject(geth_poa_middleware, layer=0)
+        w3 = await get_async_web3_provider()
         vault = w3.eth.contract(
             address=Web3.to_checksum_address(COLLATERAL_VAULT_ADDRESS), 
             abi=COLLATERAL_VAULT_ABI
         )
-        data = vault.functions.getVaultStatus().call()
+        data = await vault.functions.getVaultStatus().call()
         return {
             "totalMintedGlobal": str(data[0]),
             "globalDailyMinted": str(data[1]),
@@ -187,7 +187,7 @@ async def pause_contract():
             abi=COLLATERAL_VAULT_ABI
         )
         fn = vault.functions.emergencyPause()
-        tx_hash = send_admin_transaction(fn)
+        tx_hash = await run_in_threadpool(send_admin_transaction, fn)
         return {"message": "Protocol paused successfully.", "transactionHash": tx_hash}
     except Exception as e:
         raise HTTPException(
@@ -209,7 +209,7 @@ async def unpause_contract():
             abi=COLLATERAL_VAULT_ABI
         )
         fn = vault.functions.emergencyUnpause()
-        tx_hash = send_admin_transaction(fn)
+        tx_hash = await run_in_threadpool(send_admin_transaction, fn)
         return {"message": "Protocol resumed successfully.", "transactionHash": tx_hash}
     except Exception as e:
         raise HTTPException(
@@ -225,13 +225,15 @@ async def unpause_contract():
 async def get_automint_config():
     """Retrieve the auto-mint configuration."""
     try:
-        w3 = get_web3_provider()
+        w3 = await get_async_web3_provider()
         vault = w3.eth.contract(
             address=Web3.to_checksum_address(COLLATERAL_VAULT_ADDRESS), 
             abi=COLLATERAL_VAULT_ABI
         )
-        cfg = vault.functions.autoMintConfig().call()
-        enabled = vault.functions.autoMintEnabled().call()
+        cfg, enabled = await asyncio.gather(
+            vault.functions.autoMintConfig().call(),
+            vault.functions.autoMintEnabled().call()
+        )
         return {
             "isEnabled": enabled,
             "baseReward": cfg[0] / PRECISION,
@@ -259,7 +261,7 @@ async def toggle_automint(enabled: bool):
             abi=COLLATERAL_VAULT_ABI
         )
         fn = vault.functions.toggleAutoMint(enabled)
-        tx_hash = send_admin_transaction(fn)
+        tx_hash = await run_in_threadpool(send_admin_transaction, fn)
         status_text = "enabled" if enabled else "disabled"
         return {"message": f"Auto-Mint has been {status_text}.", "transactionHash": tx_hash}
     except Exception as e:
@@ -288,7 +290,7 @@ async def update_automint_config(payload: AutoMintConfigPayload):
             payload.minHoldTime,
             int(payload.collateralRequirement)
         )
-        tx_hash = send_admin_transaction(fn)
+        tx_hash = await run_in_threadpool(send_admin_transaction, fn)
         return {"message": "Auto-Mint configuration updated.", "transactionHash": tx_hash}
     except Exception as e:
         raise HTTPException(
@@ -310,7 +312,7 @@ async def disable_collateral_type(request: CollateralActionRequest):
             abi=COLLATERAL_VAULT_ABI
         )
         fn = vault.functions.updateCollateralEnabled(request.collateral_address, False)
-        tx_hash = send_admin_transaction(fn)
+        tx_hash = await run_in_threadpool(send_admin_transaction, fn)
         return {"message": f"Collateral {request.collateral_address} disabled.", "transactionHash": tx_hash}
     except Exception as e:
         raise HTTPException(
@@ -1,22 +1,14 @@
 # In /backend/routes/collateral.py
 
-import os
 from fastapi import APIRouter, HTTPException
-from typing import List, Dict, Any
-from web3 import Web3
+from typing import List
 from pydantic import BaseModel
 
-from services.web3_client import get_web3_provider
-from utils.utils import load_contract_abi
+from services.collateral_registry import collateral_registry
 
 # FIX: Use a more specific prefix to avoid conflicts, and remove it from the router itself.
 router = APIRouter(tags=["Protocol Info"])
 
-COLLATERAL_VAULT_ADDRESS = os.getenv("COLLATERAL_VAULT_ADDRESS")
-COLLATERAL_VAULT_ABI = load_contract_abi("abi/CollateralVault.json")
-# Using a generic ERC20 ABI to get symbol, name, and decimals
-ERC20_ABI = load_contract_abi("abi/ERC20.json") 
-
 class CollateralInfo(BaseModel):
     address: str
     symbol: str
@@ -26,45 +18,20 @@ class CollateralInfo(BaseModel):
 @router.get("/collaterals", response_model=List[CollateralInfo])
 async def get_enabled_collaterals():
     """
-    Fetches a list of all enabled collateral tokens from the vault contract,
+    Returns all enabled collateral tokens from the collateral registry,
     including their symbol, name, and decimals.
     """
     try:
-        w3 = get_web3_provider()
-        vault_contract = w3.eth.contract(address=Web3.to_checksum_address(COLLATERAL_VAULT_ADDRESS), abi=COLLATERAL_VAULT_ABI)
-        
-        collateral_addresses = vault_contract.functions.getAllCollateralTokens().call()
-        
-        enabled_collaterals = []
-        for addr in collateral_addresses:
-            try:
-                config = vault_contract.functions.collateralConfigs(addr).call()
-                is_enabled = config[0]
-                
-                if is_enabled:
-                    token_contract = w3.eth.contract(address=addr, abi=ERC20_ABI)
-                    # Use try-except for symbol/name as some custom tokens might not have them
-                    try:
-                        symbol = token_contract.functions.symbol().call()
-                    except Exception:
-                        symbol = "N/A"
-                    try:
-                        name = token_contract.functions.name().call()
-                    except Exception:
-                        name = "Unknown Token"
-                    
-                    decimals = token_contract.functions.decimals().call()
-                    
-                    enabled_collaterals.append(CollateralInfo(
-                        address=addr,
-                        symbol=symbol,
-                        name=name,
-                        decimals=decimals
-                    ))
-            except Exception:
-                # Gracefully skip any misconfigured addresses (like price feeds)
-                continue
-                
-        return enabled_collaterals
+        collaterals = await collateral_registry.all(enabled_only=True)
+        return [
+            CollateralInfo(
+                address=collateral["address"],
+                symbol="N/A" if collateral["symbol"] is None else collateral["symbol"],
+                name="Unknown Token" if collateral["name"] is None else collateral["name"],
+                decimals=collateral["tokenDecimals"]
+            )
+            # Gracefully skip any misconfigured addresses (like price feeds)
+            for collateral in collaterals if collateral["tokenDecimals"] is not None
+        ]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch collateral list: {str(e)}")
@@ -5,7 +5,7 @@ from fastapi import APIRouter, HTTPException, status, Depends
 
 # Import the specific client and provider functions
 from services.supabase_client import get_supabase_admin_client
-from services.web3_client import get_web3_provider_with_fallback
+from services.web3_client import get_web3_provider_with_fallback, rpc_router, rpc_single_flight
 
 router = APIRouter(prefix="/health", tags=["Health Checks"])
 
@@ -42,6 +42,11 @@ async def check_web3_health():
             detail=f"Web3 provider connection failed: {str(e)}"
         )
 
+@router.get("/rpc", response_model=dict)
+async def check_rpc_router():
+    """Reports the RPC router's endpoint ranking, latencies, circuit breaker state and coalescing counts."""
+    return {**rpc_router.snapshot(), "single_flight": rpc_single_flight.snapshot()}
+
 @router.get("/env", response_model=dict)
 async def check_env_vars():
     """Verifies that all required environment variables are set."""
@@ -3,17 +3,25 @@
 import os
 import logging
 import time
+import itertools
+from math import prod
+from fractions import Fraction
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from typing import List, Dict
 from web3 import Web3
 from pydantic import BaseModel
 from decimal import Decimal
 
 # Corrected Import Paths
-from services.web3_client import get_web3_provider_with_fallback as get_web3_provider
+from services.web3_client import get_web3_provider_with_fallback as get_web3_provider, get_async_web3_provider
 from services.supabase_client import get_supabase_admin_client
 from services.oracle_service import get_eth_ghs_price
 from services.web3_service import send_admin_transaction
+from services.contract_service import MulticallReader
+from services.collateral_registry import collateral_registry
+from services.liquidation_keeper import iter_liquidatable
+from services.risk_index import risk_index, collateral_ratio, RISK_INDEX_REFRESH_INTERVAL, AT_RISK_CACHE_NAMESPACE
 from utils.utils import is_admin_user, load_contract_abi
 from fastapi_cache.decorator import cache
 
@@ -24,6 +32,9 @@ logger = logging.getLogger(__name__)
 # FIX: Removed the redundant prefix="/liquidations" from the router definition.
 router = APIRouter(tags=["Liquidations"])
 
+# Upper bound on the scenarios one stress test may evaluate
+MAX_STRESS_SCENARIOS = int(os.getenv("MAX_STRESS_SCENARIOS", "10000"))
+
 # --- Environment & ABI Loading ---
 COLLATERAL_VAULT_ADDRESS = os.getenv("COLLATERAL_VAULT_ADDRESS")
 if not COLLATERAL_VAULT_ADDRESS:
@@ -40,6 +51,24 @@ class AtRiskVault(BaseModel):
     collateralization_ratio: str
     is_liquidatable: bool
 
+class StressTestRequest(BaseModel):
+    # Each scenario maps collateral addresses to a fractional price change (-0.2 = a 20% drop);
+    # collaterals left out keep their current price.
+    scenarios: List[Dict[str, float]] = []
+    # Every combination of the listed shocks is evaluated as well
+    grid: Dict[str, List[float]] = {}
+    # Fractional change in the value of the cedi (-0.1 = a 10% devaluation), applied on top of
+    # each scenario; collateral prices are quoted in GHS, so they move inversely.
+    ghs_shocks: List[float] = [0.0]
+
+class StressScenarioResult(BaseModel):
+    shocks: Dict[str, float]
+    ghs_shock: float
+    liquidatable_positions: int
+    debt_at_risk: str
+    collateral_seized: Dict[str, str]
+    collateral_seized_value: str
+
 class LiquidationRequest(BaseModel):
     wallet_address: str
     collateral_address: str
@@ -47,65 +76,59 @@ class LiquidationRequest(BaseModel):
 # --- Liquidation Endpoints ---
 
 @router.get("/at-risk", response_model=List[AtRiskVault])
-@cache(expire=300) # Cache the results for 5 minutes
+@cache(expire=int(RISK_INDEX_REFRESH_INTERVAL), namespace=AT_RISK_CACHE_NAMESPACE) # Shared by all workers, for as long as the index is fresh
 async def get_at_risk_vaults(
     user: dict = Depends(is_admin_user),
     supabase = Depends(get_supabase_admin_client)
 ):
     """
-    Scans all user profiles with vaults and returns those eligible for liquidation.
+    Returns the vaults that are eligible for liquidation at the current collateral prices.
+    Answered from the in-memory risk index; if the index cannot be loaded, every
+    profile's positions are scanned on-chain instead.
     Handles data type conversions from on-chain uint256 to readable strings.
     """
     logger.info(f"Fetching at-risk vaults for admin user {user.get('sub')}")
     try:
-        w3 = get_web3_provider()
-        vault_contract = w3.eth.contract(address=Web3.to_checksum_address(COLLATERAL_VAULT_ADDRESS), abi=COLLATERAL_VAULT_ABI)
-        
-        profiles_res = supabase.table("profiles").select("wallet_address").neq("wallet_address", "null").execute()
-        
-        if not profiles_res.data:
-            logger.info("No profiles with wallet addresses found to scan for at-risk vaults.")
-            return []
+        configs = {collateral["address"]: collateral for collateral in await collateral_registry.all()}
+        tghsx_decimals = 6 # tGHSX has 6 decimals
+
+        try:
+            index = await risk_index.get()
+        except Exception as e:
+            logger.error(f"Risk index unavailable, scanning positions on-chain: {e}")
+            index = None
+
+        if index is not None:
+            positions = (
+                (position["wallet_address"], collateral_token_address, position["collateral_amount"], position["minted_amount"],
+                 collateral_ratio(position["collateral_amount"], position["minted_amount"], config["price"], config["decimals"]))
+                for collateral_token_address, config in configs.items()
+                for position in index.liquidatable(collateral_token_address, config["price"])
+            )
+        else:
+            w3 = await get_async_web3_provider()
+            reader = MulticallReader(w3)
+            # Profiles are streamed a page at a time, so every wallet is checked however many there are
+            positions = [
+                (wallet_address, collateral_token_address, position[0], position[1], position[3])
+                async for wallet_address, collateral_token_address, position in iter_liquidatable(reader, configs, supabase)
+            ]
 
         at_risk_vaults = []
-        all_collaterals = vault_contract.functions.getAllCollateralTokens().call()
-
-        for profile in profiles_res.data:
-            wallet_address = profile.get("wallet_address")
-            if not wallet_address:
-                continue
-
-            for collateral_token_address in all_collaterals:
-                try:
-                    position = vault_contract.functions.getUserPosition(
-                        Web3.to_checksum_address(wallet_address),
-                        Web3.to_checksum_address(collateral_token_address)
-                    ).call()
-                    
-                    is_liquidatable = position[4]
-                    if is_liquidatable:
-                        # Fetch collateral decimals for accurate conversion
-                        config = vault_contract.functions.collateralConfigs(Web3.to_checksum_address(collateral_token_address)).call()
-                        collateral_decimals = config[5]
-                        tghsx_decimals = 6 # tGHSX has 6 decimals
-
-                        # Convert uint256 values to human-readable strings
-                        collateral_amount = str(Decimal(position[0]) / Decimal(10**collateral_decimals))
-                        minted_amount = str(Decimal(position[1]) / Decimal(10**tghsx_decimals))
-                        collateral_ratio = f"{(Decimal(position[3]) / Decimal(10**6)) * 100:.2f}%"
-
-                        at_risk_vaults.append(AtRiskVault(
-                            wallet_address=wallet_address,
-                            collateral_address=collateral_token_address,
-                            collateral_amount=collateral_amount,
-                            minted_amount=minted_amount,
-                            collateralization_ratio=collateral_ratio,
-                            is_liquidatable=is_liquidatable
-                        ))
-                        logger.info(f"Found at-risk vault for wallet: {wallet_address} with collateral: {collateral_token_address}")
-                except Exception as e:
-                    logger.error(f"Could not fetch position for wallet {wallet_address} with collateral {collateral_token_address}: {str(e)}")
+        for wallet_address, collateral_token_address, collateral_amount, minted_amount, ratio in positions:
+            collateral_decimals = configs[collateral_token_address]["decimals"]
+
+            # Convert uint256 values to human-readable strings
+            at_risk_vaults.append(AtRiskVault(
+                wallet_address=wallet_address,
+                collateral_address=collateral_token_address,
+                collateral_amount=str(Decimal(collateral_amount) / Decimal(10**collateral_decimals)),
+                minted_amount=str(Decimal(minted_amount) / Decimal(10**tghsx_decimals)),
+                collateralization_ratio=f"{(Decimal(ratio) / Decimal(10**6)) * 100:.2f}%",
+                is_liquidatable=True
+            ))
         
+        logger.info(f"Found {len(at_risk_vaults)} at-risk vaults.")
         return at_risk_vaults
     except Exception as e:
         logger.error(f"A critical error occurred while retrieving at-risk vaults: {str(e)}")
@@ -114,6 +137,82 @@ async def get_at_risk_vaults(
             detail=f"Failed to retrieve at-risk vaults: {str(e)}"
         )
 
+def _shocked_price(price: int, shock: float, ghs_shock: float) -> int:
+    """The collateral's GHS price after the shocks, rounded down like the vault's own math."""
+    factor = (1 + Fraction(str(shock))) / (1 + Fraction(str(ghs_shock)))
+    return int(price * factor)
+
+@router.post("/stress-test", response_model=List[StressScenarioResult])
+async def stress_test(
+    request: StressTestRequest,
+    user: dict = Depends(is_admin_user)
+):
+    """
+    Evaluates every open position under each price-shock scenario and returns, per
+    scenario, how many positions would become liquidatable, the tGHSX debt behind
+    them and the collateral liquidation would seize. Positions come from the risk
+    index and are checked with the vault's fixed-point liquidation rule.
+    """
+    configs = {collateral["address"].lower(): collateral for collateral in await collateral_registry.all()}
+
+    if not request.ghs_shocks:
+        raise HTTPException(status_code=400, detail="At least one GHS shock is required; use [0.0] for none.")
+    # Counted before the grid is expanded, so an oversized grid is rejected without being built
+    grid_size = prod(len(shocks) for shocks in request.grid.values()) if request.grid else 0
+    if max(len(request.scenarios) + grid_size, 1) * len(request.ghs_shocks) > MAX_STRESS_SCENARIOS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_STRESS_SCENARIOS} scenarios can be evaluated at once.")
+
+    scenarios: List[Dict[str, float]] = [dict(scenario) for scenario in request.scenarios]
+    if request.grid:
+        addresses = list(request.grid)
+        scenarios.extend(dict(zip(addresses, shocks)) for shocks in itertools.product(*(request.grid[a] for a in addresses)))
+    if not scenarios:
+        scenarios = [{}]
+
+    unknown = {address for scenario in scenarios for address in scenario if address.lower() not in configs}
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown collateral addresses: {sorted(unknown)}")
+    shocks = [shock for scenario in scenarios for shock in scenario.values()] + list(request.ghs_shocks)
+    if any(shock <= -1 for shock in shocks):
+        raise HTTPException(status_code=400, detail="Shocks must be greater than -1 (a 100% drop).")
+
+    logger.info(f"Admin {user.get('sub')} running a stress test over {len(scenarios) * len(request.ghs_shocks)} scenarios")
+    try:
+        index = await risk_index.get()
+        cases = [
+            ({address.lower(): shock for address, shock in scenario.items()}, scenario, ghs_shock)
+            for ghs_shock in request.ghs_shocks for scenario in scenarios
+        ]
+        results = [
+            {"count": 0, "debt": 0, "seized": {}, "seized_value": 0}
+            for _ in cases
+        ]
+        # One vectorized pass per collateral covers every scenario
+        for address, config in configs.items():
+            prices = [_shocked_price(config["price"], shock.get(address, 0.0), ghs_shock) for shock, _, ghs_shock in cases]
+            counts, debts, seized = index.exposure(address, prices)
+            for result, price, count, debt, amount in zip(results, prices, counts, debts, seized):
+                result["count"] += int(count)
+                result["debt"] += debt
+                result["seized"][config["address"]] = str(Decimal(amount) / Decimal(10**config["decimals"]))
+                result["seized_value"] += amount * price // 10**config["decimals"]
+
+        tghsx_decimals = 6 # tGHSX has 6 decimals
+        return [
+            StressScenarioResult(
+                shocks=scenario,
+                ghs_shock=ghs_shock,
+                liquidatable_positions=result["count"],
+                debt_at_risk=str(Decimal(result["debt"]) / Decimal(10**tghsx_decimals)),
+                collateral_seized=result["seized"],
+                collateral_seized_value=str(Decimal(result["seized_value"]) / Decimal(10**tghsx_decimals)),
+            )
+            for (_, scenario, ghs_shock), result in zip(cases, results)
+        ]
+    except Exception as e:
+        logger.error(f"Stress test failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to run stress test: {str(e)}")
+
 @router.post("/liquidate", response_model=Dict[str, str])
 async def liquidate_vault(
     request: LiquidationRequest,
@@ -132,7 +231,8 @@ async def liquidate_vault(
             Web3.to_checksum_address(request.collateral_address)
         )
         
-        tx_hash = send_admin_transaction(function_call)
+        # Sending waits for the receipt, so keep it off the event loop.
+        tx_hash = await run_in_threadpool(send_admin_transaction, function_call)
         logger.info(f"Successfully submitted liquidation transaction for wallet {request.wallet_address}. Tx Hash: {tx_hash}")
         
         return {"message": "Liquidation transaction submitted successfully.", "transaction_hash": tx_hash}
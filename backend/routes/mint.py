@@ -1,6 +1,7 @@
 # In /backend/routes/mint.py
 
 import os
+import asyncio
 import uuid
 import httpx
 import time
@@ -9,7 +10,8 @@ from pydantic import BaseModel, validator
 from decimal import Decimal
 from typing import Dict, Any, List
 
-from services.web3_client import get_web3_provider
+from services.web3_client import get_async_web3_provider
+from services.collateral_registry import collateral_registry
 from services.supabase_client import get_supabase_admin_client
 from utils.utils import load_contract_abi, get_current_user, is_admin_user
 from services.web3_service import send_admin_transaction
@@ -62,10 +64,10 @@ async def send_telegram_alert(message: str):
     except Exception as e:
         print(f"!!! TELEGRAM ALERT FAILED: {e}")
 
-async def check_price_validity(vault_contract, collateral_addr: str):
+async def check_price_validity(collateral_addr: str):
     """Checks if the collateral price is recent enough."""
-    config = vault_contract.functions.collateralConfigs(collateral_addr).call()
-    last_update = config[2]  # lastPriceUpdate timestamp (uint64)
+    collateral = await collateral_registry.get(collateral_addr)
+    last_update = collateral["lastPriceUpdate"] if collateral else 0
     current_time = int(time.time())
     if current_time - last_update > 3600:  # 1 hour staleness check
         raise HTTPException(status_code=400, detail="Price data is stale. Please wait for the oracle to update.")
@@ -92,16 +94,18 @@ async def trigger_auto_mint(
     collateral_addr = Web3.to_checksum_address(payload.collateral_address)
 
     try:
-        w3 = get_web3_provider()
+        w3 = await get_async_web3_provider()
         vault_contract = w3.eth.contract(address=Web3.to_checksum_address(COLLATERAL_VAULT_ADDRESS), abi=COLLATERAL_VAULT_ABI)
         
-        await check_price_validity(vault_contract, collateral_addr)
-        
-        is_enabled = vault_contract.functions.autoMintEnabled().call()
+        # The eligibility reads are independent, so issue them concurrently.
+        _, is_enabled, mint_status = await asyncio.gather(
+            check_price_validity(collateral_addr),
+            vault_contract.functions.autoMintEnabled().call(),
+            vault_contract.functions.getUserMintStatus(user_wallet_address).call()
+        )
         if not is_enabled:
             raise HTTPException(status_code=400, detail="Auto-Minting is currently disabled by the admin.")
 
-        mint_status = vault_contract.functions.getUserMintStatus(user_wallet_address).call()
         cooldown_remaining = mint_status[3]
         if cooldown_remaining > 0:
             raise HTTPException(status_code=400, detail=f"You are in a cooldown period. Please wait {cooldown_remaining} more seconds.")
@@ -133,19 +137,20 @@ async def submit_mint_request(
     collateral_addr = Web3.to_checksum_address(payload.collateral_address)
     
     try:
-        w3 = get_web3_provider()
+        w3 = await get_async_web3_provider()
         vault_contract = w3.eth.contract(address=Web3.to_checksum_address(COLLATERAL_VAULT_ADDRESS), abi=COLLATERAL_VAULT_ABI)
         
-        await check_price_validity(vault_contract, collateral_addr)
-        
-        position = vault_contract.functions.getUserPosition(user_wallet_address, collateral_addr).call()
+        _, position, min_collateral_ratio = await asyncio.gather(
+            check_price_validity(collateral_addr),
+            vault_contract.functions.getUserPosition(user_wallet_address, collateral_addr).call(),
+            vault_contract.functions.MIN_COLLATERAL_RATIO().call()
+        )
         collateral_value = position[2] 
         current_minted_amount = position[1]
 
         new_mint_request_amount = int(payload.mint_amount * PRECISION)
         
         total_proposed_debt = current_minted_amount + new_mint_request_amount
-        min_collateral_ratio = vault_contract.functions.MIN_COLLATERAL_RATIO().call()
         
         required_collateral_value = (total_proposed_debt * min_collateral_ratio) / PRECISION
 
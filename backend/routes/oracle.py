@@ -10,14 +10,14 @@ from services.oracle_service import get_eth_ghs_price
 router = APIRouter(tags=["Oracle"])
 
 @router.get("/price", response_model=Dict[str, Any])
-def get_oracle_price():
+async def get_oracle_price():
     """
     Fetches the latest aggregated ETH/GHS price from the oracle service.
     This endpoint returns human-readable price data.
     """
     try:
         # The service now returns data in a frontend-friendly format
-        price_data = get_eth_ghs_price()
+        price_data = await get_eth_ghs_price()
         return {
             "eth_usd_price": price_data["eth_usd_price"],
             "usd_ghs_price": price_data["usd_ghs_price"],
@@ -1,6 +1,7 @@
 # In /backend/routes/protocol.py
 
 import os
+import asyncio
 import time
 import logging
 from fastapi import APIRouter, Depends, HTTPException, status
@@ -10,7 +11,9 @@ from decimal import Decimal
 from web3.exceptions import ContractLogicError
 
 # Corrected Import Paths
-from services.web3_client import get_web3_provider
+from services.web3_client import get_async_web3_provider
+from services.collateral_registry import collateral_registry
+from services.swr_cache import StaleWhileRevalidateCache
 from utils.utils import load_contract_abi
 
 router = APIRouter()
@@ -24,81 +27,95 @@ if not COLLATERAL_VAULT_ADDRESS:
 COLLATERAL_VAULT_ABI = load_contract_abi("abi/CollateralVault.json")
 ERC20_ABI = load_contract_abi("abi/ERC20.json") 
 PRECISION = 10**6
+PROTOCOL_HEALTH_TTL = int(os.getenv("PROTOCOL_HEALTH_TTL", "15"))
 
 # --- Helper Function for Price Staleness Check ---
-async def check_price_validity(vault_contract, collateral_tokens: List[str]):
+def _check_token_price(collateral: Dict[str, Any], current_time: int):
+    try:
+        if not collateral["enabled"]: # Skip disabled collaterals
+            return
+        last_update = collateral["lastPriceUpdate"]  # lastPriceUpdate is a uint64 timestamp
+        if current_time - last_update > 3600:  # 1-hour staleness check
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Price data for collateral {collateral['address']} is stale. Please try again later."
+            )
+    except Exception as e:
+        # This will catch errors for misconfigured tokens (like price feeds)
+        logger.warning(f"Could not check price validity for token {collateral['address']}. It might be misconfigured. Skipping. Error: {e}")
+
+def check_price_validity(collaterals: List[Dict[str, Any]]):
     """Checks if the prices for all collateral tokens are recent enough to be valid."""
     current_time = int(time.time())
-    for token_address in collateral_tokens:
-        try:
-            config = vault_contract.functions.collateralConfigs(Web3.to_checksum_address(token_address)).call()
-            if not config[0]: # Skip disabled collaterals
-                continue
-            last_update = config[2]  # lastPriceUpdate is a uint64 timestamp
-            if current_time - last_update > 3600:  # 1-hour staleness check
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail=f"Price data for collateral {token_address} is stale. Please try again later."
-                )
-        except Exception as e:
-            # This will catch errors for misconfigured tokens (like price feeds)
-            logger.warning(f"Could not check price validity for token {token_address}. It might be misconfigured. Skipping. Error: {e}")
-            continue
+    for collateral in collaterals:
+        _check_token_price(collateral, current_time)
+
+async def _get_collateral_value_usd(w3, collateral: Dict[str, Any]) -> Decimal:
+    """Returns the USD value of the vault's balance of one collateral token (0 if disabled or misconfigured)."""
+    try:
+        if not collateral["enabled"]: # Skip if collateral is not enabled
+            return Decimal(0)
+
+        token_contract = w3.eth.contract(address=collateral["address"], abi=ERC20_ABI)
+        vault_token_balance = await token_contract.functions.balanceOf(COLLATERAL_VAULT_ADDRESS).call()
+
+        price = Decimal(collateral["price"]) / Decimal(PRECISION)
+        token_decimals = collateral["decimals"]
+        
+        return (Decimal(vault_token_balance) / Decimal(10**token_decimals)) * price
+    except Exception as e:
+        # FIX: Gracefully handle and log errors for individual misconfigured collateral tokens
+        logger.error(f"Could not process collateral token {collateral['address']}. It might be misconfigured in the vault. Error: {e}")
+        return Decimal(0)
+
+
+async def _compute_protocol_health() -> Dict[str, Any]:
+    """Calculates aggregated health metrics for the protocol from on-chain data."""
+    w3 = await get_async_web3_provider()
+    vault_contract = w3.eth.contract(address=Web3.to_checksum_address(COLLATERAL_VAULT_ADDRESS), abi=COLLATERAL_VAULT_ABI)
+
+    # Configs and prices come from the registry; only balances and vault status need RPCs.
+    collaterals = await collateral_registry.all()
+    check_price_validity(collaterals)
+
+    status_data, collateral_values = await asyncio.gather(
+        vault_contract.functions.getVaultStatus().call(),
+        asyncio.gather(*(_get_collateral_value_usd(w3, collateral) for collateral in collaterals))
+    )
+    total_debt = Decimal(status_data[0]) / Decimal(PRECISION)
+    total_value_locked_usd = sum(collateral_values, Decimal(0))
+
+    global_collateral_ratio_percent = 0.0
+    if total_debt > 0:
+        # Assuming 1 tGHSX = 1 USD for this calculation as per original file logic
+        ratio = (total_value_locked_usd / total_debt) * 100
+        global_collateral_ratio_percent = float(ratio)
+
+    return {
+        "totalValueLockedUSD": float(total_value_locked_usd),
+        "totalDebt": float(total_debt),
+        "globalCollateralizationRatio": global_collateral_ratio_percent,
+        "isPaused": status_data[4],
+        "numberOfCollateralTypes": status_data[5]
+    }
+
+
+# Polled by every open dashboard tab, so it is served from memory and refreshed in the background.
+protocol_health_cache = StaleWhileRevalidateCache(
+    _compute_protocol_health,
+    fresh_for=PROTOCOL_HEALTH_TTL,
+    name="protocol health"
+)
 
 
 @router.get("/health", response_model=Dict[str, Any])
 async def get_protocol_health():
     """
-    Calculates and returns aggregated health metrics for the protocol.
+    Returns aggregated health metrics for the protocol.
     This is a public endpoint and does not require authentication.
     """
     try:
-        w3 = get_web3_provider()
-        vault_contract = w3.eth.contract(address=Web3.to_checksum_address(COLLATERAL_VAULT_ADDRESS), abi=COLLATERAL_VAULT_ABI)
-
-        collateral_tokens = vault_contract.functions.getAllCollateralTokens().call()
-        if collateral_tokens:
-            await check_price_validity(vault_contract, collateral_tokens)
-
-        status_data = vault_contract.functions.getVaultStatus().call()
-        total_debt = Decimal(status_data[0]) / Decimal(PRECISION)
-
-        total_value_locked_usd = Decimal(0)
-        for token_address_str in collateral_tokens:
-            try:
-                token_address = Web3.to_checksum_address(token_address_str)
-                collateral_config = vault_contract.functions.collateralConfigs(token_address).call()
-                
-                if not collateral_config[0]: # Skip if collateral is not enabled
-                    continue
-
-                token_contract = w3.eth.contract(address=token_address, abi=ERC20_ABI)
-                vault_token_balance = token_contract.functions.balanceOf(COLLATERAL_VAULT_ADDRESS).call()
-                
-                price = Decimal(collateral_config[1]) / Decimal(PRECISION)
-                token_decimals = collateral_config[5]
-                
-                collateral_value_usd = (Decimal(vault_token_balance) / Decimal(10**token_decimals)) * price
-                total_value_locked_usd += collateral_value_usd
-            except Exception as e:
-                # FIX: Gracefully handle and log errors for individual misconfigured collateral tokens
-                logger.error(f"Could not process collateral token {token_address_str}. It might be misconfigured in the vault. Error: {e}")
-                continue # Skip to the next token
-
-        global_collateral_ratio_percent = 0.0
-        if total_debt > 0:
-            # Assuming 1 tGHSX = 1 USD for this calculation as per original file logic
-            ratio = (total_value_locked_usd / total_debt) * 100
-            global_collateral_ratio_percent = float(ratio)
-
-        return {
-            "totalValueLockedUSD": float(total_value_locked_usd),
-            "totalDebt": float(total_debt),
-            "globalCollateralizationRatio": global_collateral_ratio_percent,
-            "isPaused": status_data[4],
-            "numberOfCollateralTypes": status_data[5]
-        }
-
+        return await protocol_health_cache.get()
     except HTTPException as http_exc:
         raise http_exc
     except ContractLogicError as e:
@@ -16,7 +16,8 @@ async def get_transaction_history(
     supabase = Depends(get_supabase_admin_client),
     page: int = 1,
     limit: int = 10,
-    type: str = "all" # Add type filter parameter
+    type: str = "all", # Add type filter parameter
+    finality: str = "all" # "finalized", "pending" (not yet confirmed on-chain) or "all"
 ):
     """
     Fetches a paginated transaction history for the authenticated user.
@@ -25,6 +26,8 @@ async def get_transaction_history(
     user_id = user.get("sub")
     if not user_id:
         raise HTTPException(status_code=400, detail="Could not identify user from token.")
+    if finality not in ("all", "finalized", "pending"):
+        raise HTTPException(status_code=400, detail="finality must be 'all', 'finalized' or 'pending'.")
 
     try:
         # Calculate the start and end index for the requested page
@@ -44,6 +47,10 @@ async def get_transaction_history(
         if type != "all":
             query = query.eq("event_name", type)
 
+        # Pending rows are shown immediately but may still be removed by a chain reorg
+        if finality != "all":
+            query = query.eq("status", finality)
+
         # Execute the query
         response = query.execute()
         
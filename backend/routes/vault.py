@@ -1,6 +1,8 @@
 # In /backend/routes/vault.py
 
 import os
+import asyncio
+import logging
 from datetime import datetime, timezone
 from fastapi import APIRouter, Depends, HTTPException, status
 from pydantic import BaseModel, validator
@@ -8,11 +10,15 @@ from typing import Dict, Any
 from web3 import Web3
 from decimal import Decimal
 
-from services.web3_client import get_web3_provider
+from services.web3_client import get_async_web3_provider
+from services.collateral_registry import collateral_registry
 from services.supabase_client import get_supabase_admin_client
+from services.vault_writer import user_vault_writer
+from services.vault_dirty_set import mark_dirty, ALL_COLLATERALS
 from utils.utils import get_current_user, load_contract_abi
 
 # --- Router and Environment Setup ---
+logger = logging.getLogger(__name__)
 router = APIRouter()
 COLLATERAL_VAULT_ADDRESS = os.getenv("COLLATERAL_VAULT_ADDRESS")
 if not COLLATERAL_VAULT_ADDRESS:
@@ -65,10 +71,17 @@ async def save_wallet_address(
             "wallet_address": payload.wallet_address,
             "default_collateral_address": payload.default_collateral_address
         }).execute()
-        return {"message": "Wallet address saved successfully."}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to save wallet address: {str(e)}")
 
+    try:
+        # Have the background sync pick up the wallet's positions on its next cycle
+        mark_dirty(supabase, [(payload.wallet_address, ALL_COLLATERALS)])
+    except Exception as e:
+        # The wallet is saved; the sync's cold slice reaches it without the mark
+        logger.error(f"Could not mark wallet {payload.wallet_address} for sync: {e}")
+    return {"message": "Wallet address saved successfully."}
+
 
 @router.get("/mint-status", response_model=MintStatusResponse)
 async def get_user_mint_status(
@@ -82,10 +95,10 @@ async def get_user_mint_status(
             return MintStatusResponse(dailyMinted="0", remainingDaily="0", lastMintTime=0, cooldownRemaining=0, dailyMintCount=0, remainingMints=0)
         
         user_wallet = Web3.to_checksum_address(user_res.data["wallet_address"])
-        w3 = get_web3_provider()
+        w3 = await get_async_web3_provider()
         vault_contract = w3.eth.contract(address=Web3.to_checksum_address(COLLATERAL_VAULT_ADDRESS), abi=COLLATERAL_VAULT_ABI)
         
-        status_data = vault_contract.functions.getUserMintStatus(user_wallet).call()
+        status_data = await vault_contract.functions.getUserMintStatus(user_wallet).call()
         
         return MintStatusResponse(
             dailyMinted=str(Decimal(status_data[0]) / Decimal(PRECISION)),
@@ -113,29 +126,31 @@ async def get_onchain_vault_status(
         
         user_wallet = Web3.to_checksum_address(user_res.data["wallet_address"])
         collateral_token_addr = Web3.to_checksum_address(collateral_address)
-        w3 = get_web3_provider()
+        w3 = await get_async_web3_provider()
         vault_contract = w3.eth.contract(address=Web3.to_checksum_address(COLLATERAL_VAULT_ADDRESS), abi=COLLATERAL_VAULT_ABI)
         
-        config = vault_contract.functions.collateralConfigs(collateral_token_addr).call()
-        decimals = config[5]
-        position_data = vault_contract.functions.getUserPosition(user_wallet, collateral_token_addr).call()
+        # The collateral's decimals come from the registry; only the position needs an RPC.
+        collateral, position_data = await asyncio.gather(
+            collateral_registry.get(collateral_token_addr),
+            vault_contract.functions.getUserPosition(user_wallet, collateral_token_addr).call()
+        )
+        if collateral is None:
+            raise ValueError(f"Could not read collateral config for {collateral_token_addr}")
+        decimals = collateral["decimals"]
         
         collateral_amount_readable = Decimal(position_data[0]) / Decimal(10**decimals)
         minted_amount_readable = Decimal(position_data[1]) / Decimal(PRECISION)
 
-        # --- FIX: Sync on-chain data with the user_vaults table in Supabase ---
-        # This ensures our off-chain records are always up-to-date with the blockchain state.
-        # We use upsert to create a new record if one doesn't exist, or update it if it does.
-        vault_record = {
+        # Keep user_vaults in step with the chain. The write-behind buffer drops unchanged
+        # positions and writes real changes in batches, off the request path.
+        user_vault_writer.add({
             "user_id": user_id,
             "wallet_address": user_wallet,
             "collateral_address": collateral_token_addr,
-            "eth_collateral": float(collateral_amount_readable), # Assuming a float column
-            "tghsx_minted": float(minted_amount_readable),     # Assuming a float column
+            "eth_collateral": str(collateral_amount_readable),
+            "tghsx_minted": str(minted_amount_readable),
             "last_synced": datetime.now(timezone.utc).isoformat()
-        }
-        supabase.table("user_vaults").upsert(vault_record).execute()
-        # --------------------------------------------------------------------
+        })
 
         return VaultStatusResponse(
             collateralAmount=str(collateral_amount_readable),
@@ -0,0 +1,145 @@
+# In /backend/services/cache_backend.py
+
+import os
+import time
+import asyncio
+import sqlite3
+import hashlib
+import logging
+from contextlib import closing
+from typing import Any, Callable, Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+from fastapi_cache.backends import Backend
+from fastapi_cache.backends.inmemory import InMemoryBackend
+from starlette.requests import Request
+from starlette.responses import Response
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# gunicorn runs several workers, so the response cache must live outside any one of them:
+#   redis://host:6379/0          -> Redis (or any Redis-protocol server)
+#   sqlite:////tmp/cache.sqlite3 -> SQLite file shared by all workers on one host
+#   unset / memory://            -> per-process in-memory cache (local development)
+CACHE_BACKEND_URL = os.getenv("CACHE_BACKEND_URL", "")
+
+
+class SQLiteBackend(Backend):
+    """
+    A fastapi-cache backend stored in a single SQLite file, for single-host
+    deployments without Redis. Every worker on the host opens the same file, so
+    they share one cache. Blocking sqlite3 calls run in a worker thread.
+
+    Entries set without `expire` have a NULL `expires_at` and never expire, as
+    with the other fastapi-cache backends.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with self._connect() as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            columns = conn.execute("PRAGMA table_info(cache)").fetchall()
+            if any(column[1] == "expires_at" and column[3] for column in columns):
+                # Files from before entries could be kept without expiry; it is only a cache
+                conn.execute("DROP TABLE cache")
+            conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at INTEGER)")
+
+    def _connect(self):
+        # sqlite3's own context manager only commits, so the connection is closed explicitly
+        return closing(sqlite3.connect(self.path, timeout=5))
+
+    def _get_with_ttl(self, key: str) -> Tuple[int, Optional[bytes]]:
+        now = int(time.time())
+        with self._connect() as conn, conn:
+            row = conn.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return 0, None
+            if row[1] is None:
+                return -1, row[0]
+            if row[1] < now:
+                conn.execute("DELETE FROM cache WHERE key = ? AND expires_at < ?", (key, now))
+                return 0, None
+            return row[1] - now, row[0]
+
+    def _set(self, key: str, value: bytes, expire: Optional[int]):
+        now = int(time.time())
+        expires_at = None if expire is None else now + expire
+        with self._connect() as conn, conn:
+            conn.execute("INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)", (key, value, expires_at))
+            # Expired rows are otherwise only removed when read again
+            conn.execute("DELETE FROM cache WHERE expires_at < ?", (now,))
+
+    def _clear(self, namespace: Optional[str], key: Optional[str]) -> int:
+        with self._connect() as conn, conn:
+            if namespace:
+                return conn.execute("DELETE FROM cache WHERE key LIKE ?", (f"{namespace}%",)).rowcount
+            if key:
+                return conn.execute("DELETE FROM cache WHERE key = ?", (key,)).rowcount
+        return 0
+
+    async def get_with_ttl(self, key: str) -> Tuple[int, Optional[bytes]]:
+        return await asyncio.to_thread(self._get_with_ttl, key)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return (await self.get_with_ttl(key))[1]
+
+    async def set(self, key: str, value: bytes, expire: Optional[int] = None) -> None:
+        await asyncio.to_thread(self._set, key, value, expire)
+
+    async def clear(self, namespace: Optional[str] = None, key: Optional[str] = None) -> int:
+        return await asyncio.to_thread(self._clear, namespace, key)
+
+
+def create_cache_backend(url: str = CACHE_BACKEND_URL) -> Backend:
+    """Builds the fastapi-cache backend selected by `CACHE_BACKEND_URL`."""
+    scheme = urlparse(url).scheme
+    if scheme in ("redis", "rediss", "unix"):
+        # Imported lazily so deployments without Redis do not need the client installed
+        from redis import asyncio as aioredis
+        from fastapi_cache.backends.redis import RedisBackend
+        logger.info("Using Redis cache backend.")
+        return RedisBackend(aioredis.from_url(url))
+    if scheme == "sqlite":
+        path = url[len("sqlite:///"):]
+        logger.info(f"Using SQLite cache backend at {path}.")
+        return SQLiteBackend(path)
+    if url and scheme != "memory":
+        raise ValueError(f"Unsupported CACHE_BACKEND_URL scheme: {url}")
+    return InMemoryBackend()
+
+
+# --- Cache Key Policy ---
+
+_KEY_VALUE_TYPES = (str, int, float, bool, type(None))
+
+
+def build_cache_key(
+    func: Callable[..., Any],
+    namespace: str = "",
+    *,
+    request: Optional[Request] = None,
+    response: Optional[Response] = None,
+    args: Tuple[Any, ...],
+    kwargs: Dict[str, Any],
+    per_user: bool = False,
+) -> str:
+    """
+    Builds a cache key that is identical in every worker. Only plain parameter
+    values (path/query params) are included; injected dependencies such as the
+    Supabase client would otherwise put per-process object reprs into the key.
+    With `per_user`, the authenticated user's id is included so one user's
+    response is never served to another; a route whose response depends on who
+    is asking uses `key_builder=partial(build_cache_key, per_user=True)`.
+    """
+    parts = [f"{name}={value!r}" for name, value in sorted(kwargs.items()) if isinstance(value, _KEY_VALUE_TYPES)]
+    if per_user:
+        user = next((value for value in kwargs.values() if isinstance(value, dict) and "sub" in value), None)
+        if user is None:
+            raise ValueError(f"{func.__name__} is cached per user but has no authenticated user dependency.")
+        parts.append(f"user={user['sub']}")
+    if request is not None:
+        parts.append(f"query={sorted(request.query_params.multi_items())}")
+
+    digest = hashlib.md5(":".join(parts).encode()).hexdigest()  # noqa: S324 - not used for security
+    return f"{namespace}:{func.__module__}:{func.__name__}:{digest}"
@@ -0,0 +1,219 @@
+# In /backend/services/collateral_registry.py
+
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from web3 import Web3, AsyncWeb3
+
+from services.web3_client import get_async_web3_provider
+from utils.utils import load_contract_abi
+
+# --- Environment & ABI Loading ---
+COLLATERAL_VAULT_ADDRESS = os.getenv("COLLATERAL_VAULT_ADDRESS")
+if not COLLATERAL_VAULT_ADDRESS:
+    raise RuntimeError("COLLATERAL_VAULT_ADDRESS not set in environment.")
+COLLATERAL_VAULT_ABI = load_contract_abi("abi/CollateralVault.json")
+ERC20_ABI = load_contract_abi("abi/ERC20.json")
+
+# How long cached configs are served before the registry checks the chain for changes.
+COLLATERAL_REGISTRY_TTL = float(os.getenv("COLLATERAL_REGISTRY_TTL", "15"))
+# After a failed refresh, cached configs are served for this long before the chain is tried again.
+COLLATERAL_REGISTRY_RETRY_INTERVAL = float(os.getenv("COLLATERAL_REGISTRY_RETRY_INTERVAL", "30"))
+# Beyond this many blocks since the last check, a full reload is cheaper than eth_getLogs.
+COLLATERAL_REGISTRY_MAX_LOG_RANGE = int(os.getenv("COLLATERAL_REGISTRY_MAX_LOG_RANGE", "2000"))
+
+# Events after which a collateral's config must be re-read.
+CONFIG_EVENT_TOPICS = [
+    Web3.keccak(text="CollateralConfigUpdated(address,uint128,uint32,uint8)").hex(),
+    Web3.keccak(text="PriceUpdated(address,uint128,uint128)").hex(),
+]
+
+logger = logging.getLogger(__name__)
+
+
+def config_to_entry(address: str, config) -> Dict[str, Any]:
+    return {
+        "address": address,
+        "enabled": config[0],
+        "price": config[1],
+        "lastPriceUpdate": config[2],
+        "maxLTV": config[3],
+        "liquidationBonus": config[4],
+        "decimals": config[5],
+    }
+
+
+class CollateralRegistry:
+    """
+    In-process cache of the vault's collateral list, each collateral's
+    `collateralConfigs` entry and its ERC20 metadata.
+
+    Everything is loaded once. After `ttl` seconds the next reader checks the
+    vault's `CollateralConfigUpdated` / `PriceUpdated` logs since the last check
+    and re-reads only the affected configs, so routes can read price, decimals,
+    `lastPriceUpdate` and `enabled` without any RPC on the hot path.
+
+    Listeners added with `on_price_change` are awaited with (address, old price,
+    new price) for every cached price a refresh changes, after the lock is released.
+    """
+
+    def __init__(self, ttl: float = COLLATERAL_REGISTRY_TTL, retry_interval: float = COLLATERAL_REGISTRY_RETRY_INTERVAL):
+        self.ttl = ttl
+        self.retry_interval = retry_interval
+        self._collaterals: Dict[str, Dict[str, Any]] = {}
+        self._checked_at = 0.0
+        # Monotonic time before which a failed refresh is not retried
+        self._retry_at = 0.0
+        self._last_block: Optional[int] = None
+        self._lock = asyncio.Lock()
+        self._price_listeners: List[Callable[[str, int, int], Awaitable]] = []
+
+    def on_price_change(self, listener: Callable[[str, int, int], Awaitable]):
+        self._price_listeners.append(listener)
+
+    async def _notify_price_changes(self, prices: Dict[str, int]):
+        """Calls the price listeners for every collateral whose price differs from `prices`."""
+        for address, collateral in list(self._collaterals.items()):
+            if address not in prices or prices[address] == collateral["price"]:
+                continue
+            for listener in self._price_listeners:
+                try:
+                    await listener(address, prices[address], collateral["price"])
+                except Exception as e:
+                    logger.error(f"Price change listener failed for {address}: {e}")
+
+    def _vault_contract(self, w3: AsyncWeb3):
+        return w3.eth.contract(address=Web3.to_checksum_address(COLLATERAL_VAULT_ADDRESS), abi=COLLATERAL_VAULT_ABI)
+
+    async def _read_config(self, w3: AsyncWeb3, address: str) -> Optional[Dict[str, Any]]:
+        try:
+            config = await self._vault_contract(w3).functions.collateralConfigs(address).call()
+            return config_to_entry(address, config)
+        except Exception as e:
+            # Misconfigured addresses (like price feeds) are left out of the registry
+            logger.warning(f"Could not read collateral config for {address}: {e}")
+            return None
+
+    async def _read_token_metadata(self, w3: AsyncWeb3, address: str) -> Dict[str, Any]:
+        token_contract = w3.eth.contract(address=address, abi=ERC20_ABI)
+        # Some custom tokens do not implement symbol/name, so failures are kept as None
+        symbol, name, decimals = await asyncio.gather(
+            token_contract.functions.symbol().call(),
+            token_contract.functions.name().call(),
+            token_contract.functions.decimals().call(),
+            return_exceptions=True
+        )
+        return {
+            "symbol": None if isinstance(symbol, Exception) else symbol,
+            "name": None if isinstance(name, Exception) else name,
+            "tokenDecimals": None if isinstance(decimals, Exception) else decimals,
+        }
+
+    async def _load(self, w3: AsyncWeb3):
+        """Full reload of the collateral list and every config. Token metadata is kept, as it never changes."""
+        block_number = await w3.eth.block_number
+        addresses = await self._vault_contract(w3).functions.getAllCollateralTokens().call()
+        entries = await asyncio.gather(*(self._read_config(w3, addr) for addr in addresses))
+
+        entries = [entry for entry in entries if entry is not None]
+        new_addresses = [entry["address"] for entry in entries if entry["address"] not in self._collaterals]
+        new_metadata = dict(zip(
+            new_addresses,
+            await asyncio.gather(*(self._read_token_metadata(w3, addr) for addr in new_addresses))
+        ))
+
+        collaterals = {}
+        for entry in entries:
+            address = entry["address"]
+            metadata = new_metadata.get(address) or {
+                key: self._collaterals[address][key] for key in ("symbol", "name", "tokenDecimals")
+            }
+            collaterals[address] = {**entry, **metadata}
+
+        self._collaterals = collaterals
+        self._last_block = block_number
+        logger.info(f"Collateral registry loaded {len(collaterals)} collaterals at block {block_number}")
+
+    async def _refresh(self, w3: AsyncWeb3):
+        """Applies config changes logged since the last check, falling back to a full reload."""
+        if self._last_block is None:
+            return await self._load(w3)
+
+        latest_block = await w3.eth.block_number
+        if latest_block <= self._last_block:
+            return
+        if latest_block - self._last_block > COLLATERAL_REGISTRY_MAX_LOG_RANGE:
+            return await self._load(w3)
+
+        logs = await w3.eth.get_logs({
+            "address": Web3.to_checksum_address(COLLATERAL_VAULT_ADDRESS),
+            "fromBlock": self._last_block + 1,
+            "toBlock": latest_block,
+            "topics": [CONFIG_EVENT_TOPICS],
+        })
+        affected = {Web3.to_checksum_address(log["topics"][1][-20:]) for log in logs}
+        if any(addr not in self._collaterals for addr in affected):
+            # A new collateral was added, so the token list itself has changed
+            return await self._load(w3)
+
+        entries = await asyncio.gather(*(self._read_config(w3, addr) for addr in affected))
+        for entry in entries:
+            if entry is not None:
+                self._collaterals[entry["address"]].update(entry)
+        self._last_block = latest_block
+        if affected:
+            logger.info(f"Collateral registry refreshed configs for {sorted(affected)} up to block {latest_block}")
+
+    def _is_fresh(self) -> bool:
+        now = time.monotonic()
+        return now - self._checked_at < self.ttl or (bool(self._collaterals) and now < self._retry_at)
+
+    async def ensure_fresh(self):
+        if self._is_fresh():
+            return
+        async with self._lock:
+            if self._is_fresh():
+                return
+            w3 = await get_async_web3_provider()
+            prices = {address: collateral["price"] for address, collateral in self._collaterals.items()}
+            try:
+                await self._refresh(w3)
+            except Exception as e:
+                if not self._collaterals:
+                    raise
+                # Keep serving the last known configs; the next read retries once retry_interval
+                # has passed, so requests do not queue behind one failing refresh after another
+                logger.warning(f"Collateral registry refresh failed, serving cached configs: {e}")
+                self._retry_at = time.monotonic() + self.retry_interval
+                return
+            self._checked_at = time.monotonic()
+        # Outside the lock, so listeners can read the registry
+        await self._notify_price_changes(prices)
+
+    async def all(self, enabled_only: bool = False) -> List[Dict[str, Any]]:
+        """Returns every registered collateral (in vault order), optionally only the enabled ones."""
+        await self.ensure_fresh()
+        return [c for c in self._collaterals.values() if c["enabled"] or not enabled_only]
+
+    async def get(self, collateral_address: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns the cached entry for a collateral. Addresses that are not registered
+        in the vault are read on-chain without being cached, so arbitrary user input
+        cannot grow the registry.
+        """
+        address = Web3.to_checksum_address(collateral_address)
+        await self.ensure_fresh()
+        if address in self._collaterals:
+            return self._collaterals[address]
+        return await self._read_config(await get_async_web3_provider(), address)
+
+    def peek(self, collateral_address: str) -> Optional[Dict[str, Any]]:
+        """Synchronous lookup for non-async callers; returns None unless a fresh entry is cached."""
+        if time.monotonic() - self._checked_at >= self.ttl:
+            return None
+        return self._collaterals.get(Web3.to_checksum_address(collateral_address))
+
+
+collateral_registry = CollateralRegistry()
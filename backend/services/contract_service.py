@@ -2,13 +2,17 @@
 
 import os
 import time
-from web3 import Web3
-from typing import Dict, Any
+import asyncio
+import logging
+from web3 import Web3, AsyncWeb3
+from web3._utils.abi import get_abi_output_types
+from typing import Dict, Any, List, Tuple, Iterable, Optional
 from decimal import Decimal
 from web3.exceptions import ContractLogicError
 from fastapi import HTTPException, status
 
 from services.web3_client import get_web3_provider
+from services.collateral_registry import collateral_registry, config_to_entry
 from utils.utils import load_contract_abi
 
 # --- Environment & ABI Loading ---
@@ -18,8 +22,22 @@ if not COLLATERAL_VAULT_ADDRESS:
 
 try:
     COLLATERAL_VAULT_ABI = load_contract_abi("abi/CollateralVault.json")
+    MULTICALL3_ABI = load_contract_abi("abi/Multicall3.json")
 except Exception as e:
-    raise RuntimeError(f"Failed to load CollateralVault ABI: {e}")
+    raise RuntimeError(f"Failed to load contract ABIs: {e}")
+
+# Multicall3 is deployed at the same address on Amoy and most EVM chains.
+MULTICALL3_ADDRESS = os.getenv("MULTICALL3_ADDRESS", "0xcA11bde05977b3631167028862bE2a173976CA11")
+# Number of view calls packed into a single aggregate3 request.
+MULTICALL_CHUNK_SIZE = int(os.getenv("MULTICALL_CHUNK_SIZE", "200"))
+# Number of aggregate3 requests allowed in flight at once.
+MULTICALL_CONCURRENCY = int(os.getenv("MULTICALL_CONCURRENCY", "4"))
+TGHSX_DECIMALS = 6
+
+logger = logging.getLogger(__name__)
+
+# Whether MULTICALL3_ADDRESS has code on this chain; checked once per process.
+_multicall3_deployed: Optional[bool] = None
 
 
 class OnChainContractService:
@@ -31,15 +49,22 @@ class OnChainContractService:
 
     def __init__(self):
         """Initializes the service with a Web3 provider and contract instance."""
+        # The shared provider is validated once when it is first built.
         self.w3 = get_web3_provider()
-        if not self.w3.is_connected():
-            raise ConnectionError("Failed to connect to Web3 provider.")
         self.vault_contract = self.w3.eth.contract(
             address=Web3.to_checksum_address(COLLATERAL_VAULT_ADDRESS),
             abi=COLLATERAL_VAULT_ABI
         )
         self.PRECISION = 10**6
 
+    def _get_collateral_config(self, collateral_address: str) -> Dict[str, Any]:
+        """Returns the collateral's config from the registry cache, reading it on-chain if no fresh entry exists."""
+        collateral = collateral_registry.peek(collateral_address)
+        if collateral is not None:
+            return collateral
+        address = Web3.to_checksum_address(collateral_address)
+        return config_to_entry(address, self.vault_contract.functions.collateralConfigs(address).call())
+
     # FIX: Add a proactive price staleness check
     def check_price_validity(self, collateral_address: str = None):
         """Checks if collateral prices are updated within the last hour."""
@@ -53,10 +78,10 @@ class OnChainContractService:
 
             current_time = int(time.time())
             for token in collateral_tokens_to_check:
-                config = self.vault_contract.functions.collateralConfigs(Web3.to_checksum_address(token)).call()
-                if not config[0]: # Skip disabled collaterals
+                config = self._get_collateral_config(token)
+                if not config["enabled"]: # Skip disabled collaterals
                     continue
-                last_update = config[2] # lastPriceUpdate timestamp
+                last_update = config["lastPriceUpdate"] # lastPriceUpdate timestamp
                 if current_time - last_update > 3600: # 1 hour
                     raise HTTPException(
                         status_code=status.HTTP_400_BAD_REQUEST,
@@ -82,8 +107,7 @@ class OnChainContractService:
             # FIX: Proactively check for stale prices before calling the contract
             self.check_price_validity(collateral_address)
 
-            config = self.vault_contract.functions.collateralConfigs(Web3.to_checksum_address(collateral_address)).call()
-            collateral_decimals = config[5]
+            collateral_decimals = self._get_collateral_config(collateral_address)["decimals"]
             
             position_data = self.vault_contract.functions.getUserPosition(
                 Web3.to_checksum_address(user_address),
@@ -91,14 +115,7 @@ class OnChainContractService:
             ).call()
 
             # FIX: Add unit conversions for consistency
-            return {
-                "collateralAmount": float(Decimal(position_data[0]) / Decimal(10**collateral_decimals)),
-                "mintedAmount": float(Decimal(position_data[1]) / Decimal(self.PRECISION)),
-                "collateralValue": float(Decimal(position_data[2]) / Decimal(self.PRECISION)),
-                "collateralRatio": float(Decimal(position_data[3]) / Decimal(self.PRECISION)),
-                "isLiquidatable": position_data[4],
-                "lastUpdateTime": position_data[5]
-            }
+            return format_position(position_data, collateral_decimals)
         except HTTPException as http_exc:
             raise http_exc
         # FIX: Add specific error handling for contract reverts
@@ -138,3 +155,120 @@ class OnChainContractService:
         except Exception as e:
             print(f"Error in get_global_vault_status: {e}")
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to fetch global vault status.")
+
+
+def format_position(position_data: Iterable, collateral_decimals: int) -> Dict[str, Any]:
+    """
+    Normalizes a raw `getUserPosition` tuple into the position dict returned by
+    `OnChainContractService.get_user_position`.
+    """
+    position_data = tuple(position_data)
+    return {
+        "collateralAmount": float(Decimal(position_data[0]) / Decimal(10**collateral_decimals)),
+        "mintedAmount": float(Decimal(position_data[1]) / Decimal(10**TGHSX_DECIMALS)),
+        "collateralValue": float(Decimal(position_data[2]) / Decimal(10**TGHSX_DECIMALS)),
+        "collateralRatio": float(Decimal(position_data[3]) / Decimal(10**TGHSX_DECIMALS)),
+        "isLiquidatable": position_data[4],
+        "lastUpdateTime": position_data[5]
+    }
+
+
+class MulticallReader:
+    """
+    Batched read engine for CollateralVault view calls. Calls are packed into
+    Multicall3 `aggregate3` requests of `chunk_size` calls each, so a scan over
+    thousands of (wallet, collateral) pairs costs tens of RPCs instead of one per call.
+
+    Results are decoded back into exactly what `contract.functions.X(...).call()`
+    would have returned, so callers keep their existing tuple indexing. A call that
+    reverts yields None instead of failing the whole batch.
+    """
+
+    def __init__(self, w3: AsyncWeb3, chunk_size: int = MULTICALL_CHUNK_SIZE, concurrency: int = MULTICALL_CONCURRENCY):
+        self.w3 = w3
+        self.chunk_size = chunk_size
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.vault_contract = w3.eth.contract(
+            address=Web3.to_checksum_address(COLLATERAL_VAULT_ADDRESS),
+            abi=COLLATERAL_VAULT_ABI
+        )
+        self.multicall_contract = w3.eth.contract(
+            address=Web3.to_checksum_address(MULTICALL3_ADDRESS),
+            abi=MULTICALL3_ABI
+        )
+
+    def _decode(self, fn_abi: dict, return_data: bytes) -> Any:
+        output_types = get_abi_output_types(fn_abi)
+        decoded = self.w3.codec.decode(output_types, return_data)
+        # Match web3's behaviour of unwrapping single-value outputs
+        return decoded[0] if len(decoded) == 1 else decoded
+
+    async def _call_individually(self, calls: List[Tuple[Any, str, list]], block_identifier="latest") -> List[Optional[Any]]:
+        """Fallback for chains without Multicall3 (e.g. local hardhat nodes)."""
+        async def _call(contract, fn_name, args):
+            try:
+                return await contract.get_function_by_name(fn_name)(*args).call(block_identifier=block_identifier)
+            except Exception as e:
+                logger.warning(f"View call {fn_name}{tuple(args)} failed: {e}")
+                return None
+        return list(await asyncio.gather(*(_call(*call) for call in calls)))
+
+    async def _has_multicall3(self) -> bool:
+        global _multicall3_deployed
+        if _multicall3_deployed is None:
+            _multicall3_deployed = len(await self.w3.eth.get_code(self.multicall_contract.address)) > 0
+            if not _multicall3_deployed:
+                logger.warning(f"No Multicall3 contract at {MULTICALL3_ADDRESS}; view calls are sent individually.")
+        return _multicall3_deployed
+
+    async def _aggregate_chunk(self, calls: List[Tuple[Any, str, list]], block_identifier="latest") -> List[Optional[Any]]:
+        async with self._semaphore:
+            # Only a missing Multicall3 falls back to individual calls; any other error (rate
+            # limits, timeouts, open circuits) propagates rather than multiplying the load
+            if not await self._has_multicall3():
+                return await self._call_individually(calls, block_identifier)
+            encoded = [
+                (contract.address, True, contract.encodeABI(fn_name=fn_name, args=args))
+                for contract, fn_name, args in calls
+            ]
+            results = await self.multicall_contract.functions.aggregate3(encoded).call(block_identifier=block_identifier)
+
+            decoded = []
+            for (contract, fn_name, args), (success, return_data) in zip(calls, results):
+                if not success:
+                    decoded.append(None)
+                    continue
+                try:
+                    decoded.append(self._decode(contract.get_function_by_name(fn_name).abi, return_data))
+                except Exception as e:
+                    logger.warning(f"Could not decode {fn_name}{tuple(args)} result: {e}")
+                    decoded.append(None)
+            return decoded
+
+    async def aggregate(self, calls: List[Tuple[Any, str, list]], block_identifier="latest") -> List[Optional[Any]]:
+        """
+        Executes a list of (contract, function_name, args) view calls in Multicall3
+        chunks and returns the decoded results in the same order. `block_identifier`
+        reads the state as of an earlier block.
+        """
+        chunks = [calls[i:i + self.chunk_size] for i in range(0, len(calls), self.chunk_size)]
+        chunk_results = await asyncio.gather(*(self._aggregate_chunk(chunk, block_identifier) for chunk in chunks))
+        return [result for chunk in chunk_results for result in chunk]
+
+    async def get_user_positions(self, pairs: List[Tuple[str, str]], block_identifier="latest") -> Dict[Tuple[str, str], Any]:
+        """
+        Returns {(wallet_address, collateral_address): getUserPosition tuple} for
+        every pair that could be read. Keys use the addresses exactly as passed in.
+        """
+        valid_pairs, calls = [], []
+        for wallet, collateral in pairs:
+            # A malformed address (e.g. a bad profiles.wallet_address) is left out instead of failing the scan
+            try:
+                args = [Web3.to_checksum_address(wallet), Web3.to_checksum_address(collateral)]
+            except (ValueError, TypeError) as e:
+                logger.warning(f"Skipping position read for invalid pair ({wallet}, {collateral}): {e}")
+                continue
+            valid_pairs.append((wallet, collateral))
+            calls.append((self.vault_contract, "getUserPosition", args))
+        results = await self.aggregate(calls, block_identifier)
+        return {pair: position for pair, position in zip(valid_pairs, results) if position is not None}
@@ -0,0 +1,245 @@
+# In /backend/services/event_backfill.py
+
+import argparse
+import asyncio
+import glob
+import json
+import os
+import sys
+from collections import deque
+from datetime import datetime
+from typing import Optional
+from web3 import Web3
+
+# --- Path Correction ---
+try:
+    backend_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+    if backend_path not in sys.path:
+        sys.path.insert(0, backend_path)
+except Exception as e:
+    print(f"Error adjusting system path: {e}")
+
+from services.web3_client import get_async_web3_provider, close_async_web3_provider, AMOY_CHAIN_ID
+from services.event_listener import (
+    COLLATERAL_VAULT_ADDRESS, CHECKPOINT_NAME, MAX_BLOCK_RANGE,
+    fetch_events, process_events, load_checkpoint, save_checkpoint, TransactionWriter, with_finality,
+    deferred_events,
+)
+
+# --- Configuration ---
+# Backfill progress is checkpointed separately from the live listener, so an interrupted
+# backfill can be resumed without touching the listener's position.
+BACKFILL_CHECKPOINT_NAME = f"{CHECKPOINT_NAME}_backfill"
+BACKFILL_CHUNK_SIZE = int(os.getenv("BACKFILL_CHUNK_SIZE", str(MAX_BLOCK_RANGE)))
+BACKFILL_CONCURRENCY = int(os.getenv("BACKFILL_CONCURRENCY", "4"))
+
+# The deployment records in /deployments do not store a block number, so the deploy block is
+# taken from COLLATERAL_VAULT_DEPLOY_BLOCK, a block key in the record if one is added later,
+# or located on-chain from the record's timestamp.
+DEPLOYMENTS_DIR = os.getenv("DEPLOYMENTS_DIR", os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'deployments')))
+COLLATERAL_VAULT_DEPLOY_BLOCK = os.getenv("COLLATERAL_VAULT_DEPLOY_BLOCK")
+DEPLOYMENT_BLOCK_KEYS = ("deploymentBlock", "deployBlock", "blockNumber")
+# The deploy scripts write their timestamp once every contract is deployed, so the search
+# starts this many seconds earlier to be sure the vault's creation block is included.
+DEPLOYMENT_TIMESTAMP_MARGIN = int(os.getenv("BACKFILL_DEPLOYMENT_MARGIN", "3600"))
+
+# --- Deploy Block Resolution ---
+
+def find_vault_deployments() -> list:
+    """Returns every deployment record whose CollateralVault is the configured vault."""
+    records = []
+    for path in sorted(glob.glob(os.path.join(DEPLOYMENTS_DIR, "*.json"))):
+        try:
+            with open(path) as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            continue
+        vault = (record.get("contracts") or {}).get("CollateralVault")
+        if not isinstance(vault, str) or vault.lower() != COLLATERAL_VAULT_ADDRESS.lower():
+            continue
+        if record.get("chainId", AMOY_CHAIN_ID) != AMOY_CHAIN_ID:
+            continue
+        records.append(record)
+    return records
+
+def _deployment_timestamp(record: dict) -> Optional[int]:
+    try:
+        return int(datetime.fromisoformat(str(record["timestamp"]).replace("Z", "+00:00")).timestamp())
+    except (KeyError, ValueError):
+        return None
+
+async def _first_block(low: int, high: int, predicate) -> int:
+    """Binary search for the first block in [low, high] for which the async `predicate` holds."""
+    while low < high:
+        middle = (low + high) // 2
+        if await predicate(middle):
+            high = middle
+        else:
+            low = middle + 1
+    return low
+
+async def resolve_deploy_block(w3, head: int) -> int:
+    """Finds the first block that can contain CollateralVault events."""
+    if COLLATERAL_VAULT_DEPLOY_BLOCK:
+        return int(COLLATERAL_VAULT_DEPLOY_BLOCK)
+
+    records = find_vault_deployments()
+    for record in records:
+        for key in DEPLOYMENT_BLOCK_KEYS:
+            if record.get(key) is not None:
+                return int(record[key])
+
+    timestamps = [ts for ts in map(_deployment_timestamp, records) if ts is not None]
+    if timestamps:
+        # Block headers are served by every node, so this works without an archive node
+        target = min(timestamps) - DEPLOYMENT_TIMESTAMP_MARGIN
+
+        async def mined_after_target(block_number: int) -> bool:
+            return (await w3.eth.get_block(block_number))["timestamp"] >= target
+
+        block = await _first_block(0, head, mined_after_target)
+        print(f"Deployment record timestamp {min(timestamps)} places the vault deployment after block {block}.")
+        return block
+
+    # Last resort: the first block at which the vault has code (needs historical state)
+    vault = Web3.to_checksum_address(COLLATERAL_VAULT_ADDRESS)
+
+    async def has_code(block_number: int) -> bool:
+        return len(await w3.eth.get_code(vault, block_identifier=block_number)) > 0
+
+    block = await _first_block(0, head, has_code)
+    print(f"Vault code first appears at block {block}.")
+    return block
+
+# --- Backfill ---
+
+class EventBackfill:
+    """
+    Re-ingests every CollateralVault event in a block range.
+
+    The range is split into chunks that a bounded pool of workers fetches with
+    concurrent `eth_getLogs` calls. A chunk the provider rejects (e.g. "block
+    range too large") is split in half and both halves are fetched instead, and
+    later chunks use the smaller size. Results are written strictly in block
+    order and the backfill checkpoint advances after each chunk, so a rerun
+    resumes after the last chunk that was fully written.
+
+    Events for wallets without a profile are deferred by the handler. Once the
+    last chunk is written they are retried once; those still without a profile
+    are reported as skipped and kept in `skipped`.
+    """
+
+    def __init__(self, w3, chunk_size: int = BACKFILL_CHUNK_SIZE, concurrency: int = BACKFILL_CONCURRENCY,
+                 handler=process_events, checkpoint_name: str = BACKFILL_CHECKPOINT_NAME):
+        self.w3 = w3
+        self.chunk_size = chunk_size
+        self.concurrency = concurrency
+        self.handler = handler
+        self.checkpoint_name = checkpoint_name
+        self.writer = TransactionWriter()
+        self.events_written = 0
+        self.skipped = []
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def _fetch_chunk(self, from_block: int, to_block: int) -> list:
+        async with self._semaphore:
+            try:
+                return await fetch_events(self.w3, from_block, to_block)
+            except Exception as e:
+                if from_block == to_block:
+                    raise
+                print(f"eth_getLogs for blocks {from_block}-{to_block} failed ({e}); splitting the chunk.")
+        # The halves are fetched after releasing the worker slot, so a split never waits on itself
+        middle = (from_block + to_block) // 2
+        self.chunk_size = min(self.chunk_size, max(1, middle - from_block + 1))
+        first, second = await asyncio.gather(
+            self._fetch_chunk(from_block, middle), self._fetch_chunk(middle + 1, to_block)
+        )
+        return first + second
+
+    async def run(self, from_block: int, to_block: int, head: Optional[int] = None):
+        head = to_block if head is None else head
+        print(f"Backfilling vault events for blocks {from_block}-{to_block} "
+              f"({self.concurrency} workers, chunks of {self.chunk_size} blocks)...")
+        # Up to two chunks per worker are fetched ahead of the chunk currently being written
+        pending = deque()
+        next_block = from_block
+        try:
+            while pending or next_block <= to_block:
+                while next_block <= to_block and len(pending) < 2 * self.concurrency:
+                    chunk_end = min(to_block, next_block + self.chunk_size - 1)
+                    pending.append((chunk_end, asyncio.ensure_future(self._fetch_chunk(next_block, chunk_end))))
+                    next_block = chunk_end + 1
+
+                chunk_end, task = pending.popleft()
+                events = await task
+                if events:
+                    self.writer.add(with_finality(await asyncio.to_thread(self.handler, events), head))
+                    await asyncio.to_thread(self.writer.flush)
+                    self.events_written += len(events)
+                await asyncio.to_thread(save_checkpoint, chunk_end, self.checkpoint_name)
+                print(f"Backfilled up to block {chunk_end} ({self.events_written} events so far).")
+        finally:
+            for _, task in pending:
+                task.cancel()
+        await self._resolve_deferred(head)
+
+    async def _resolve_deferred(self, head: int):
+        """Retries the events deferred for lack of a profile and reports the ones still unresolved."""
+        if not deferred_events:
+            return
+        rows = await asyncio.to_thread(deferred_events.retry)
+        if rows:
+            self.writer.add(with_finality(rows, head))
+            await asyncio.to_thread(self.writer.flush)
+        self.skipped = deferred_events.drain()
+        if self.skipped:
+            tx_hashes = sorted({event["transactionHash"].hex() for event in self.skipped})
+            print(f"Warning: Skipped {len(self.skipped)} event(s) for wallets without a user profile: {', '.join(tx_hashes)}")
+
+# --- Command Line ---
+
+async def run_backfill(from_block: Optional[int] = None, to_block: Optional[int] = None,
+                       chunk_size: int = BACKFILL_CHUNK_SIZE, concurrency: int = BACKFILL_CONCURRENCY):
+    w3 = await get_async_web3_provider()
+    try:
+        head = await w3.eth.block_number
+        to_block = head if to_block is None else to_block
+
+        if from_block is None:
+            from_block = await resolve_deploy_block(w3, head)
+            backfilled = await asyncio.to_thread(load_checkpoint, BACKFILL_CHECKPOINT_NAME)
+            if backfilled is not None and backfilled >= from_block:
+                print(f"Resuming backfill after checkpoint block {backfilled}.")
+                from_block = backfilled + 1
+
+        skipped = []
+        if from_block <= to_block:
+            backfill = EventBackfill(w3, chunk_size, concurrency)
+            await backfill.run(from_block, to_block, head)
+            skipped = backfill.skipped
+        print(f"Backfill complete up to block {to_block}"
+              + (f"; {len(skipped)} event(s) skipped for wallets without a profile." if skipped else "."))
+
+        # A listener that has never run continues from where the backfill stopped
+        if await asyncio.to_thread(load_checkpoint) is None:
+            await asyncio.to_thread(save_checkpoint, to_block)
+            print(f"Listener checkpoint set to block {to_block}.")
+    finally:
+        await close_async_web3_provider()
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill CollateralVault events from the deploy block to the chain head.")
+    parser.add_argument("--from-block", type=int, help="first block to ingest (default: the vault's deploy block, or after the last backfill checkpoint)")
+    parser.add_argument("--to-block", type=int, help="last block to ingest (default: the current head)")
+    parser.add_argument("--chunk-size", type=int, default=BACKFILL_CHUNK_SIZE, help="blocks per eth_getLogs call")
+    parser.add_argument("--concurrency", type=int, default=BACKFILL_CONCURRENCY, help="concurrent eth_getLogs calls")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(run_backfill(args.from_block, args.to_block, args.chunk_size, args.concurrency))
+    except KeyboardInterrupt:
+        print("\nBackfill stopped by user; rerun to resume from the last checkpoint.")
+
+if __name__ == "__main__":
+    main()
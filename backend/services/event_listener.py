@@ -2,10 +2,17 @@
 
 import asyncio
 import json
+import logging
 import os
 import sys
 import time
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+import websockets
 from web3 import Web3
+from web3._utils.method_formatters import log_entry_formatter
+from eth_utils import event_abi_to_log_topic
 from dotenv import load_dotenv
 
 # --- Path Correction ---
@@ -16,44 +23,321 @@ try:
 except Exception as e:
     print(f"Error adjusting system path: {e}")
 
-from services.supabase_client import get_supabase_admin_client
-from services.web3_client import get_web3_provider
+from services.supabase_client import get_supabase_admin_client, paginate_sync
+from services.web3_client import get_web3_provider, get_async_web3_provider
+from services.position_mirror import PositionMirror, POSITION_MIRROR_ENABLED
+from services.vault_dirty_set import mark_dirty, ALL_COLLATERALS
 from utils.utils import load_contract_abi
 
+logger = logging.getLogger(__name__)
+
 # --- Configuration ---
-SUPABASE_CLIENT = get_supabase_admin_client()
-W3 = get_web3_provider()
+# The Supabase client and the Web3 provider are fetched where they are used (both are cached
+# per process), so importing this module never blocks on a connection.
 COLLATERAL_VAULT_ADDRESS = os.getenv("COLLATERAL_VAULT_ADDRESS")
 COLLATERAL_VAULT_ABI = load_contract_abi("abi/CollateralVault.json")
-VAULT_CONTRACT = W3.eth.contract(address=Web3.to_checksum_address(COLLATERAL_VAULT_ADDRESS), abi=COLLATERAL_VAULT_ABI)
+# Only used to decode logs, so it needs no provider
+VAULT_CONTRACT = Web3().eth.contract(address=Web3.to_checksum_address(COLLATERAL_VAULT_ADDRESS), abi=COLLATERAL_VAULT_ABI)
+
+# --- Ingestion Configuration ---
+# FIX: Corrected event names to match CollateralVault.sol
+INGESTED_EVENTS = ["CollateralDeposited", "CollateralWithdrawn", "TokensMinted", "TokensBurned", "PositionLiquidated"]
+# Events that are fetched but not stored as transactions: the position mirror also needs
+# auto-mints, which change a position's minted amount.
+DECODED_EVENTS = INGESTED_EVENTS + ["AutoMintExecuted"]
+# Maps each event's topic0 to the contract event used to decode its logs.
+EVENTS_BY_TOPIC = {
+    "0x" + event_abi_to_log_topic(VAULT_CONTRACT.events[name]().abi).hex(): VAULT_CONTRACT.events[name]()
+    for name in DECODED_EVENTS
+}
+
+# The last fully processed block is stored in Supabase so the listener resumes exactly where it
+# stopped. Expected table: event_checkpoints (name text primary key, last_block bigint, updated_at timestamptz)
+CHECKPOINT_TABLE = "event_checkpoints"
+CHECKPOINT_NAME = "collateral_vault"
+# The block up to which the position mirror has written every change to user_vaults, so a
+# restart resumes the mirror instead of reloading every position from the chain.
+MIRROR_CHECKPOINT_NAME = "collateral_vault_mirror"
+# Without a checkpoint, ingestion starts here (defaults to the current head).
+EVENT_LISTENER_START_BLOCK = os.getenv("EVENT_LISTENER_START_BLOCK")
+
+# A poll with no new block costs one eth_blockNumber. One that finds new blocks adds an
+# eth_getLogs, the header of the range's last block (unless fetching its events' timestamps
+# already did) and, while the last ingested block is within EVENT_CONFIRMATIONS of the head,
+# that block's header to check for a reorg: at most 4 requests every 4 s (1 req/s), against
+# five filter polls every 2 s (2.5 req/s) before.
+POLL_INTERVAL = float(os.getenv("EVENT_POLL_INTERVAL", "4"))
+INITIAL_BLOCK_RANGE = int(os.getenv("EVENT_INITIAL_BLOCK_RANGE", "500"))
+MAX_BLOCK_RANGE = int(os.getenv("EVENT_MAX_BLOCK_RANGE", "2000"))
+
+# With WS_RPC_URL set, new logs are pushed over an eth_subscribe("logs") subscription and
+# range polling only runs every EVENT_WS_CHECKPOINT_INTERVAL seconds to advance the checkpoint,
+# finalize rows and check for reorgs. While the WebSocket is down, polling takes over.
+WS_RPC_URL = os.getenv("WS_RPC_URL")
+EVENT_WS_CHECKPOINT_INTERVAL = float(os.getenv("EVENT_WS_CHECKPOINT_INTERVAL", "60"))
+WS_RECONNECT_MIN_DELAY = 1
+WS_RECONNECT_MAX_DELAY = 60
+
+# Events are stored as soon as they are seen at the head, with status "pending", and marked
+# "finalized" once EVENT_CONFIRMATIONS blocks have been built on top of them. The hashes of
+# ingested blocks within that window are tracked; if one changes, the rows after the last
+# unchanged block are deleted and the range is ingested again.
+# Expected columns: transactions.block_number bigint, block_hash text, status text default 'finalized'
+EVENT_CONFIRMATIONS = int(os.getenv("EVENT_CONFIRMATIONS", "32"))
+
+# Ingested rows are buffered and upserted in batches of up to TX_WRITE_BATCH_SIZE rows, at least
+# every TX_WRITE_FLUSH_INTERVAL seconds and whenever the listener catches up with the chain head.
+# Expected unique constraint: transactions (tx_hash, log_index)
+TRANSACTIONS_TABLE = "transactions"
+TRANSACTIONS_CONFLICT_KEY = "tx_hash,log_index"
+TX_WRITE_BATCH_SIZE = int(os.getenv("TX_WRITE_BATCH_SIZE", "500"))
+TX_WRITE_FLUSH_INTERVAL = float(os.getenv("TX_WRITE_FLUSH_INTERVAL", "5"))
+
+# Wallet -> user lookups are served from memory. Profiles added since the last read are fetched
+# every WALLET_INDEX_REFRESH_INTERVAL seconds and the full list is reloaded every
+# WALLET_INDEX_FULL_RELOAD_INTERVAL seconds; events for unknown wallets are retried every
+# WALLET_RETRY_INTERVAL seconds for up to WALLET_RETRY_WINDOW seconds.
+WALLET_INDEX_REFRESH_INTERVAL = float(os.getenv("WALLET_INDEX_REFRESH_INTERVAL", "300"))
+WALLET_INDEX_FULL_RELOAD_INTERVAL = float(os.getenv("WALLET_INDEX_FULL_RELOAD_INTERVAL", "21600"))
+WALLET_RETRY_INTERVAL = float(os.getenv("WALLET_RETRY_INTERVAL", "15"))
+WALLET_RETRY_WINDOW = float(os.getenv("WALLET_RETRY_WINDOW", "600"))
+
+# Timestamps of recently ingested blocks. Headers for every distinct block in a fetched range
+# are requested concurrently (merged into JSON-RPC batches where the endpoint supports them).
+BLOCK_TIMESTAMP_CACHE_SIZE = int(os.getenv("BLOCK_TIMESTAMP_CACHE_SIZE", "10000"))
+BLOCK_PREFETCH_CHUNK_SIZE = 100
 
 # --- Helper Functions ---
 
-def get_user_id_from_wallet(wallet_address: str, retries=5, delay=2) -> str:
-    """Finds a user's ID based on their wallet address, with retries."""
-    for i in range(retries):
+class WalletIndex:
+    """
+    Lowercase wallet address -> profile id map, so resolving an event's user
+    is a dict lookup instead of an `ilike` query per event.
+
+    Every `refresh_interval` seconds only the profiles past the highest id seen
+    so far are read (`id > last id`, one keyset page for a quiet table). Wallets
+    this misses, such as a wallet saved on an existing profile, are picked up by
+    `lookup_missing`, which the deferred retry queue calls with all still-unknown
+    wallets in one query, and by the full reload every `full_reload_interval`
+    seconds, which also drops wallets that were removed.
+    """
+
+    def __init__(self, refresh_interval: float = WALLET_INDEX_REFRESH_INTERVAL,
+                 full_reload_interval: float = WALLET_INDEX_FULL_RELOAD_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self.full_reload_interval = full_reload_interval
+        self._users = {}
+        self._last_id = None
+        self._loaded_at = None
+        self._reloaded_at = None
+
+    @staticmethod
+    def _read(after=None):
+        """Returns {wallet: profile id} for the profiles with an id past `after`, and the last id read. Blocking."""
+        users, last_id = {}, after
+        for page in paginate_sync("profiles", "id, wallet_address", after=after,
+                                  filters=lambda query: query.neq("wallet_address", "null")):
+            for profile in page:
+                if profile.get("wallet_address"):
+                    users[profile["wallet_address"].lower()] = profile["id"]
+            last_id = page[-1]["id"]
+        return users, last_id
+
+    def refresh(self):
+        """Reloads every profile with a wallet address. Blocking."""
+        self._users, self._last_id = self._read()
+        self._loaded_at = self._reloaded_at = time.monotonic()
+        logger.info(f"Wallet index loaded {len(self._users)} wallets.")
+
+    def refresh_new(self):
+        """Adds the profiles created since the last read. Blocking."""
+        users, self._last_id = self._read(after=self._last_id)
+        self._users.update(users)
+        self._loaded_at = time.monotonic()
+        if users:
+            logger.info(f"Wallet index added {len(users)} new wallets.")
+
+    def _ensure_fresh(self):
+        now = time.monotonic()
+        if self._loaded_at is not None and now - self._loaded_at < self.refresh_interval:
+            return
+        try:
+            if self._reloaded_at is None or now - self._reloaded_at >= self.full_reload_interval:
+                self.refresh()
+            else:
+                self.refresh_new()
+        except Exception as e:
+            if self._loaded_at is None:
+                raise
+            logger.warning(f"Wallet index refresh failed, using the cached index: {e}")
+            self._loaded_at = time.monotonic()
+
+    def get(self, wallet_address: str):
+        """Returns the profile id for a wallet, or None if no profile is known for it. May block to refresh."""
+        self._ensure_fresh()
+        return self._users.get(wallet_address.lower())
+
+    def peek(self, wallet_address: str):
+        """Like `get`, but never queries the database; safe to call on the event loop."""
+        return self._users.get(wallet_address.lower())
+
+    def snapshot(self) -> dict:
+        """Returns a copy of the whole index (lowercase wallet -> profile id). May block to refresh."""
+        self._ensure_fresh()
+        return dict(self._users)
+
+    def lookup_missing(self, wallet_addresses: set):
+        """Looks up wallets that are not in the index with a single query and adds any that are found."""
+        wallets = sorted({wallet.lower() for wallet in wallet_addresses} - set(self._users))
+        if not wallets:
+            return
+        # ilike keeps the match case-insensitive, as wallets may be stored checksummed
+        condition = ",".join(f"wallet_address.ilike.{wallet}" for wallet in wallets)
+        response = get_supabase_admin_client().from_("profiles").select("id, wallet_address").or_(condition).execute()
+        for profile in response.data:
+            self._users[profile["wallet_address"].lower()] = profile["id"]
+
+wallet_index = WalletIndex()
+
+class DeferredEvents:
+    """
+    Events whose wallet has no profile yet (e.g. the user transacted before saving
+    their wallet in the app). Instead of blocking ingestion while waiting for the
+    profile, they are parked here and retried every `retry_interval` seconds for
+    up to `retry_window` seconds, after which they are skipped as before. Parked
+    events are only held in memory, so they are lost if the listener restarts.
+    """
+
+    def __init__(self, retry_interval: float = WALLET_RETRY_INTERVAL, retry_window: float = WALLET_RETRY_WINDOW):
+        self.retry_interval = retry_interval
+        self.retry_window = retry_window
+        self._events = []
+        self._last_retry = time.monotonic()
+
+    def __len__(self):
+        return len(self._events)
+
+    def defer(self, event: dict):
+        if not self._events:
+            self._last_retry = time.monotonic()
+        self._events.append((event, time.monotonic()))
+
+    def discard_after(self, block_number: int):
+        self._events = [(event, deferred_at) for event, deferred_at in self._events if event["blockNumber"] <= block_number]
+
+    def due(self) -> bool:
+        return bool(self._events) and time.monotonic() - self._last_retry >= self.retry_interval
+
+    def retry(self) -> list:
+        """Formats parked events whose profile now exists. Blocking."""
+        events, self._events = self._events, []
+        self._last_retry = time.monotonic()
         try:
-            response = SUPABASE_CLIENT.from_("profiles").select("id").ilike("wallet_address", wallet_address).execute()
-            if response.data:
-                return response.data[0].get("id")
+            wallet_index.lookup_missing({event["args"]["user"] for event, _ in events})
         except Exception as e:
-            print(f"Attempt {i+1}: DB query error for wallet {wallet_address}: {e}")
-        
-        print(f"Attempt {i+1}/{retries}: User for wallet {wallet_address} not found. Retrying...")
-        time.sleep(delay)
-    return None
+            print(f"DB query error while retrying {len(events)} deferred event(s): {e}")
+            self._events = events + self._events
+            return []
+
+        rows, now = [], time.monotonic()
+        for i, (event, deferred_at) in enumerate(events):
+            wallet = event["args"]["user"]
+            if wallet_index.get(wallet):
+                try:
+                    row = format_event_data(event)
+                except Exception as e:
+                    # e.g. the block timestamp fell out of the cache and could not be re-read
+                    print(f"Error formatting deferred event(s); {len(events) - i} kept for the next retry: {e}")
+                    self._events.extend(events[i:])
+                    break
+                if row:
+                    rows.append(row)
+            elif now - deferred_at < self.retry_window:
+                self._events.append((event, deferred_at))
+            else:
+                print(f"Warning: Skipping event for wallet {wallet} as no user profile was found.")
+        if rows:
+            print(f"Resolved {len(rows)} deferred event(s); {len(self._events)} still waiting for a profile.")
+        return rows
+
+    def drain(self) -> list:
+        """Removes and returns every parked event."""
+        events, self._events = [event for event, _ in self._events], []
+        return events
+
+deferred_events = DeferredEvents()
+
+class BlockTimestampCache:
+    """
+    Bounded LRU of block number -> block timestamp. The ingestion code prefetches
+    the headers of all blocks in a range before formatting its events, so
+    formatting itself never waits on `eth_getBlockByNumber`. The hashes of the
+    fetched headers are kept too, so reorg tracking can reuse them.
+    """
+
+    def __init__(self, max_size: int = BLOCK_TIMESTAMP_CACHE_SIZE):
+        self.max_size = max_size
+        self._timestamps = OrderedDict()
+        # Prefetching runs on the event loop while formatting runs in a worker thread
+        self._lock = threading.Lock()
+
+    def _get(self, block_number: int):
+        """The cached (timestamp, hash) of a block, or None."""
+        with self._lock:
+            entry = self._timestamps.get(block_number)
+            if entry is not None:
+                self._timestamps.move_to_end(block_number)
+            return entry
+
+    def put(self, block_number: int, block):
+        """Caches the timestamp and hash of a fetched block header."""
+        with self._lock:
+            self._timestamps[block_number] = (block["timestamp"], block["hash"].hex())
+            self._timestamps.move_to_end(block_number)
+            while len(self._timestamps) > self.max_size:
+                self._timestamps.popitem(last=False)
+
+    def discard_after(self, block_number: int):
+        with self._lock:
+            for number in [n for n in self._timestamps if n > block_number]:
+                del self._timestamps[number]
+
+    async def prefetch(self, w3, block_numbers):
+        """Fetches the headers of all uncached blocks concurrently."""
+        missing = sorted({n for n in block_numbers if self._get(n) is None})
+        for i in range(0, len(missing), BLOCK_PREFETCH_CHUNK_SIZE):
+            chunk = missing[i:i + BLOCK_PREFETCH_CHUNK_SIZE]
+            blocks = await asyncio.gather(*(w3.eth.get_block(n) for n in chunk))
+            for block_number, block in zip(chunk, blocks):
+                self.put(block_number, block)
+
+    def timestamp(self, block_number: int) -> int:
+        """Returns a block's timestamp, fetching the header if it was not prefetched. Blocking."""
+        entry = self._get(block_number)
+        if entry is None:
+            block = get_web3_provider().eth.get_block(block_number)
+            self.put(block_number, block)
+            return block["timestamp"]
+        return entry[0]
+
+    def block_hash(self, block_number: int):
+        """Returns a block's hash if its header has been fetched, else None."""
+        entry = self._get(block_number)
+        return entry[1] if entry is not None else None
+
+block_timestamps = BlockTimestampCache()
+
+def get_user_id_from_wallet(wallet_address: str) -> str:
+    """Finds a user's ID based on their wallet address."""
+    return wallet_index.get(wallet_address)
 
 def format_event_data(event: dict) -> dict:
     """Formats raw event data into a structured dictionary for the database."""
     event_name = event.get("event")
     tx_hash = event.get("transactionHash").hex()
     block_number = event.get("blockNumber")
-    
-    try:
-        block_info = W3.eth.get_block(block_number)
-        timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(block_info.timestamp))
-    except Exception:
-        timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+    # Errors propagate, so the range is retried instead of being stored with the wrong time
+    timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(block_timestamps.timestamp(block_number)))
 
     user_wallet = event["args"].get("user")
     if not user_wallet:
@@ -62,7 +346,8 @@ def format_event_data(event: dict) -> dict:
 
     user_id = get_user_id_from_wallet(user_wallet)
     if not user_id:
-        print(f"Warning: Skipping event for wallet {user_wallet} as no user profile was found.")
+        print(f"User for wallet {user_wallet} not found yet; deferring {event_name} event.")
+        deferred_events.defer(event)
         return None
 
     # Convert all event arguments to string for JSON serialization
@@ -71,57 +356,488 @@ def format_event_data(event: dict) -> dict:
     return {
         "user_id": user_id,
         "tx_hash": tx_hash,
+        "log_index": event.get("logIndex"),
+        "block_number": block_number,
+        "block_hash": event.get("blockHash").hex(),
         "event_name": event_name,
         "event_data": json.dumps(event_args_json),
         "block_timestamp": timestamp,
     }
 
-def save_transaction_to_db(tx_data: dict):
-    """Saves the formatted transaction data to the Supabase 'transactions' table."""
-    try:
-        SUPABASE_CLIENT.table("transactions").upsert(tx_data, on_conflict="tx_hash").execute()
-        print(f"Successfully saved event: {tx_data['event_name']} (Tx: {tx_data['tx_hash'][:10]}...)")
-    except Exception as e:
-        print(f"DATABASE ERROR: Failed to save transaction {tx_data['tx_hash']}. Reason: {e}")
+def decode_logs(logs: list) -> list:
+    """Decodes raw vault logs into web3 event dicts, in chain order."""
+    events = []
+    for log in sorted(logs, key=lambda l: (l["blockNumber"], l["logIndex"])):
+        event = EVENTS_BY_TOPIC.get(log["topics"][0].hex() if log["topics"] else None)
+        if event is not None:
+            events.append(event.process_log(log))
+    return events
 
-# --- Main Event Loop ---
+async def fetch_events(w3, from_block: int, to_block: int) -> list:
+    """
+    Fetches and decodes all ingested vault events in a block range with a single
+    eth_getLogs call, and prefetches the timestamps of the blocks they were emitted in.
+    """
+    logs = await w3.eth.get_logs({
+        "address": Web3.to_checksum_address(COLLATERAL_VAULT_ADDRESS),
+        "fromBlock": from_block,
+        "toBlock": to_block,
+        "topics": [list(EVENTS_BY_TOPIC)],
+    })
+    events = decode_logs(logs)
+    await block_timestamps.prefetch(w3, (event["blockNumber"] for event in events))
+    return events
+
+def process_events(events: list) -> list:
+    """Formats events into `transactions` rows. Blocking; run in a worker thread by the ingestion engine."""
+    rows = []
+    for event in events:
+        if event.get("event") not in INGESTED_EVENTS:
+            continue
+        print(f"-> New event detected: {event.get('event')}")
+        formatted_data = format_event_data(event)
+        if formatted_data:
+            rows.append(formatted_data)
+    return rows
+
+# --- Transaction Storage ---
+
+class TransactionWriter:
+    """
+    Buffers formatted `transactions` rows and writes them as multi-row upserts,
+    so a busy block costs one PostgREST round trip instead of one per event.
+
+    Rows are keyed by (tx_hash, log_index): a transaction that emits several
+    events (e.g. `batchLiquidate`) keeps one row per event, and re-ingesting a
+    range overwrites rows instead of duplicating them. Rows stay buffered until
+    a flush succeeds, so a failed write is retried by the next flush.
+    """
+
+    def __init__(self, batch_size: int = TX_WRITE_BATCH_SIZE, flush_interval: float = TX_WRITE_FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._rows = {}
+        self._last_flush = time.monotonic()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def add(self, rows: list):
+        for row in rows:
+            self._rows[(row["tx_hash"], row["log_index"])] = row
 
-async def log_loop(event_filter, poll_interval, event_name):
-    """The main asynchronous loop that polls for new events."""
-    print(f"Listening for '{event_name}' events...")
-    while True:
+    def discard_after(self, block_number: int):
+        """Drops buffered rows from blocks above `block_number` (e.g. orphaned by a reorg)."""
+        self._rows = {key: row for key, row in self._rows.items() if row["block_number"] <= block_number}
+
+    def due(self) -> bool:
+        return len(self._rows) >= self.batch_size or time.monotonic() - self._last_flush >= self.flush_interval
+
+    def flush(self):
+        """Upserts every buffered row in batches of `batch_size`. Blocking."""
+        while self._rows:
+            keys = list(self._rows)[:self.batch_size]
+            batch = [self._rows[key] for key in keys]
+            get_supabase_admin_client().table(TRANSACTIONS_TABLE).upsert(batch, on_conflict=TRANSACTIONS_CONFLICT_KEY).execute()
+            for key in keys:
+                self._rows.pop(key, None)
+            print(f"Saved {len(batch)} transaction row(s) up to Tx {batch[-1]['tx_hash'][:10]}...")
+        self._last_flush = time.monotonic()
+
+def finality_status(block_number: int, head: int) -> str:
+    return "finalized" if block_number <= head - EVENT_CONFIRMATIONS else "pending"
+
+def with_finality(rows: list, head: int) -> list:
+    for row in rows:
+        row["status"] = finality_status(row["block_number"], head)
+    return rows
+
+def finalize_transactions(finalized_block: int):
+    """Marks pending rows at or below `finalized_block` as finalized."""
+    get_supabase_admin_client().table(TRANSACTIONS_TABLE).update({"status": "finalized"}) \
+        .eq("status", "pending").lte("block_number", finalized_block).execute()
+
+def delete_transactions_after(block_number: int):
+    """Deletes rows from blocks above `block_number`, which a reorg has orphaned."""
+    get_supabase_admin_client().table(TRANSACTIONS_TABLE).delete().gt("block_number", block_number).execute()
+
+def transaction_pairs_after(block_number: int) -> set:
+    """The (wallet, collateral) positions named by stored rows above `block_number`. Blocking."""
+    pairs = set()
+    for page in paginate_sync(TRANSACTIONS_TABLE, "event_data", key=("tx_hash", "log_index"),
+                              filters=lambda query: query.gt("block_number", block_number)):
+        for row in page:
+            args = json.loads(row["event_data"])
+            pairs.add((args["user"].lower(), Web3.to_checksum_address(args["collateral"])))
+    return pairs
+
+def dirty_pairs(events: list) -> set:
+    """The (wallet, collateral) positions changed by a batch of events, for the vault sync."""
+    pairs = set()
+    for event in events:
+        collateral = event["args"].get("collateral")
+        # Auto-mints do not say which collateral they were minted against
+        pairs.add((event["args"]["user"], Web3.to_checksum_address(collateral) if collateral else ALL_COLLATERALS))
+    return pairs
+
+# --- Checkpoint Storage ---
+
+def load_checkpoint(name: str = CHECKPOINT_NAME):
+    """Returns the last fully processed block, or None if ingestion has never run."""
+    response = get_supabase_admin_client().table(CHECKPOINT_TABLE).select("last_block").eq("name", name).execute()
+    return response.data[0]["last_block"] if response.data else None
+
+def save_checkpoint(block_number: int, name: str = CHECKPOINT_NAME):
+    get_supabase_admin_client().table(CHECKPOINT_TABLE).upsert({
+        "name": name,
+        "last_block": block_number,
+        "updated_at": datetime.now(timezone.utc).isoformat()
+    }, on_conflict="name").execute()
+
+def delete_checkpoint(name: str):
+    get_supabase_admin_client().table(CHECKPOINT_TABLE).delete().eq("name", name).execute()
+
+# --- Ingestion Engine ---
+
+class LogIngestionEngine:
+    """
+    Ingests every CollateralVault event with one `eth_getLogs` call per block
+    range, covering all topics at once. Formatted rows are buffered in a
+    `TransactionWriter`; the checkpoint is only saved right after the buffer
+    has been flushed, so a restart resumes from the first block whose rows may
+    not have been written and nothing emitted while the listener was down is lost.
+
+    The range size adapts to the provider: it is halved whenever a query fails
+    (e.g. "block range too large" / "too many results"), and that size becomes a
+    ceiling. After each success the range doubles up to the ceiling, while the
+    ceiling itself creeps back towards `max_range`, so the engine settles just
+    under the provider's limit instead of repeatedly overshooting it.
+
+    Reorgs: the hash of every block the engine has ingested up to within
+    `confirmations` of the head is kept. Before each range, the latest one still
+    within that window is compared with the chain; on a mismatch the engine walks back to the last
+    block whose hash still matches, deletes everything stored after it and
+    ingests from there again. Block hashes are not persisted, so on startup the
+    last `confirmations` blocks before the checkpoint are rolled back the same way.
+    """
+
+    def __init__(self, w3, handler=process_events, checkpoint_name: str = CHECKPOINT_NAME,
+                 initial_range: int = INITIAL_BLOCK_RANGE, max_range: int = MAX_BLOCK_RANGE, writer=None,
+                 confirmations: int = EVENT_CONFIRMATIONS, mirror=None):
+        self.w3 = w3
+        self.handler = handler
+        self.writer = writer or TransactionWriter()
+        self.checkpoint_name = checkpoint_name
+        self.block_range = initial_range
+        self.max_range = max_range
+        self.range_ceiling = max_range
+        self.confirmations = confirmations
+        self.mirror = mirror
+        self.last_block = None
+        self.block_hashes = {}
+        # Highest block that may still have pending rows; None once all are finalized
+        self.pending_through = None
+
+    async def _load_checkpoint(self):
+        self.last_block = await asyncio.to_thread(load_checkpoint, self.checkpoint_name)
+        if self.last_block is None:
+            if EVENT_LISTENER_START_BLOCK:
+                self.last_block = int(EVENT_LISTENER_START_BLOCK) - 1
+            else:
+                self.last_block = await self.w3.eth.block_number
+            print(f"No checkpoint found; starting ingestion after block {self.last_block}.")
+        else:
+            print(f"Resuming ingestion after checkpoint block {self.last_block}.")
+            # Blocks near the checkpoint may have been reorged while the listener was down
+            rollback_block = max(0, self.last_block - self.confirmations)
+            if self.mirror is not None:
+                await self._restore_mirror(rollback_block)
+            await self._rollback(rollback_block)
+            self.pending_through = self.last_block + self.confirmations
+
+    async def _rollback(self, block_number: int):
+        """Forgets everything ingested after `block_number` and resumes ingestion from the next block."""
+        self.writer.discard_after(block_number)
+        deferred_events.discard_after(block_number)
+        block_timestamps.discard_after(block_number)
+        if self.mirror is not None:
+            self.mirror.rollback(block_number)
+        for number in [n for n in self.block_hashes if n > block_number]:
+            del self.block_hashes[number]
+        await asyncio.to_thread(delete_transactions_after, block_number)
+        # Streamed rows can be ahead of the checkpoint, which must never move forward here
+        self.last_block = min(self.last_block, block_number)
+        await asyncio.to_thread(save_checkpoint, self.last_block, self.checkpoint_name)
+        if self.mirror is not None:
+            await self._save_mirror_checkpoint()
+
+    async def _restore_mirror(self, block_number: int):
+        """
+        Resumes the position mirror from `block_number` if it had written every change
+        up to there; the positions named in the stored rows after it are re-read. Otherwise
+        the mirror is loaded in full with the first batch.
+        """
+        mirror_block = await asyncio.to_thread(load_checkpoint, MIRROR_CHECKPOINT_NAME)
+        if mirror_block is None or mirror_block < block_number:
+            print("Position mirror has no usable checkpoint; loading every position with the first batch.")
+            return
+        self.mirror.restore(block_number, await asyncio.to_thread(transaction_pairs_after, block_number))
+
+    async def _save_mirror_checkpoint(self):
+        block_number = self.mirror.written_through
+        if block_number is None:
+            await asyncio.to_thread(delete_checkpoint, MIRROR_CHECKPOINT_NAME)
+        else:
+            await asyncio.to_thread(save_checkpoint, block_number, MIRROR_CHECKPOINT_NAME)
+
+    async def _block_hash(self, block_number: int) -> str:
+        block = await self.w3.eth.get_block(block_number)
+        block_timestamps.put(block_number, block)
+        return block["hash"].hex()
+
+    async def _find_reorg(self, head: int):
+        """
+        Returns None if the latest ingested block is still canonical. Otherwise returns
+        the last tracked block that still is, or the block before the tracked window.
+        Blocks that are already `confirmations` deep are not checked.
+        """
+        tracked = sorted((n for n in self.block_hashes if n >= head - self.confirmations), reverse=True)
+        if not tracked:
+            return None
+        if await self._block_hash(tracked[0]) == self.block_hashes[tracked[0]]:
+            return None
+        for number in tracked[1:]:
+            if await self._block_hash(number) == self.block_hashes[number]:
+                return number
+        return tracked[-1] - 1
+
+    def _track_hashes(self, events: list, to_block: int, to_block_hash: str, head: int):
+        for event in events:
+            self.block_hashes[event["blockNumber"]] = event["blockHash"].hex()
+        self.block_hashes[to_block] = to_block_hash
+        for number in [n for n in self.block_hashes if n < head - self.confirmations]:
+            del self.block_hashes[number]
+
+    def _add_rows(self, rows: list, head: int):
+        self.writer.add(with_finality(rows, head))
+        pending = [row["block_number"] for row in rows if row["status"] == "pending"]
+        if pending:
+            self.pending_through = max([self.pending_through or 0] + pending)
+
+    async def _finalize(self, head: int):
+        finalized_block = head - self.confirmations
+        if self.pending_through is not None and finalized_block >= 0:
+            await asyncio.to_thread(finalize_transactions, finalized_block)
+            if finalized_block >= self.pending_through:
+                self.pending_through = None
+
+    async def fetch_range(self, from_block: int, to_block: int) -> list:
+        return await fetch_events(self.w3, from_block, to_block)
+
+    async def ingest_streamed(self, logs: list):
+        """
+        Writes logs pushed by a subscription straight away, ahead of the checkpoint.
+        The regular range ingestion still covers these blocks later (rewriting the
+        same rows), which is what advances the checkpoint, updates the position
+        mirror and checks for reorgs.
+        """
+        events = [event for event in decode_logs(logs) if event["blockNumber"] > self.last_block]
+        if not events:
+            return
+        await block_timestamps.prefetch(self.w3, (event["blockNumber"] for event in events))
+        head = max(event["blockNumber"] for event in events)
+        self._add_rows(await asyncio.to_thread(self.handler, events), head)
+        for event in events:
+            self.block_hashes[event["blockNumber"]] = event["blockHash"].hex()
+        await asyncio.to_thread(self.writer.flush)
+
+    async def poll_once(self) -> bool:
+        """Ingests the next range. Returns True if the listener has caught up with the chain head."""
+        head = await self.w3.eth.block_number
+        if deferred_events.due():
+            self._add_rows(await asyncio.to_thread(deferred_events.retry), head)
+
+        if head <= self.last_block:
+            if len(self.writer):
+                await asyncio.to_thread(self.writer.flush)
+            return True
+
+        common_ancestor = await self._find_reorg(head)
+        if common_ancestor is not None:
+            print(f"Reorg detected after block {common_ancestor}; re-ingesting from block {common_ancestor + 1}.")
+            await self._rollback(common_ancestor)
+            return False
+
+        from_block = self.last_block + 1
+        to_block = min(head, from_block + self.block_range - 1)
         try:
-            for event in event_filter.get_new_entries():
-                print(f"-> New event detected: {event.get('event')}")
-                formatted_data = format_event_data(event)
-                if formatted_data:
-                    save_transaction_to_db(formatted_data)
-            await asyncio.sleep(poll_interval)
+            events = await self.fetch_range(from_block, to_block)
+            # The header is usually already cached when the range's last block has events
+            to_block_hash = block_timestamps.block_hash(to_block) or await self._block_hash(to_block)
         except Exception as e:
-            print(f"ERROR in event loop for {event_name}: {e}. Restarting loop...")
-            await asyncio.sleep(10)
+            if self.block_range == 1:
+                raise
+            self.block_range = max(1, self.block_range // 2)
+            self.range_ceiling = self.block_range
+            print(f"eth_getLogs for blocks {from_block}-{to_block} failed ({e}); retrying with range {self.block_range}.")
+            return False
+        self.range_ceiling = min(self.max_range, self.range_ceiling + max(1, self.range_ceiling // 10))
+        self.block_range = min(self.range_ceiling, self.block_range * 2)
+
+        if events:
+            self._add_rows(await asyncio.to_thread(self.handler, events), head)
+        if self.mirror is not None:
+            await self.mirror.apply(events, to_block)
+        elif events:
+            await asyncio.to_thread(lambda: mark_dirty(get_supabase_admin_client(), dirty_pairs(events)))
+        self._track_hashes(events, to_block, to_block_hash, head)
+        self.last_block = to_block
+
+        # The checkpoint only advances once every row up to it has been written
+        caught_up = to_block >= head
+        if caught_up or self.writer.due():
+            await asyncio.to_thread(self.writer.flush)
+            await asyncio.to_thread(save_checkpoint, to_block, self.checkpoint_name)
+            if self.mirror is not None:
+                await self._save_mirror_checkpoint()
+            await self._finalize(head)
+        return caught_up
+
+    async def run(self, poll_interval: float = POLL_INTERVAL):
+        await self._load_checkpoint()
+        print(f"Listening for {', '.join(INGESTED_EVENTS)} events...")
+        while True:
+            try:
+                caught_up = await self.poll_once()
+                if caught_up:
+                    await asyncio.sleep(poll_interval)
+            except Exception as e:
+                print(f"ERROR in ingestion loop after block {self.last_block}: {e}. Retrying...")
+                await asyncio.sleep(10)
+
+# --- WebSocket Subscription ---
+
+class LogSubscription:
+    """
+    Feeds a `LogIngestionEngine` from an `eth_subscribe("logs")` WebSocket
+    subscription, so events reach the database within a moment of being mined
+    without any RPC traffic while the vault is idle.
+
+    On every (re)connect the subscription is opened first and the engine then
+    catches up from its checkpoint with `eth_getLogs`, so nothing emitted while
+    disconnected is missed. Range polling keeps running in the background: every
+    `checkpoint_interval` seconds while subscribed, and every `POLL_INTERVAL`
+    seconds while the WebSocket is down. Reconnects back off exponentially.
+    """
+
+    def __init__(self, engine: LogIngestionEngine, url: str = WS_RPC_URL,
+                 checkpoint_interval: float = EVENT_WS_CHECKPOINT_INTERVAL):
+        self.engine = engine
+        self.url = url
+        self.checkpoint_interval = checkpoint_interval
+        self.connected = False
+        self.reconnect_delay = WS_RECONNECT_MIN_DELAY
+        # Streamed logs and range polls both write through the engine, one at a time
+        self._lock = asyncio.Lock()
+
+    async def _poll_once(self) -> bool:
+        async with self._lock:
+            return await self.engine.poll_once()
+
+    async def _catch_up(self):
+        while not await self._poll_once():
+            pass
+
+    async def _poll(self):
+        last_poll = 0.0
+        while True:
+            interval = self.checkpoint_interval if self.connected else POLL_INTERVAL
+            if time.monotonic() - last_poll >= interval:
+                try:
+                    caught_up = await self._poll_once()
+                    last_poll = time.monotonic() if caught_up else 0.0
+                except Exception as e:
+                    print(f"ERROR in ingestion loop after block {self.engine.last_block}: {e}. Retrying...")
+                    await asyncio.sleep(10)
+                    continue
+            await asyncio.sleep(POLL_INTERVAL if last_poll else 0)
+
+    async def _handle_log(self, log: dict):
+        async with self._lock:
+            if log.get("removed"):
+                # The log's block was reorged out; the range is ingested again by the next poll
+                block_number = int(log["blockNumber"], 16)
+                print(f"Log in block {block_number} was removed by a reorg; rolling back.")
+                await self.engine._rollback(block_number - 1)
+            else:
+                await self.engine.ingest_streamed([log_entry_formatter(log)])
+
+    async def _stream(self):
+        async with websockets.connect(self.url, ping_interval=20, ping_timeout=20, max_size=None) as ws:
+            await ws.send(json.dumps({
+                "jsonrpc": "2.0",
+                "id": 1,
+                "method": "eth_subscribe",
+                "params": ["logs", {
+                    "address": Web3.to_checksum_address(COLLATERAL_VAULT_ADDRESS),
+                    "topics": [list(EVENTS_BY_TOPIC)],
+                }],
+            }))
+            response = json.loads(await ws.recv())
+            if "result" not in response:
+                raise ConnectionError(f"eth_subscribe failed: {response.get('error')}")
+            subscription_id = response["result"]
+            print(f"Subscribed to vault logs over {self.url}.")
+
+            # Logs pushed while catching up are queued by the connection and handled afterwards
+            await self._catch_up()
+            self.connected = True
+            self.reconnect_delay = WS_RECONNECT_MIN_DELAY
+
+            async for message in ws:
+                notification = json.loads(message)
+                params = notification.get("params") or {}
+                if notification.get("method") == "eth_subscription" and params.get("subscription") == subscription_id:
+                    await self._handle_log(params["result"])
+
+    async def run(self):
+        await self.engine._load_checkpoint()
+        print(f"Listening for {', '.join(INGESTED_EVENTS)} events...")
+        poller = asyncio.create_task(self._poll())
+        try:
+            while True:
+                try:
+                    await self._stream()
+                    print("WebSocket subscription closed.")
+                except Exception as e:
+                    print(f"WebSocket subscription failed: {e}")
+                self.connected = False
+                print(f"Polling for events; reconnecting in {self.reconnect_delay}s.")
+                await asyncio.sleep(self.reconnect_delay)
+                self.reconnect_delay = min(WS_RECONNECT_MAX_DELAY, self.reconnect_delay * 2)
+        finally:
+            poller.cancel()
+
+# --- Main Event Loop ---
+
+async def run_listener():
+    w3 = await get_async_web3_provider()
+    await asyncio.to_thread(wallet_index.refresh)
+    mirror = PositionMirror(w3, wallet_index, confirmations=EVENT_CONFIRMATIONS) if POSITION_MIRROR_ENABLED else None
+    engine = LogIngestionEngine(w3, mirror=mirror)
+    if WS_RPC_URL:
+        await LogSubscription(engine).run()
+    else:
+        await engine.run()
 
 def main():
-    """Sets up event filters and starts the listening loops."""
+    """Starts checkpointed event ingestion, streaming over WS_RPC_URL when it is set."""
+    logging.basicConfig(level=logging.INFO)
     print("Starting blockchain event listener...")
-    
-    # FIX: Corrected event names to match CollateralVault.sol
-    event_filters = {
-        "CollateralDeposited": VAULT_CONTRACT.events.CollateralDeposited.create_filter(fromBlock='latest'),
-        "CollateralWithdrawn": VAULT_CONTRACT.events.CollateralWithdrawn.create_filter(fromBlock='latest'),
-        "TokensMinted": VAULT_CONTRACT.events.TokensMinted.create_filter(fromBlock='latest'),
-        "TokensBurned": VAULT_CONTRACT.events.TokensBurned.create_filter(fromBlock='latest'),
-        "PositionLiquidated": VAULT_CONTRACT.events.PositionLiquidated.create_filter(fromBlock='latest')
-    }
-    
-    loop = asyncio.get_event_loop()
     try:
-        tasks = [log_loop(filter, 2, name) for name, filter in event_filters.items()]
-        loop.run_until_complete(asyncio.gather(*tasks))
+        asyncio.run(run_listener())
     except KeyboardInterrupt:
         print("\nListener stopped by user.")
-    finally:
-        loop.close()
 
 if __name__ == "__main__":
     main()
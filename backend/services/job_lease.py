@@ -0,0 +1,167 @@
+# In /backend/services/job_lease.py
+
+import os
+import time
+import uuid
+import fcntl
+import socket
+import asyncio
+import logging
+import tempfile
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable
+
+from services.supabase_client import get_supabase_admin_client
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# "file" coordinates the workers of one host through a lock file; "supabase" coordinates
+# every process that shares the database through a lease row, for multi-instance deploys.
+JOB_LEASE_BACKEND = os.getenv("JOB_LEASE_BACKEND", "file").lower()
+JOB_LEASE_DIR = os.getenv("JOB_LEASE_DIR", tempfile.gettempdir())
+# A lease row that has not been renewed for this many seconds is taken over by another worker.
+JOB_LEASE_TTL = float(os.getenv("JOB_LEASE_TTL", "60"))
+# How often a worker that does not own a job checks whether the lease has become free.
+JOB_LEASE_RETRY_INTERVAL = float(os.getenv("JOB_LEASE_RETRY_INTERVAL", "15"))
+# Expected table: job_leases (name text primary key, owner text, expires_at timestamptz)
+JOB_LEASE_TABLE = "job_leases"
+
+# Identifies this process as a lease owner
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class FileLease:
+    """
+    Exclusive `flock` on a per-job lock file. The kernel drops the lock when the
+    owning process exits, however it dies, so another worker on the same host
+    takes over on its next attempt. Renewal is a no-op.
+    """
+
+    def __init__(self, name: str, directory: str = JOB_LEASE_DIR):
+        self.path = os.path.join(directory, f"tghsx-job-{name}.lock")
+        self._file = None
+
+    def acquire(self) -> bool:
+        if self._file is not None:
+            return True
+        lock_file = open(self.path, "a+")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(WORKER_ID)
+        lock_file.flush()
+        self._file = lock_file
+        return True
+
+    def renew(self) -> bool:
+        return self._file is not None
+
+    def release(self):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+
+class SupabaseLease:
+    """
+    Lease row in `job_leases` with an expiry time that the owner pushes forward
+    on every renewal. Another worker may claim the row once it has expired, so
+    a dead owner is replaced within `ttl` seconds. Expiry times come from each
+    worker's clock, so hosts should be NTP-synced to well within `ttl`. Blocking.
+    """
+
+    def __init__(self, name: str, ttl: float = JOB_LEASE_TTL):
+        self.name = name
+        self.ttl = ttl
+
+    def _expiry(self) -> str:
+        return (datetime.now(timezone.utc) + timedelta(seconds=self.ttl)).isoformat()
+
+    def acquire(self) -> bool:
+        supabase = get_supabase_admin_client()
+        now = datetime.now(timezone.utc).isoformat()
+        # Take over an expired lease (or extend our own)...
+        claimed = supabase.table(JOB_LEASE_TABLE).update({"owner": WORKER_ID, "expires_at": self._expiry()}) \
+            .eq("name", self.name).or_(f'owner.eq."{WORKER_ID}",expires_at.lt."{now}"').execute()
+        if claimed.data:
+            return True
+        # ...or create it if no worker has ever held it
+        created = supabase.table(JOB_LEASE_TABLE).upsert(
+            {"name": self.name, "owner": WORKER_ID, "expires_at": self._expiry()}, on_conflict="name", ignore_duplicates=True
+        ).execute()
+        return any(row.get("owner") == WORKER_ID for row in created.data)
+
+    def renew(self) -> bool:
+        supabase = get_supabase_admin_client()
+        renewed = supabase.table(JOB_LEASE_TABLE).update({"expires_at": self._expiry()}) \
+            .eq("name", self.name).eq("owner", WORKER_ID).execute()
+        return bool(renewed.data)
+
+    def release(self):
+        get_supabase_admin_client().table(JOB_LEASE_TABLE).delete().eq("name", self.name).eq("owner", WORKER_ID).execute()
+
+
+def create_lease(name: str):
+    if JOB_LEASE_BACKEND == "supabase":
+        return SupabaseLease(name)
+    if JOB_LEASE_BACKEND == "file":
+        return FileLease(name)
+    raise ValueError(f"Unknown JOB_LEASE_BACKEND {JOB_LEASE_BACKEND!r}; expected 'file' or 'supabase'.")
+
+
+async def run_exclusive(name: str, job: Callable[[], Awaitable], lease=None,
+                        retry_interval: float = JOB_LEASE_RETRY_INTERVAL, ttl: float = JOB_LEASE_TTL):
+    """
+    Runs the periodic `job` in exactly one of the processes that call this with the
+    same `name`. Every caller competes for the job's lease; the winner runs the job
+    and renews the lease every `ttl / 3` seconds, the others retry every
+    `retry_interval` seconds. If the owner dies or cannot renew, its job is
+    cancelled and another caller takes over.
+    """
+    lease = lease or create_lease(name)
+    while True:
+        try:
+            acquired = await asyncio.to_thread(lease.acquire)
+        except Exception as e:
+            logger.error(f"Could not acquire the lease for job {name}: {e}")
+            acquired = False
+        if not acquired:
+            await asyncio.sleep(retry_interval)
+            continue
+
+        logger.info(f"Worker {WORKER_ID} owns job {name}.")
+        task = asyncio.create_task(job())
+        renewed_at = time.monotonic()
+        try:
+            while not task.done():
+                await asyncio.wait({task}, timeout=ttl / 3)
+                if task.done():
+                    break
+                try:
+                    if not await asyncio.to_thread(lease.renew):
+                        logger.warning(f"Worker {WORKER_ID} lost the lease for job {name}; stopping it.")
+                        break
+                    renewed_at = time.monotonic()
+                except Exception as e:
+                    # Keep running while the lease is still valid; another worker may claim it after that
+                    logger.error(f"Could not renew the lease for job {name}: {e}")
+                    if time.monotonic() - renewed_at >= ttl:
+                        logger.warning(f"Lease for job {name} expired; stopping it.")
+                        break
+            if task.done() and not task.cancelled() and task.exception() is not None:
+                logger.error(f"Job {name} failed: {task.exception()}")
+        finally:
+            task.cancel()
+            # Let the job unwind before another worker can take over, so two copies never overlap
+            await asyncio.gather(task, return_exceptions=True)
+            try:
+                await asyncio.to_thread(lease.release)
+            except Exception as e:
+                logger.error(f"Could not release the lease for job {name}: {e}")
+        await asyncio.sleep(retry_interval)
@@ -0,0 +1,116 @@
+# In /backend/services/liquidation_keeper.py
+
+import os
+import asyncio
+import logging
+from fractions import Fraction
+from typing import AsyncIterator, Dict, List, Tuple
+from web3 import Web3
+
+from services.supabase_client import paginate
+from services.web3_client import get_async_web3_provider, get_web3_provider_with_fallback as get_web3_provider
+from services.web3_service import send_admin_transaction
+from services.contract_service import MulticallReader, COLLATERAL_VAULT_ADDRESS, COLLATERAL_VAULT_ABI
+from services.collateral_registry import collateral_registry
+from services.rpc_router import RateBudget, rpc_budget
+from services.risk_index import risk_index
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+KEEPER_INTERVAL = float(os.getenv("KEEPER_INTERVAL", "300"))
+# Candidates come from the risk index, which is built from user_vaults and so can lag the
+# chain; positions within this fraction of their liquidation price are re-read as well.
+KEEPER_PRICE_MARGIN = float(os.getenv("KEEPER_PRICE_MARGIN", "0.05"))
+# Requests per second the keeper may send to each RPC endpoint (0 = unlimited)
+KEEPER_RPC_RPS = float(os.getenv("KEEPER_RPC_RPS", "2"))
+# Multicall3 requests in flight while scanning positions
+KEEPER_CONCURRENCY = int(os.getenv("KEEPER_CONCURRENCY", "2"))
+# Off by default: the keeper only reports liquidatable positions. When enabled, it liquidates
+# them one at a time from the admin account (admin transactions share one nonce sequence).
+KEEPER_AUTO_LIQUIDATE = os.getenv("KEEPER_AUTO_LIQUIDATE", "false").lower() == "true"
+
+
+async def iter_liquidatable(reader: MulticallReader, configs: Dict[str, dict], supabase=None) -> AsyncIterator[Tuple[str, str, tuple]]:
+    """
+    Yields (wallet, collateral, getUserPosition tuple) for every liquidatable
+    position of a wallet with a profile. Profiles are streamed a page at a time
+    and each page's positions are read in batched Multicall3 requests.
+    """
+    async for profiles in paginate("profiles", "wallet_address", filters=lambda query: query.neq("wallet_address", "null"), client=supabase):
+        pairs = [
+            (profile["wallet_address"], collateral_address)
+            for profile in profiles if profile.get("wallet_address")
+            for collateral_address in configs
+        ]
+        positions = await reader.get_user_positions(pairs)
+        for wallet_address, collateral_address in pairs:
+            position = positions.get((wallet_address, collateral_address))
+            if position is None:
+                logger.error(f"Could not fetch position for wallet {wallet_address} with collateral {collateral_address}")
+                continue
+            if position[4]:
+                yield wallet_address, collateral_address, position
+
+
+def liquidation_candidates(index, configs: Dict[str, dict], margin: float = KEEPER_PRICE_MARGIN) -> List[Tuple[str, str]]:
+    """
+    (wallet, collateral) pairs the risk index places at or near liquidation: those that
+    would be liquidatable if each collateral's price were `margin` higher. Each is one
+    binary search over the index's liquidation-price ordering.
+    """
+    factor = 1 + Fraction(str(margin))
+    return [
+        (position["wallet_address"], address)
+        for address, config in configs.items()
+        for position in index.liquidatable(address, int(config["price"] * factor))
+    ]
+
+
+def _liquidate(wallet_address: str, collateral_address: str) -> str:
+    w3 = get_web3_provider()
+    vault_contract = w3.eth.contract(address=Web3.to_checksum_address(COLLATERAL_VAULT_ADDRESS), abi=COLLATERAL_VAULT_ABI)
+    function_call = vault_contract.functions.liquidate(
+        Web3.to_checksum_address(wallet_address), Web3.to_checksum_address(collateral_address)
+    )
+    return send_admin_transaction(function_call)
+
+
+async def run_liquidation_keeper(interval: float = KEEPER_INTERVAL, auto_liquidate: bool = KEEPER_AUTO_LIQUIDATE):
+    """
+    Checks for liquidatable positions every `interval` seconds, liquidating them if
+    enabled. Only the candidates from the risk index are read on-chain, under a
+    KEEPER_RPC_RPS budget, so a pass costs RPCs per position near liquidation
+    rather than per profile and collateral.
+    """
+    rpc_budget.set(RateBudget(KEEPER_RPC_RPS))
+    while True:
+        w3 = await get_async_web3_provider()
+        reader = MulticallReader(w3, concurrency=KEEPER_CONCURRENCY)
+        configs = {collateral["address"]: collateral for collateral in await collateral_registry.all()}
+        candidates = liquidation_candidates(await risk_index.get(), configs)
+        positions = await reader.get_user_positions(candidates) if candidates else {}
+
+        found = liquidated = 0
+        for wallet_address, collateral_address in candidates:
+            position = positions.get((wallet_address, collateral_address))
+            if position is None:
+                logger.error(f"Could not fetch position for wallet {wallet_address} with collateral {collateral_address}")
+                continue
+            if not position[4]:
+                continue
+            found += 1
+            logger.warning(f"Liquidatable position: wallet {wallet_address}, collateral {collateral_address}, "
+                           f"collateral {position[0]}, minted {position[1]}, ratio {position[3]}")
+            if not auto_liquidate:
+                continue
+            try:
+                # Sending waits for the receipt, so keep it off the event loop
+                tx_hash = await asyncio.to_thread(_liquidate, wallet_address, collateral_address)
+                liquidated += 1
+                logger.info(f"Keeper liquidated wallet {wallet_address}, collateral {collateral_address}: {tx_hash}")
+            except Exception as e:
+                logger.error(f"Keeper could not liquidate wallet {wallet_address}, collateral {collateral_address}: {e}")
+
+        logger.info(f"Keeper checked {len(candidates)} candidates and found {found} liquidatable positions; {liquidated} liquidated.")
+        await asyncio.sleep(interval)
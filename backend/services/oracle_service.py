@@ -4,14 +4,15 @@ import os
 import time
 import httpx
 import asyncio
-from web3 import Web3
-from web3.contract import Contract
+from web3 import Web3, AsyncWeb3
+from web3.contract import AsyncContract
 from typing import Dict, Any
 from decimal import Decimal
 import backoff
 from web3.exceptions import ContractLogicError
 
-from services.web3_client import get_web3_provider
+from services.web3_client import get_async_web3_provider
+from services.swr_cache import StaleWhileRevalidateCache, PRICE_VALIDITY_PERIOD
 from utils.utils import load_contract_abi
 
 # --- Environment & ABI Loading ---
@@ -25,7 +26,8 @@ if not ETH_USD_PRICE_FEED_ADDRESS or not Web3.is_address(ETH_USD_PRICE_FEED_ADDR
     raise RuntimeError("Invalid or missing CHAINLINK_ETH_USD_PRICE_FEED_ADDRESS")
 
 # --- In-memory Cache ---
-price_cache: Dict[str, Any] = {}
+# The last good price is served from memory and refreshed in the background once it is
+# older than CACHE_TTL; it is never served once the feed data is older than 1 hour.
 CACHE_TTL = 60
 
 # --- ABI Loading ---
@@ -35,16 +37,19 @@ except Exception as e:
     raise RuntimeError(f"CRITICAL ERROR loading AggregatorV3Interface ABI: {e}")
 
 # --- Helper Functions ---
-def get_price_feed_contract(w3: Web3, address: str) -> Contract:
+def get_price_feed_contract(w3: AsyncWeb3, address: str) -> AsyncContract:
     return w3.eth.contract(address=Web3.to_checksum_address(address), abi=AGGREGATOR_V3_ABI)
 
 @backoff.on_exception(backoff.expo, (ContractLogicError, ConnectionError), max_tries=3)
-def fetch_latest_price(price_feed_contract: Contract) -> Dict[str, int]:
-    round_data = price_feed_contract.functions.latestRoundData().call()
+async def fetch_latest_price(price_feed_contract: AsyncContract) -> Dict[str, int]:
+    round_data, decimals = await asyncio.gather(
+        price_feed_contract.functions.latestRoundData().call(),
+        price_feed_contract.functions.decimals().call()
+    )
     price, timestamp = round_data[1], round_data[3]
     if price <= 0: raise ValueError("Price feed returned non-positive price.")
-    if time.time() - timestamp > 3600: raise ValueError("Price feed data is stale.")
-    return {"price": price, "timestamp": timestamp, "decimals": price_feed_contract.functions.decimals().call()}
+    if time.time() - timestamp > PRICE_VALIDITY_PERIOD: raise ValueError("Price feed data is stale.")
+    return {"price": price, "timestamp": timestamp, "decimals": decimals}
 
 async def get_usd_ghs_from_cmc() -> Dict[str, Any]:
     """Fallback to CoinMarketCap if Chainlink feed is unavailable."""
@@ -73,41 +78,47 @@ async def get_usd_ghs_from_cmc() -> Dict[str, Any]:
             "decimals": 8
         }
 
-def get_eth_ghs_price() -> Dict[str, Any]:
-    cache_key = "eth_ghs_price"
-    if cache_key in price_cache and (time.time() - price_cache[cache_key].get("fetch_time", 0)) < CACHE_TTL:
-        return price_cache[cache_key]["data"]
-
-    w3 = get_web3_provider()
+async def _fetch_eth_ghs_price() -> Dict[str, Any]:
+    w3 = await get_async_web3_provider()
     try:
         eth_usd_contract = get_price_feed_contract(w3, ETH_USD_PRICE_FEED_ADDRESS)
-        eth_usd_data = fetch_latest_price(eth_usd_contract)
+        eth_usd_data = await fetch_latest_price(eth_usd_contract)
         
         usd_ghs_data = None
         if USD_GHS_PRICE_FEED_ADDRESS and Web3.is_address(USD_GHS_PRICE_FEED_ADDRESS):
             try:
                 usd_ghs_contract = get_price_feed_contract(w3, USD_GHS_PRICE_FEED_ADDRESS)
-                usd_ghs_data = fetch_latest_price(usd_ghs_contract)
+                usd_ghs_data = await fetch_latest_price(usd_ghs_contract)
             except Exception as e:
                 print(f"Chainlink USD/GHS feed failed: {e}. Falling back to CoinMarketCap.")
         
         if not usd_ghs_data:
-            usd_ghs_data = asyncio.run(get_usd_ghs_from_cmc())
+            usd_ghs_data = await get_usd_ghs_from_cmc()
 
         eth_usd_price = Decimal(eth_usd_data['price']) / Decimal(10 ** eth_usd_data['decimals'])
         usd_ghs_price = Decimal(usd_ghs_data['price']) / Decimal(10 ** usd_ghs_data['decimals'])
         eth_ghs_price = eth_usd_price * usd_ghs_price
         
-        result = {
+        return {
             "eth_ghs_price": float(eth_ghs_price),
             "eth_usd_price": float(eth_usd_price),
             "usd_ghs_price": float(usd_ghs_price),
             "timestamp": max(eth_usd_data['timestamp'], usd_ghs_data['timestamp']),
+            # The combined price is only as fresh as its oldest input
+            "oldest_timestamp": min(eth_usd_data['timestamp'], usd_ghs_data['timestamp']),
             "decimals": eth_usd_data['decimals']
         }
-
-        price_cache[cache_key] = {"data": result, "fetch_time": time.time()}
-        return result
     except Exception as e:
         print(f"CRITICAL: Could not calculate ETH/GHS price. Error: {e}")
         raise
+
+eth_ghs_price_cache = StaleWhileRevalidateCache(
+    _fetch_eth_ghs_price,
+    fresh_for=CACHE_TTL,
+    timestamp_of=lambda price_data: price_data["oldest_timestamp"],
+    name="ETH/GHS price"
+)
+
+async def get_eth_ghs_price() -> Dict[str, Any]:
+    """Returns the latest ETH/GHS price from memory, refreshing it in the background when due."""
+    return await eth_ghs_price_cache.get()
@@ -0,0 +1,270 @@
+# In /backend/services/position_mirror.py
+
+import os
+import time
+import random
+import asyncio
+import logging
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Dict, Iterable, List, Set, Tuple
+from web3 import Web3, AsyncWeb3
+
+from services.vault_writer import user_vault_writer
+from services.contract_service import MulticallReader, TGHSX_DECIMALS
+from services.collateral_registry import collateral_registry
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# When enabled, the event listener keeps `user_vaults` current from vault events and the web
+# app no longer runs the hourly full sync (tasks.sync_user_vaults).
+POSITION_MIRROR_ENABLED = os.getenv("POSITION_MIRROR_ENABLED", "false").lower() == "true"
+# Every POSITION_MIRROR_RECONCILE_INTERVAL seconds, this many mirrored positions are re-read
+# on-chain and compared with the mirror.
+POSITION_MIRROR_RECONCILE_INTERVAL = float(os.getenv("POSITION_MIRROR_RECONCILE_INTERVAL", "900"))
+POSITION_MIRROR_RECONCILE_SAMPLE = int(os.getenv("POSITION_MIRROR_RECONCILE_SAMPLE", "100"))
+
+# (collateral, minted) direction of each event's `amount`
+EVENT_DELTAS = {
+    "CollateralDeposited": (1, 0),
+    "CollateralWithdrawn": (-1, 0),
+    "TokensMinted": (0, 1),
+    "TokensBurned": (0, -1),
+}
+
+Pair = Tuple[str, str]
+
+
+class PositionMirror:
+    """
+    In-process copy of the vault positions of every wallet with a profile, kept
+    current by applying CollateralVault events in chain order and written through
+    to `user_vaults`, so syncing costs work per event instead of per user.
+
+    - Deposits, withdrawals, mints and burns are applied as deltas; a liquidation
+      clears the position.
+    - `AutoMintExecuted` does not name its collateral, and a wallet the mirror has
+      never seen has no base to apply a delta to; those positions are re-read with
+      `getUserPosition` as of the last block of the batch instead.
+    - The pairs changed in each of the last `confirmations` blocks are tracked.
+      After a reorg within that window, only those pairs are dropped and re-read
+      once the canonical blocks are applied; a deeper reorg reloads the mirror.
+    - On restart, `restore` resumes from the block the mirror had written through,
+      so only the positions named in the rolled-back blocks, and those changed from
+      then on, are re-read instead of reloading every position. Auto-mints are not
+      stored, so one orphaned while the listener was down is only corrected when
+      its wallet's positions are next re-read.
+    - Every `reconcile_interval` seconds a random sample of positions is re-read
+      and compared with the mirror; any drift is logged and corrected.
+
+    Amounts are kept as raw on-chain integers; `user_vaults` gets the same decimal
+    strings the hourly sync wrote, through the same write buffer. A position whose
+    collateral decimals cannot be read stays unwritten until they can.
+
+    `load`, `_read` and `reconcile` call `getUserPosition` at the batch's block
+    rather than "latest". While the listener is catching up that block can be far
+    behind the head, so the RPC endpoints must serve historical state (an archive
+    node) for the mirror to load or re-read positions.
+    """
+
+    def __init__(self, w3: AsyncWeb3, wallets, confirmations: int = 0,
+                 reconcile_interval: float = POSITION_MIRROR_RECONCILE_INTERVAL,
+                 reconcile_sample: int = POSITION_MIRROR_RECONCILE_SAMPLE):
+        self.w3 = w3
+        # The listener's WalletIndex: lowercase wallet -> profile id
+        self.wallets = wallets
+        self.reader = MulticallReader(w3)
+        self.confirmations = confirmations
+        self.reconcile_interval = reconcile_interval
+        self.reconcile_sample = reconcile_sample
+        self.positions: Dict[Pair, List[int]] = {}
+        # Every vault event up to and including this block has been applied
+        self.block = None
+        self.drift_corrections = 0
+        self._unwritten = set()
+        # Pairs changed in each recent block, known for every block from `_tracked_from` on
+        self._touched: Dict[int, Set[Pair]] = {}
+        self._tracked_from = None
+        # Pairs to re-read with the next batch, whatever its events
+        self._stale: Set[Pair] = set()
+        self._last_reconcile = time.monotonic()
+
+    async def _collateral_addresses(self) -> List[str]:
+        return [collateral["address"] for collateral in await collateral_registry.all()]
+
+    async def _read(self, pairs: List[Pair], block_number: int) -> Dict[Pair, List[int]]:
+        positions = await self.reader.get_user_positions(pairs, block_identifier=block_number)
+        return {pair: [position[0], position[1]] for pair, position in positions.items()}
+
+    async def load(self, block_number: int):
+        """Reads every (profile wallet, collateral) position as of `block_number`."""
+        wallets = await asyncio.to_thread(self.wallets.snapshot)
+        collaterals = await self._collateral_addresses()
+        pairs = [(wallet, collateral) for wallet in wallets for collateral in collaterals]
+        self.positions = await self._read(pairs, block_number)
+        self.block = block_number
+        self._touched, self._tracked_from, self._stale = {}, block_number + 1, set()
+        logger.info(f"Position mirror loaded {len(self.positions)} positions at block {block_number}.")
+        await self._write(self.positions)
+
+    def reset(self):
+        """Discards the mirrored state; it is reloaded on the next batch."""
+        self.block = None
+
+    def restore(self, block_number: int, pairs: Iterable[Pair]):
+        """
+        Resumes after a restart from `block_number`, up to which `user_vaults` holds
+        every mirrored position. Positions are re-read as events touch them, and
+        `pairs` (those named in rolled-back blocks) with the next batch.
+        """
+        self.positions = {}
+        self.block = block_number
+        self._touched, self._tracked_from, self._stale = {}, block_number + 1, set(pairs)
+
+    @property
+    def written_through(self):
+        """The block up to which every mirrored change is in `user_vaults`, or None."""
+        return None if self._unwritten else self.block
+
+    def rollback(self, block_number: int):
+        """
+        Undoes the blocks after `block_number` (e.g. after a reorg): the pairs they
+        changed are dropped and re-read with the next batch. Reloads the mirror if
+        those blocks are older than the tracked window.
+        """
+        if self.block is None or block_number >= self.block:
+            return
+        if block_number + 1 < self._tracked_from:
+            logger.warning(f"Rollback to block {block_number} is older than the position mirror's window; reloading it.")
+            return self.reset()
+        for number in [n for n in self._touched if n > block_number]:
+            for pair in self._touched.pop(number):
+                self.positions.pop(pair, None)
+                self._stale.add(pair)
+        self.block = block_number
+
+    async def apply(self, events: list, through_block: int):
+        """Applies a batch of decoded vault events covering every block up to `through_block`."""
+        if self.block is None:
+            return await self.load(through_block)
+        if through_block <= self.block:
+            return
+
+        # Deltas are applied to copies and committed only once the stale reads have
+        # succeeded, so a batch that fails part-way can be retried without applying
+        # any of its events twice.
+        updated: Dict[Pair, List[int]] = {}
+        changed, stale = set(), set(self._stale)
+        touched: Dict[int, Set[Pair]] = {}
+        collaterals = None
+        for event in events:
+            if event["blockNumber"] <= self.block:
+                continue
+            name, args = event["event"], event["args"]
+            wallet = args["user"].lower()
+            if name == "AutoMintExecuted":
+                collaterals = collaterals or await self._collateral_addresses()
+                pairs = [(wallet, collateral) for collateral in collaterals]
+                stale.update(pairs)
+                touched.setdefault(event["blockNumber"], set()).update(pairs)
+                continue
+            if name not in EVENT_DELTAS and name != "PositionLiquidated":
+                continue
+
+            pair = (wallet, Web3.to_checksum_address(args["collateral"]))
+            touched.setdefault(event["blockNumber"], set()).add(pair)
+            if pair not in updated and pair in self.positions:
+                updated[pair] = list(self.positions[pair])
+            position = updated.get(pair)
+            if position is None or pair in stale:
+                stale.add(pair)
+            elif name == "PositionLiquidated":
+                position[0] = position[1] = 0
+                changed.add(pair)
+            else:
+                collateral_sign, minted_sign = EVENT_DELTAS[name]
+                position[0] += collateral_sign * args["amount"]
+                position[1] += minted_sign * args["amount"]
+                changed.add(pair)
+
+        # Only wallets with a profile are mirrored, as user_vaults is keyed by user
+        stale = [pair for pair in stale if self.wallets.peek(pair[0])]
+        positions = await self._read(stale, through_block) if stale else {}
+
+        self.positions.update({pair: updated[pair] for pair in changed if pair not in positions})
+        self.positions.update(positions)
+        changed.update(positions)
+        self.block = through_block
+        self._stale = set()
+        self._track(touched, through_block)
+        # Written with the next batch if this one's write or reconciliation fails
+        self._unwritten |= changed
+
+        if time.monotonic() - self._last_reconcile >= self.reconcile_interval:
+            try:
+                changed.update(await self.reconcile())
+            except Exception as e:
+                logger.error(f"Position mirror reconciliation failed; retrying after the next interval: {e}")
+        await self._write(changed)
+
+    def _track(self, touched: Dict[int, Set[Pair]], through_block: int):
+        """Records the pairs changed per block, keeping only the last `confirmations` blocks."""
+        for number, pairs in touched.items():
+            self._touched.setdefault(number, set()).update(pairs)
+        floor = through_block - self.confirmations
+        for number in [n for n in self._touched if n <= floor]:
+            del self._touched[number]
+        self._tracked_from = max(self._tracked_from, floor + 1)
+
+    async def reconcile(self, sample_size: int = None) -> List[Pair]:
+        """Compares a random sample of mirrored positions with the chain and corrects any drift."""
+        self._last_reconcile = time.monotonic()
+        sample_size = self.reconcile_sample if sample_size is None else sample_size
+        pairs = random.sample(list(self.positions), min(sample_size, len(self.positions)))
+        on_chain = await self._read(pairs, self.block)
+
+        drifted = [pair for pair in pairs if pair in on_chain and on_chain[pair] != self.positions[pair]]
+        for pair in drifted:
+            logger.warning(f"Position mirror drift for {pair}: mirrored {self.positions[pair]}, on-chain {on_chain[pair]}")
+            self.positions[pair] = on_chain[pair]
+        self.drift_corrections += len(drifted)
+        logger.info(f"Position mirror reconciled {len(on_chain)} sampled positions at block {self.block}; {len(drifted)} drifted.")
+        return drifted
+
+    async def _write(self, pairs: Iterable[Pair]):
+        """Upserts the given positions (and any that failed to write earlier) into user_vaults."""
+        pending = self._unwritten | set(pairs)
+        unwritten, buffered = set(), 0
+        synced_at = datetime.now(timezone.utc).isoformat()
+        for wallet, collateral in pending:
+            user_id = self.wallets.peek(wallet)
+            position = self.positions.get((wallet, collateral))
+            if not user_id or position is None:
+                continue
+            try:
+                config = await collateral_registry.get(collateral)
+            except Exception as e:
+                logger.error(f"Could not read collateral config for {collateral}: {e}")
+                config = None
+            if config is None:
+                # Guessing the decimals would store a wrong amount
+                unwritten.add((wallet, collateral))
+                continue
+            collateral_decimals = config["decimals"]
+            buffered += 1
+            user_vault_writer.add({
+                "user_id": user_id,
+                "collateral_address": collateral,
+                "eth_collateral": str(Decimal(position[0]) / Decimal(10**collateral_decimals)),
+                "tghsx_minted": str(Decimal(position[1]) / Decimal(10**TGHSX_DECIMALS)),
+                "last_synced": synced_at,
+            })
+        if unwritten:
+            logger.warning(f"{len(unwritten)} mirrored positions have no collateral config; retrying with the next batch.")
+        try:
+            await user_vault_writer.flush()
+            self._unwritten = unwritten
+        except Exception as e:
+            logger.error(f"Failed to write {buffered} mirrored positions to user_vaults; retrying with the next batch: {e}")
+            self._unwritten = pending
@@ -0,0 +1,266 @@
+# In /backend/services/risk_index.py
+
+import os
+import time
+import asyncio
+import logging
+from decimal import Decimal, InvalidOperation
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from fastapi_cache import FastAPICache
+
+from services.supabase_client import paginate
+from services.contract_service import TGHSX_DECIMALS
+from services.collateral_registry import collateral_registry
+from services.swr_cache import StaleWhileRevalidateCache
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# Age (s) after which the index is rebuilt from user_vaults
+RISK_INDEX_REFRESH_INTERVAL = float(os.getenv("RISK_INDEX_REFRESH_INTERVAL", "60"))
+# An index older than this is never served; callers wait for the rebuild instead
+RISK_INDEX_MAX_STALENESS = 3 * RISK_INDEX_REFRESH_INTERVAL
+# Response cache namespace of /liquidations/at-risk, cleared when a price change moves
+# positions across the liquidation threshold
+AT_RISK_CACHE_NAMESPACE = "at-risk"
+
+# CollateralVault constants
+PRECISION = 10**6
+LIQUIDATION_THRESHOLD = 125 * PRECISION // 100
+
+# Liquidation prices are searched as uint64; a larger one (dust collateral against real
+# debt) is stored as this, i.e. liquidatable at any price the oracle can realistically report.
+MAX_LIQUIDATION_PRICE = int(np.iinfo(np.uint64).max)
+
+
+def liquidation_price(collateral_amount: int, minted_amount: int, decimals: int) -> Optional[int]:
+    """
+    The lowest collateral price at which the position is safe, or None if it has no
+    debt or no collateral. The vault never liquidates either: `getUserPosition`
+    reports them as not liquidatable and `liquidate` reverts. Otherwise it liquidates when
+
+        (amount * price // 10**decimals) * PRECISION // minted < LIQUIDATION_THRESHOLD
+
+    With integer floors that holds exactly when the value is below
+    ceil(LIQUIDATION_THRESHOLD * minted / PRECISION), i.e. when `price` is below
+    ceil(that value * 10**decimals / amount), which is returned.
+    """
+    if minted_amount <= 0 or collateral_amount <= 0:
+        return None
+    value_needed = -(-LIQUIDATION_THRESHOLD * minted_amount // PRECISION)
+    return min(-(-value_needed * 10**decimals // collateral_amount), MAX_LIQUIDATION_PRICE)
+
+
+def collateral_ratio(collateral_amount: int, minted_amount: int, price: int, decimals: int) -> int:
+    """The vault's `collateralRatio` for a position with debt, in PRECISION units."""
+    return (collateral_amount * price // 10**decimals) * PRECISION // minted_amount
+
+
+def _raw_amount(value, decimals: int) -> Optional[int]:
+    """Converts a user_vaults decimal string back to the on-chain integer."""
+    try:
+        return int((Decimal(str(value)) * 10**decimals).to_integral_value())
+    except (TypeError, InvalidOperation):
+        return None
+
+
+class RiskIndex:
+    """
+    Columnar snapshot of every open vault position, for answering "which positions
+    are liquidatable at this price" without reading the chain.
+
+    Positions are held in NumPy columns (wallet id, collateral id, collateral amount,
+    minted amount, liquidation price) sorted by collateral and then by liquidation
+    price, with one contiguous slice per collateral. A position is liquidatable
+    exactly when the collateral's price is below its liquidation price, so the
+    liquidatable positions of a collateral at any price are the tail of its slice
+    past one binary search, and the positions that crossed the threshold between
+    two prices are the slice between two.
+
+    Running totals of the minted and collateral columns turn the debt and collateral
+    behind any such tail into two lookups, so a whole grid of stress scenarios is a
+    handful of vectorized searches.
+
+    The snapshot is built from `user_vaults` (see `load_risk_index`), so it is as
+    current as the vault sync; liquidations themselves are checked on-chain.
+    Amounts stay exact Python integers (object columns), as they exceed 64 bits.
+    """
+
+    def __init__(self):
+        self.wallets: List[str] = []
+        self.collaterals: List[str] = []
+        self.wallet_ids = np.empty(0, dtype=np.int64)
+        self.collateral_ids = np.empty(0, dtype=np.int64)
+        self.collateral_amounts = np.empty(0, dtype=object)
+        self.minted_amounts = np.empty(0, dtype=object)
+        self.liquidation_prices = np.empty(0, dtype=np.uint64)
+        # Running totals: entry i is the sum of the first i positions' amounts
+        self._minted_totals = np.zeros(1, dtype=object)
+        self._collateral_totals = np.zeros(1, dtype=object)
+        # collateral address -> (start, end) of its slice of the columns
+        self._slices: Dict[str, Tuple[int, int]] = {}
+        self.built_at: Optional[float] = None
+
+    def __len__(self):
+        return len(self.liquidation_prices)
+
+    def build(self, positions: List[Tuple[str, str, int, int]], configs: Dict[str, dict]):
+        """
+        Fills the index with `positions`, given as (wallet, collateral, raw amount,
+        raw minted). Positions that can never be liquidated are left out.
+        """
+        positions = [position for position in positions if position[2] > 0 and position[3] > 0]
+        by_address = {address.lower(): address for address in configs}
+        collaterals = sorted(by_address)
+        collateral_index = {address: i for i, address in enumerate(collaterals)}
+        wallets, wallet_index = [], {}
+
+        count = len(positions)
+        wallet_ids = np.empty(count, dtype=np.int64)
+        collateral_ids = np.empty(count, dtype=np.int64)
+        collateral_amounts = np.empty(count, dtype=object)
+        minted_amounts = np.empty(count, dtype=object)
+        liquidation_prices = np.empty(count, dtype=np.uint64)
+        for i, (wallet, collateral, collateral_amount, minted_amount) in enumerate(positions):
+            collateral = collateral.lower()
+            if wallet not in wallet_index:
+                wallet_index[wallet] = len(wallets)
+                wallets.append(wallet)
+            wallet_ids[i] = wallet_index[wallet]
+            collateral_ids[i] = collateral_index[collateral]
+            collateral_amounts[i] = collateral_amount
+            minted_amounts[i] = minted_amount
+            liquidation_prices[i] = liquidation_price(collateral_amount, minted_amount, configs[by_address[collateral]]["decimals"])
+
+        order = np.lexsort((liquidation_prices, collateral_ids))
+        collateral_ids = collateral_ids[order]
+        bounds = np.searchsorted(collateral_ids, np.arange(len(collaterals) + 1))
+
+        self.wallets = wallets
+        self.collaterals = [by_address[address] for address in collaterals]
+        self.wallet_ids = wallet_ids[order]
+        self.collateral_ids = collateral_ids
+        self.collateral_amounts = collateral_amounts[order]
+        self.minted_amounts = minted_amounts[order]
+        self.liquidation_prices = liquidation_prices[order]
+        self._minted_totals = np.concatenate((np.zeros(1, dtype=object), np.cumsum(self.minted_amounts)))
+        self._collateral_totals = np.concatenate((np.zeros(1, dtype=object), np.cumsum(self.collateral_amounts)))
+        self._slices = {
+            address.lower(): (int(bounds[i]), int(bounds[i + 1])) for i, address in enumerate(self.collaterals)
+        }
+        self.built_at = time.time()
+
+    def _slice(self, collateral_address: str) -> Tuple[int, int]:
+        return self._slices.get(collateral_address.lower(), (0, 0))
+
+    def _position(self, i: int) -> dict:
+        return {
+            "wallet_address": self.wallets[self.wallet_ids[i]],
+            "collateral_address": self.collaterals[self.collateral_ids[i]],
+            "collateral_amount": self.collateral_amounts[i],
+            "minted_amount": self.minted_amounts[i],
+            "liquidation_price": int(self.liquidation_prices[i]),
+        }
+
+    def liquidatable(self, collateral_address: str, price: int) -> List[dict]:
+        """Positions of `collateral_address` that the vault would liquidate at `price`."""
+        start, end = self._slice(collateral_address)
+        price = min(int(price), MAX_LIQUIDATION_PRICE)
+        first = start + int(np.searchsorted(self.liquidation_prices[start:end], price, side="right"))
+        return [self._position(i) for i in range(first, end)]
+
+    def crossed(self, collateral_address: str, old_price: int, new_price: int) -> List[dict]:
+        """
+        Positions whose liquidatability changed when the price moved from `old_price`
+        to `new_price`: newly liquidatable ones on a fall, newly safe ones on a rise.
+        Called on every registry price change (see `_on_price_change`).
+        """
+        start, end = self._slice(collateral_address)
+        prices = self.liquidation_prices[start:end]
+        low, high = sorted(min(int(price), MAX_LIQUIDATION_PRICE) for price in (old_price, new_price))
+        first, last = np.searchsorted(prices, [low, high], side="right")
+        return [self._position(i) for i in range(start + int(first), start + int(last))]
+
+    def exposure(self, collateral_address: str, prices: Sequence[int]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        For each of `prices`, the number of `collateral_address` positions that would be
+        liquidatable, their total minted amount and their total collateral amount
+        (liquidation seizes all of it). Returned as three arrays aligned with `prices`.
+        """
+        start, end = self._slice(collateral_address)
+        prices = np.array([min(int(price), MAX_LIQUIDATION_PRICE) for price in prices], dtype=np.uint64)
+        first = start + np.searchsorted(self.liquidation_prices[start:end], prices, side="right")
+        return (
+            end - first,
+            self._minted_totals[end] - self._minted_totals[first],
+            self._collateral_totals[end] - self._collateral_totals[first],
+        )
+
+
+async def _load_positions(decimals: Dict[str, int]) -> List[Tuple[str, str, int, int]]:
+    """Reads the open positions of every wallet with a profile, as raw on-chain integers."""
+    wallets = {}
+    async for page in paginate("profiles", "id, wallet_address", filters=lambda query: query.neq("wallet_address", "null")):
+        for profile in page:
+            if profile.get("wallet_address"):
+                wallets[profile["id"]] = profile["wallet_address"]
+
+    positions = []
+    async for page in paginate("user_vaults", "user_id, collateral_address, eth_collateral, tghsx_minted",
+                               key=("user_id", "collateral_address")):
+        for row in page:
+            wallet = wallets.get(row["user_id"])
+            collateral = (row.get("collateral_address") or "").lower()
+            if wallet is None or collateral not in decimals:
+                continue
+            collateral_amount = _raw_amount(row["eth_collateral"], decimals[collateral])
+            minted_amount = _raw_amount(row["tghsx_minted"], TGHSX_DECIMALS)
+            # Positions without debt or without collateral can never be liquidated
+            if collateral_amount is None or minted_amount is None or collateral_amount <= 0 or minted_amount <= 0:
+                continue
+            positions.append((wallet, collateral, collateral_amount, minted_amount))
+    return positions
+
+
+async def load_risk_index() -> RiskIndex:
+    """Builds a fresh index from user_vaults and the collateral registry."""
+    started = time.monotonic()
+    configs = {collateral["address"]: collateral for collateral in await collateral_registry.all()}
+    positions = await _load_positions({address.lower(): config["decimals"] for address, config in configs.items()})
+    index = RiskIndex()
+    # Sorting and the running totals are CPU-bound, so keep them off the event loop
+    await asyncio.to_thread(index.build, positions, configs)
+    logger.info(f"Risk index built with {len(index)} open positions in {time.monotonic() - started:.2f}s.")
+    return index
+
+
+# One index per process, built on first use and rebuilt in the background once it is older
+# than RISK_INDEX_REFRESH_INTERVAL. Processes that serve no liquidation requests and run no
+# keeper never load it; each one that does pages through profiles and user_vaults at most
+# once per interval.
+risk_index = StaleWhileRevalidateCache(
+    load_risk_index, fresh_for=RISK_INDEX_REFRESH_INTERVAL, max_staleness=RISK_INDEX_MAX_STALENESS, name="risk index"
+)
+
+
+async def _on_price_change(collateral_address: str, old_price: int, new_price: int):
+    """
+    Drops the cached /at-risk response when a collateral's new price moves positions
+    across the liquidation threshold. The positions are found with one pair of binary
+    searches over the risk index; without a loaded index the response is dropped anyway.
+    """
+    index = risk_index.peek()
+    crossed = index.crossed(collateral_address, old_price, new_price) if index is not None else None
+    if crossed == []:
+        return
+    if crossed:
+        became = "liquidatable" if new_price < old_price else "safe"
+        logger.warning(f"{len(crossed)} positions with collateral {collateral_address} became {became} "
+                       f"as its price moved from {old_price} to {new_price}.")
+    await FastAPICache.clear(namespace=AT_RISK_CACHE_NAMESPACE)
+
+# Registered with the index, so every process that builds it (web workers, the keeper in
+# worker.py) reacts to the price changes its registry sees
+collateral_registry.on_price_change(_on_price_change)
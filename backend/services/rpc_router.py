@@ -0,0 +1,245 @@
+import os
+import time
+import asyncio
+import threading
+from collections import deque
+from contextvars import ContextVar
+from typing import Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+RPC_LATENCY_WINDOW = int(os.getenv("RPC_LATENCY_WINDOW", "100"))     # Samples kept per endpoint
+RPC_DEFAULT_LATENCY = float(os.getenv("RPC_DEFAULT_LATENCY", "0.5"))  # Assumed latency before any samples (s)
+RPC_CIRCUIT_FAILURES = int(os.getenv("RPC_CIRCUIT_FAILURES", "5"))    # Consecutive failures that trip the breaker
+RPC_CIRCUIT_ERROR_RATE = float(os.getenv("RPC_CIRCUIT_ERROR_RATE", "0.5"))
+RPC_CIRCUIT_MIN_SAMPLES = 10
+RPC_CIRCUIT_COOLDOWN = float(os.getenv("RPC_CIRCUIT_COOLDOWN", "30"))
+RPC_RATE_LIMIT_COOLDOWN = float(os.getenv("RPC_RATE_LIMIT_COOLDOWN", "10"))
+RPC_HEDGE_MIN_DELAY = float(os.getenv("RPC_HEDGE_MIN_DELAY_MS", "50")) / 1000
+RPC_HEDGE_MAX_DELAY = float(os.getenv("RPC_HEDGE_MAX_DELAY_MS", "1000")) / 1000
+
+# Reads that sit directly on a user-facing request path and are safe to send twice.
+HEDGED_RPC_METHODS = {"eth_call", "eth_getBlockByNumber", "eth_blockNumber"}
+# Side-effect free reads whose concurrent identical requests can share one response.
+COALESCED_RPC_METHODS = {
+    "eth_call", "eth_getBlockByNumber", "eth_blockNumber", "eth_getBalance",
+    "eth_getCode", "eth_getLogs", "eth_chainId",
+}
+
+
+class EndpointStats:
+    """Rolling latency, error and rate-limit statistics for a single RPC URL."""
+
+    def __init__(self, url: str, preference: int, window: int = RPC_LATENCY_WINDOW):
+        self.url = url
+        self.preference = preference
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.requests = 0
+        self.failures = 0
+        self.rate_limited = 0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.disabled = False
+        self._lock = threading.Lock()
+
+    def record_success(self, latency: float):
+        with self._lock:
+            self.requests += 1
+            self.latencies.append(latency)
+            self.outcomes.append(True)
+            self.consecutive_failures = 0
+
+    def record_latency(self, latency: float):
+        """Records a request that was abandoned (e.g. lost a hedge) as a latency lower bound."""
+        with self._lock:
+            self.latencies.append(latency)
+
+    def record_failure(self, rate_limited: bool = False):
+        with self._lock:
+            self.requests += 1
+            self.failures += 1
+            self.outcomes.append(False)
+            self.consecutive_failures += 1
+            now = time.monotonic()
+            if rate_limited:
+                self.rate_limited += 1
+                self.open_until = max(self.open_until, now + RPC_RATE_LIMIT_COOLDOWN)
+            # After a cooldown the endpoint is half-open: consecutive_failures is only reset
+            # by a success, so a single further failure trips the breaker again.
+            if self.consecutive_failures >= RPC_CIRCUIT_FAILURES or (
+                len(self.outcomes) >= RPC_CIRCUIT_MIN_SAMPLES and self.error_rate() >= RPC_CIRCUIT_ERROR_RATE
+            ):
+                if self.open_until <= now:
+                    logger.warning(f"Circuit opened for RPC endpoint {self.url} for {RPC_CIRCUIT_COOLDOWN}s")
+                self.open_until = max(self.open_until, now + RPC_CIRCUIT_COOLDOWN)
+
+    def p95(self) -> float:
+        samples = sorted(self.latencies)
+        if not samples:
+            return RPC_DEFAULT_LATENCY
+        return samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def is_available(self) -> bool:
+        return not self.disabled and time.monotonic() >= self.open_until
+
+    def score(self) -> float:
+        """Expected cost of a request: p95 latency inflated by the recent error rate."""
+        return self.p95() * (1 + 4 * self.error_rate())
+
+    def snapshot(self) -> dict:
+        return {
+            "url": self.url,
+            "available": self.is_available(),
+            "disabled": self.disabled,
+            "p95_ms": round(self.p95() * 1000, 1),
+            "error_rate": round(self.error_rate(), 3),
+            "requests": self.requests,
+            "failures": self.failures,
+            "rate_limited": self.rate_limited,
+            "circuit_open_for_s": round(max(0.0, self.open_until - time.monotonic()), 1),
+        }
+
+
+class RPCRouter:
+    """
+    Ranks the configured RPC URLs by their recent performance. The sync and async
+    Web3 providers ask it for an ordered list of endpoints on every request and
+    report each outcome back, so a slow or failing endpoint is demoted within a
+    few requests and skipped entirely while its circuit breaker is open.
+    """
+
+    def __init__(self, urls):
+        self.endpoints = {}
+        for url in urls:
+            if url not in self.endpoints:
+                self.endpoints[url] = EndpointStats(url, len(self.endpoints))
+        self.hedged_requests = 0
+
+    def ranked(self) -> list:
+        """
+        Available endpoints, best first, followed by endpoints whose circuit is open
+        (soonest to reopen first) as a last resort.
+        """
+        endpoints = [e for e in self.endpoints.values() if not e.disabled]
+        available = sorted((e for e in endpoints if e.is_available()), key=lambda e: (e.score(), e.preference))
+        cooling_down = sorted((e for e in endpoints if not e.is_available()), key=lambda e: e.open_until)
+        return [e.url for e in available + cooling_down]
+
+    def hedge_delay(self, url: str) -> float:
+        """How long to wait on `url` before sending the same read to the next endpoint."""
+        return min(RPC_HEDGE_MAX_DELAY, max(RPC_HEDGE_MIN_DELAY, self.endpoints[url].p95()))
+
+    def record_success(self, url: str, latency: float):
+        self.endpoints[url].record_success(latency)
+
+    def record_latency(self, url: str, latency: float):
+        self.endpoints[url].record_latency(latency)
+
+    def record_failure(self, url: str, rate_limited: bool = False):
+        self.endpoints[url].record_failure(rate_limited)
+
+    def disable(self, url: str, reason: str):
+        """Permanently removes an endpoint from rotation (e.g. it serves the wrong chain)."""
+        logger.error(f"Disabling RPC endpoint {url}: {reason}")
+        self.endpoints[url].disabled = True
+
+    def snapshot(self) -> dict:
+        return {
+            "ranking": self.ranked(),
+            "hedged_requests": self.hedged_requests,
+            "endpoints": [e.snapshot() for e in self.endpoints.values()],
+        }
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent async calls: while a call for a key is in
+    flight, later callers with the same key await the same task instead of
+    issuing their own request.
+    """
+
+    def __init__(self):
+        self._in_flight = {}
+        self.requests = 0
+        self.coalesced = 0
+
+    async def do(self, key, call):
+        self.requests += 1
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(call())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            self.coalesced += 1
+        # Shielded so one cancelled caller does not cancel the request for the others
+        return await asyncio.shield(task)
+
+    def snapshot(self) -> dict:
+        return {
+            "requests": self.requests,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._in_flight),
+        }
+
+
+class TokenBucket:
+    """Async token bucket allowing `rate` acquisitions per second, in bursts of up to `burst`."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.waited = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        # The lock queues waiters, so tokens are handed out in arrival order
+        async with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                delay = (1 - self.tokens) / self.rate
+                self.waited += delay
+                await asyncio.sleep(delay)
+                self.tokens, self.updated = 1.0, time.monotonic()
+            self.tokens -= 1
+
+
+class RateBudget:
+    """
+    A requests-per-second budget applied separately to each RPC endpoint. Background
+    jobs install one with `rpc_budget.set(...)`; every request the routed async
+    provider sends from that context then waits for a token for the endpoint it
+    goes to, while user-facing requests are not throttled.
+    """
+
+    def __init__(self, rps: float):
+        self.rps = rps
+        self._buckets = {}
+
+    async def acquire(self, url: str):
+        if self.rps <= 0:
+            return
+        bucket = self._buckets.get(url)
+        if bucket is None:
+            bucket = self._buckets[url] = TokenBucket(self.rps)
+        await bucket.acquire()
+
+    def waited(self) -> float:
+        """Total seconds requests have been delayed by the budget."""
+        return sum(bucket.waited for bucket in self._buckets.values())
+
+
+# The budget, if any, for RPC requests made from the current task (inherited by sub-tasks).
+rpc_budget: ContextVar[Optional[RateBudget]] = ContextVar("rpc_budget", default=None)
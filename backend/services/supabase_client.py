@@ -1,7 +1,9 @@
 import os
+import asyncio
 from dotenv import load_dotenv
 from supabase import create_client, Client
 from functools import lru_cache
+from typing import Any, AsyncIterator, Callable, Iterator, List, Optional, Tuple, Union
 import validators
 from requests.exceptions import HTTPError, ConnectionError as RequestsConnectionError
 
@@ -13,6 +15,10 @@ SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY") # Anon key for client-side auth/public access
 SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY") # Service role key for backend-only operations
 
+# Rows per request when background jobs page through a table. Kept at or below the
+# PostgREST max-rows setting (1000 by default), which silently truncates larger responses.
+SUPABASE_PAGE_SIZE = int(os.getenv("SUPABASE_PAGE_SIZE", "1000"))
+
 # FIX: Add validation for environment variables
 if not SUPABASE_URL or not validators.url(SUPABASE_URL):
     raise ValueError(f"Invalid or missing SUPABASE_URL: {SUPABASE_URL}")
@@ -61,4 +67,83 @@ def get_supabase_admin_client() -> Client:
     except Exception as e:
         raise RuntimeError(f"An unexpected error occurred while initializing the Supabase admin client: {str(e)}")
 
+def _after_condition(columns: Tuple[str, ...], values: Tuple[Any, ...]) -> str:
+    """PostgREST `or` condition for rows whose (columns) sort after (values)."""
+    column, value = columns[0], f'"{values[0]}"'
+    if len(columns) == 1:
+        return f"{column}.gt.{value}"
+    return f"{column}.gt.{value},and({column}.eq.{value},or({_after_condition(columns[1:], values[1:])}))"
+
+def _page_fetcher(table: str, columns: str, key: Union[str, Tuple[str, ...]], page_size: int,
+                  filters: Optional[Callable[[Any], Any]], client: Optional[Client]):
+    """Returns the key columns and a blocking function that reads the page after a cursor."""
+    client = client or get_supabase_admin_client()
+    key_columns = (key,) if isinstance(key, str) else tuple(key)
+    if columns != "*":
+        selected = [column.strip() for column in columns.split(",")]
+        columns = ", ".join(selected + [column for column in key_columns if column not in selected])
+
+    def fetch_page(cursor):
+        query = client.table(table).select(columns)
+        if filters is not None:
+            query = filters(query)
+        if cursor is not None:
+            if len(key_columns) == 1:
+                query = query.gt(key_columns[0], cursor[0])
+            else:
+                query = query.or_(_after_condition(key_columns, cursor))
+        for column in key_columns:
+            query = query.order(column)
+        return query.limit(page_size).execute().data
+
+    return key_columns, fetch_page
+
+async def paginate(
+    table: str,
+    columns: str = "*",
+    key: Union[str, Tuple[str, ...]] = "id",
+    page_size: int = SUPABASE_PAGE_SIZE,
+    filters: Optional[Callable[[Any], Any]] = None,
+    after: Any = None,
+    client: Optional[Client] = None,
+) -> AsyncIterator[List[dict]]:
+    """
+    Streams a table in pages of up to `page_size` rows ordered by `key`, using the
+    last key of each page as the cursor for the next (`key > cursor`), so every
+    query is an index range scan and no row is skipped or repeated when rows are
+    inserted mid-scan. `key` is a column or a tuple of columns forming a composite
+    key, in which case `after` is a tuple too.
+
+    `filters` receives the query builder to add conditions, e.g.
+    `lambda q: q.neq("wallet_address", "null")`. `after` starts the scan past a
+    given key. Each request runs in a thread, so the event loop is not blocked.
+    """
+    key_columns, fetch_page = _page_fetcher(table, columns, key, page_size, filters, client)
+    cursor = None if after is None else ((after,) if isinstance(key, str) else tuple(after))
+    while True:
+        page = await asyncio.to_thread(fetch_page, cursor)
+        if page:
+            yield page
+        if len(page) < page_size:
+            return
+        cursor = tuple(page[-1][column] for column in key_columns)
 
+def paginate_sync(
+    table: str,
+    columns: str = "*",
+    key: Union[str, Tuple[str, ...]] = "id",
+    page_size: int = SUPABASE_PAGE_SIZE,
+    filters: Optional[Callable[[Any], Any]] = None,
+    after: Any = None,
+    client: Optional[Client] = None,
+) -> Iterator[List[dict]]:
+    """Blocking counterpart of `paginate`, for code that already runs in a worker thread."""
+    key_columns, fetch_page = _page_fetcher(table, columns, key, page_size, filters, client)
+    cursor = None if after is None else ((after,) if isinstance(key, str) else tuple(after))
+    while True:
+        page = fetch_page(cursor)
+        if page:
+            yield page
+        if len(page) < page_size:
+            return
+        cursor = tuple(page[-1][column] for column in key_columns)
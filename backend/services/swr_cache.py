@@ -0,0 +1,83 @@
+# In /backend/services/swr_cache.py
+
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Prices (and anything derived from them) older than this are never served; this is
+# the same 1-hour validity rule the vault's price staleness checks enforce.
+PRICE_VALIDITY_PERIOD = 3600
+# Minimum delay between background refresh attempts after a failure.
+REFRESH_RETRY_INTERVAL = 5
+
+
+class StaleWhileRevalidateCache:
+    """
+    Holds the last good result of an async `fetch` function in memory.
+
+    - Younger than `fresh_for` seconds: returned as is.
+    - Older, but within `max_staleness`: returned immediately while a single
+      background task refreshes it.
+    - Missing or past `max_staleness`: callers wait for the refresh, and its
+      error propagates if it fails.
+
+    Staleness is measured from `timestamp_of(value)` when given (e.g. the price
+    feed's own update time), otherwise from when the value was fetched.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[], Awaitable[Any]],
+        fresh_for: float,
+        max_staleness: float = PRICE_VALIDITY_PERIOD,
+        timestamp_of: Optional[Callable[[Any], float]] = None,
+        name: str = "",
+    ):
+        self.fetch = fetch
+        self.fresh_for = fresh_for
+        self.max_staleness = max_staleness
+        self.timestamp_of = timestamp_of
+        self.name = name or getattr(fetch, "__name__", "swr")
+        self._value: Any = None
+        self._fetched_at = 0.0
+        self._last_attempt = 0.0
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    def _age(self) -> float:
+        timestamp = self.timestamp_of(self._value) if self.timestamp_of else self._fetched_at
+        return time.time() - timestamp
+
+    async def _refresh(self) -> Any:
+        value = await self.fetch()
+        self._value = value
+        self._fetched_at = time.time()
+        return value
+
+    def _on_refresh_done(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Refreshing {self.name} failed: {task.exception()}")
+
+    def _start_refresh(self) -> asyncio.Task:
+        # Concurrent callers share one in-flight refresh
+        if self._refresh_task is None or self._refresh_task.done():
+            self._last_attempt = time.time()
+            self._refresh_task = asyncio.create_task(self._refresh())
+            self._refresh_task.add_done_callback(self._on_refresh_done)
+        return self._refresh_task
+
+    def peek(self) -> Any:
+        """The cached value, however old, without fetching; None if nothing was fetched yet."""
+        return self._value
+
+    async def get(self) -> Any:
+        if self._value is not None and self._age() <= self.max_staleness:
+            now = time.time()
+            if (now - self._fetched_at >= self.fresh_for
+                    and now - self._last_attempt >= min(self.fresh_for, REFRESH_RETRY_INTERVAL)):
+                self._start_refresh()
+            return self._value
+        # Shielded so a cancelled request does not abort the refresh other callers are waiting on
+        return await asyncio.shield(self._start_refresh())
@@ -0,0 +1,42 @@
+# In /backend/services/vault_dirty_set.py
+
+from datetime import datetime, timezone
+from typing import AsyncIterator, Iterable, List, Tuple
+
+from services.supabase_client import paginate
+
+# (wallet, collateral) pairs whose `user_vaults` rows need to be re-read from the chain. The
+# event listener and the web app run in separate processes, so the set lives in Supabase.
+# Expected table: vault_sync_dirty (wallet_address text, collateral_address text,
+#                                   marked_at timestamptz, primary key (wallet_address, collateral_address))
+DIRTY_TABLE = "vault_sync_dirty"
+# Marks every collateral of a wallet, e.g. when the wallet is first saved or after an auto-mint.
+ALL_COLLATERALS = "*"
+
+
+def mark_dirty(supabase, pairs: Iterable[Tuple[str, str]]):
+    """Adds (wallet, collateral) pairs to the dirty set. Wallets are stored lowercase. Blocking."""
+    marked_at = datetime.now(timezone.utc).isoformat()
+    rows = {
+        (wallet.lower(), collateral): {"wallet_address": wallet.lower(), "collateral_address": collateral, "marked_at": marked_at}
+        for wallet, collateral in pairs
+    }
+    if rows:
+        supabase.table(DIRTY_TABLE).upsert(list(rows.values()), on_conflict="wallet_address,collateral_address").execute()
+
+
+async def iter_dirty(supabase, marked_before: str) -> AsyncIterator[List[dict]]:
+    """Streams the pairs marked up to `marked_before`, in pages."""
+    async for page in paginate(
+        DIRTY_TABLE, "wallet_address, collateral_address, marked_at", key=("wallet_address", "collateral_address"),
+        filters=lambda query: query.lte("marked_at", marked_before), client=supabase,
+    ):
+        yield page
+
+
+def clear_dirty(supabase, marked_before: str):
+    """
+    Removes pairs marked up to `marked_before`, once they have been synced. A pair
+    marked again after that time stays dirty. Blocking.
+    """
+    supabase.table(DIRTY_TABLE).delete().lte("marked_at", marked_before).execute()
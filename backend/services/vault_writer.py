@@ -0,0 +1,166 @@
+# In /backend/services/vault_writer.py
+
+import os
+import time
+import asyncio
+import logging
+from decimal import Decimal, InvalidOperation
+from typing import Dict, List, Optional, Tuple
+
+from services.supabase_client import get_supabase_admin_client
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+USER_VAULTS_TABLE = "user_vaults"
+USER_VAULTS_BATCH_SIZE = 500
+# user_ids per lookup of stored amounts; they go into the request URL, so keep this modest
+USER_VAULTS_LOOKUP_BATCH_SIZE = 100
+# Seconds between flushes of positions buffered by request handlers
+USER_VAULTS_FLUSH_INTERVAL = float(os.getenv("USER_VAULTS_FLUSH_INTERVAL", "5"))
+# How long this process trusts the amounts it last read or wrote for a row. Other processes
+# write the same table, so after this long an unchanged row is written again.
+USER_VAULTS_SKIP_TTL = float(os.getenv("USER_VAULTS_SKIP_TTL", "60"))
+
+Key = Tuple[str, str]
+
+
+def _amounts(row: dict) -> Optional[Tuple[Decimal, Decimal]]:
+    """The stored amounts as Decimals, so "1.50" and 1.5 compare equal."""
+    try:
+        return Decimal(str(row["eth_collateral"])), Decimal(str(row["tghsx_minted"]))
+    except (KeyError, TypeError, InvalidOperation):
+        return None
+
+
+class UserVaultWriteError(Exception):
+    """A flush failed; `rows` are the rows left buffered, `keys` their (user_id, collateral_address)."""
+
+    def __init__(self, rows: List[dict], cause: Exception):
+        super().__init__(f"Failed to write {len(rows)} user_vaults rows: {cause}")
+        self.rows = rows
+        self.keys = [(row["user_id"], row["collateral_address"]) for row in rows]
+
+
+class UserVaultWriter:
+    """
+    Write-behind buffer for `user_vaults`. Rows are compared with the amounts last
+    written for the same (user_id, collateral_address); unchanged rows are dropped
+    and real changes are buffered until the next `flush`, which writes them in
+    multi-row upserts. Rows that fail to write stay buffered for the next flush.
+
+    Buffered rows the snapshot knows nothing about are looked up in the table
+    before they are written, so a restarted process does not rewrite rows that
+    are already current. Every web worker and the background worker write the
+    same rows, so a snapshot entry is only trusted for `skip_ttl` seconds after
+    it was read or written, and is evicted once it expires.
+    """
+
+    def __init__(self, batch_size: int = USER_VAULTS_BATCH_SIZE, skip_ttl: float = USER_VAULTS_SKIP_TTL):
+        self.batch_size = batch_size
+        self.skip_ttl = skip_ttl
+        # key -> (amounts, monotonic time they were read or written)
+        self._written: Dict[Key, Tuple[Optional[Tuple[Decimal, Decimal]], float]] = {}
+        self._pending: Dict[Key, dict] = {}
+        self.skipped = 0
+        self.written = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, row: dict) -> bool:
+        """Buffers `row` if its amounts differ from the last written ones. Returns whether it did."""
+        key = (row["user_id"], row["collateral_address"])
+        amounts, seen_at = self._written.get(key, (None, 0.0))
+        if (key not in self._pending and amounts is not None
+                and amounts == _amounts(row) and time.monotonic() - seen_at < self.skip_ttl):
+            self.skipped += 1
+            return False
+        self._pending[key] = row
+        return True
+
+    def _load(self, keys: List[Key]) -> Dict[Key, Optional[Tuple[Decimal, Decimal]]]:
+        """Reads the amounts currently stored in user_vaults for `keys`."""
+        supabase = get_supabase_admin_client()
+        wanted, stored = set(keys), {}
+        user_ids = sorted({user_id for user_id, _ in keys})
+        for i in range(0, len(user_ids), USER_VAULTS_LOOKUP_BATCH_SIZE):
+            rows = (supabase.table(USER_VAULTS_TABLE)
+                    .select("user_id, collateral_address, eth_collateral, tghsx_minted")
+                    .in_("user_id", user_ids[i:i + USER_VAULTS_LOOKUP_BATCH_SIZE])
+                    .execute().data)
+            for row in rows:
+                key = (row["user_id"], row["collateral_address"])
+                if key in wanted:
+                    stored[key] = _amounts(row)
+        return stored
+
+    def _evict(self):
+        """Drops snapshot entries that are too old to be trusted."""
+        now = time.monotonic()
+        self._written = {key: entry for key, entry in self._written.items() if now - entry[1] < self.skip_ttl}
+
+    def _upsert(self, rows: list):
+        supabase = get_supabase_admin_client()
+        # A multi-row upsert takes its columns from the rows, so rows with different columns
+        # (e.g. with and without wallet_address) are written separately and none is nulled
+        groups: Dict[Tuple[str, ...], list] = {}
+        for row in rows:
+            groups.setdefault(tuple(sorted(row)), []).append(row)
+        for group in groups.values():
+            for i in range(0, len(group), self.batch_size):
+                supabase.table(USER_VAULTS_TABLE).upsert(group[i:i + self.batch_size]).execute()
+
+    async def flush(self) -> int:
+        """
+        Writes the buffered changes. Returns the number of rows written, or raises
+        UserVaultWriteError naming the rows that stay buffered if the write fails.
+        """
+        self._evict()
+        if not self._pending:
+            return 0
+        pending, self._pending = self._pending, {}
+
+        unknown = [key for key in pending if key not in self._written]
+        if unknown:
+            try:
+                stored = await asyncio.to_thread(self._load, unknown)
+            except Exception as e:
+                logger.error(f"Could not read user_vaults for change detection; writing {len(pending)} rows unchecked: {e}")
+                stored = {}
+            loaded_at = time.monotonic()
+            for key, amounts in stored.items():
+                self._written[key] = (amounts, loaded_at)
+                if amounts is not None and amounts == _amounts(pending[key]):
+                    del pending[key]
+                    self.skipped += 1
+            if not pending:
+                return 0
+
+        try:
+            await asyncio.to_thread(self._upsert, list(pending.values()))
+        except Exception as e:
+            logger.error(f"Failed to write {len(pending)} user_vaults rows; retrying with the next flush: {e}")
+            # Rows buffered while the write was in flight are newer
+            self._pending = {**pending, **self._pending}
+            raise UserVaultWriteError(list(pending.values()), e)
+        written_at = time.monotonic()
+        for key, row in pending.items():
+            self._written[key] = (_amounts(row), written_at)
+        self.written += len(pending)
+        return len(pending)
+
+    async def run(self, interval: float = USER_VAULTS_FLUSH_INTERVAL):
+        """Flushes the buffer every `interval` seconds."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.flush()
+            except UserVaultWriteError:
+                pass  # Logged by flush; the rows are retried on the next one
+            except Exception as e:
+                logger.error(f"user_vaults flush failed: {e}")
+
+
+# One buffer per process, shared by the vault routes and the background sync.
+user_vault_writer = UserVaultWriter()
@@ -1,11 +1,26 @@
 import os
+import time
+import asyncio
+from functools import lru_cache
 from dotenv import load_dotenv
-from web3 import Web3
+import requests
+from requests.adapters import HTTPAdapter
+from aiohttp import ClientSession, ClientTimeout, TCPConnector, ClientResponseError
+from web3 import Web3, AsyncWeb3, AsyncHTTPProvider
+from web3.middleware import (
+    geth_poa_middleware,
+    async_geth_poa_middleware,
+    construct_simple_cache_middleware,
+    async_construct_simple_cache_middleware,
+)
 import validators
 import backoff
 from web3.exceptions import Web3Exception
+from web3._utils.encoding import FriendlyJsonSerde, Web3JsonEncoder
 import logging
 
+from services.rpc_router import RPCRouter, SingleFlight, rpc_budget, HEDGED_RPC_METHODS, COALESCED_RPC_METHODS
+
 # --- Setup ---
 load_dotenv()
 logging.basicConfig(level=logging.INFO)
@@ -31,62 +46,416 @@ if not VALID_RPC_URLS:
 RPC_URL = VALID_RPC_URLS[0]
 AMOY_CHAIN_ID = 80002
 
+# --- Connection Pooling ---
+# Each worker keeps a single keep-alive session per RPC URL instead of opening a
+# new TCP/TLS connection for every request.
+RPC_POOL_SIZE = int(os.getenv("RPC_POOL_SIZE", "20"))
+RPC_TIMEOUT = 30
+# web3's validation middleware looks up the chain ID before every eth_call; the chain
+# ID cannot change for a given endpoint, so it is cached after the startup check.
+CHAIN_ID_CACHE_WHITELIST = {"eth_chainId"}
+
+# --- JSON-RPC Batching ---
+# Endpoints listed in RPC_BATCH_URLS (comma-separated) accept JSON-RPC batch arrays.
+# Concurrent batchable requests sent to them within RPC_BATCH_WINDOW_MS are merged
+# into a single HTTP POST. Local hardhat/anvil nodes support batches out of the box.
+RPC_BATCH_URLS = {url.strip() for url in os.getenv("RPC_BATCH_URLS", "http://127.0.0.1:8545").split(",") if url.strip()}
+RPC_BATCH_WINDOW = float(os.getenv("RPC_BATCH_WINDOW_MS", "5")) / 1000
+RPC_BATCH_MAX_SIZE = int(os.getenv("RPC_BATCH_MAX_SIZE", "50"))
+BATCHABLE_RPC_METHODS = {"eth_call", "eth_getBlockByNumber"}
+
+
+class PooledHTTPProvider(Web3.HTTPProvider):
+    """
+    An HTTPProvider that sends every request through one shared, pooled
+    requests.Session, regardless of which thread issues the call.
+    """
+
+    def __init__(self, endpoint_uri: str, pool_size: int = RPC_POOL_SIZE):
+        super().__init__(endpoint_uri, request_kwargs={'timeout': RPC_TIMEOUT})
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+    def make_request(self, method, params):
+        request_data = self.encode_rpc_request(method, params)
+        response = self._session.post(self.endpoint_uri, data=request_data, **self.get_request_kwargs())
+        response.raise_for_status()
+        return self.decode_rpc_response(response.content)
+
+
+# --- Request Routing ---
+# Every request is sent to the best-scoring endpoint in VALID_RPC_URLS, falling
+# through to the next one on errors. See services/rpc_router.py.
+rpc_router = RPCRouter(VALID_RPC_URLS)
+# Identical concurrent reads from async handlers share one RPC (see RoutedAsyncHTTPProvider).
+rpc_single_flight = SingleFlight()
+
+
+class RateLimitedError(ConnectionError):
+    """Raised when an endpoint answers with a JSON-RPC rate-limit error."""
+
+
+def _is_rate_limited_response(response) -> bool:
+    error = response.get("error") if isinstance(response, dict) else None
+    if not isinstance(error, dict):
+        return False
+    # -32005 alone is not enough: providers also use it for "block range too large" on eth_getLogs
+    message = str(error.get("message", "")).lower()
+    return error.get("code") == 429 or any(term in message for term in ("rate limit", "too many requests", "request limit"))
+
+
+def _check_chain_id(router: RPCRouter, url: str, response):
+    chain_id = int(response["result"], 16)
+    if chain_id != AMOY_CHAIN_ID:
+        router.disable(url, f"chain ID {chain_id}, expected Amoy ({AMOY_CHAIN_ID})")
+        raise ConnectionError(f"Connected to incorrect chain ID {chain_id} at {url}. Expected Amoy ({AMOY_CHAIN_ID}).")
+
+
+class RoutedHTTPProvider(Web3.HTTPProvider):
+    """
+    A sync provider that sends each request to the endpoint the router currently
+    ranks best and retries the next endpoint on failure. Each endpoint's chain ID
+    is validated the first time it is used.
+    """
+
+    def __init__(self, router: RPCRouter):
+        super().__init__(next(iter(router.endpoints)), request_kwargs={'timeout': RPC_TIMEOUT})
+        self.router = router
+        self._providers = {url: PooledHTTPProvider(url) for url in router.endpoints}
+        self._verified = set()
+
+    def _attempt(self, url: str, method, params):
+        try:
+            if url not in self._verified:
+                _check_chain_id(self.router, url, self._providers[url].make_request("eth_chainId", []))
+                self._verified.add(url)
+            started = time.monotonic()
+            response = self._providers[url].make_request(method, params)
+        except Exception as e:
+            response_status = getattr(getattr(e, "response", None), "status_code", None)
+            self.router.record_failure(url, rate_limited=response_status == 429)
+            raise
+        if _is_rate_limited_response(response):
+            self.router.record_failure(url, rate_limited=True)
+            raise RateLimitedError(f"{url} rate limited {method}: {response['error']}")
+        self.router.record_success(url, time.monotonic() - started)
+        return response
+
+    def make_request(self, method, params):
+        errors = []
+        for url in self.router.ranked():
+            try:
+                return self._attempt(url, method, params)
+            except Exception as e:
+                logger.warning(f"RPC {method} failed on {url}: {e}")
+                errors.append(e)
+        raise ConnectionError(f"All RPC endpoints failed for {method}: {errors}")
+
+
+def _connect() -> Web3:
+    """
+    Builds a routed, pooled Web3 instance and validates the chain ID once.
+    The chain ID call doubles as the connectivity check, so no separate
+    `is_connected()` round trip is needed.
+    """
+    w3 = Web3(RoutedHTTPProvider(rpc_router))
+    # Amoy is a PoA chain; inject once here instead of in every caller.
+    w3.middleware_onion.inject(geth_poa_middleware, layer=0)
+    w3.middleware_onion.add(construct_simple_cache_middleware(rpc_whitelist=CHAIN_ID_CACHE_WHITELIST), "chain_id_cache")
+
+    chain_id = w3.eth.chain_id
+    if chain_id != AMOY_CHAIN_ID:
+        raise ConnectionError(f"Connected to incorrect chain ID {chain_id}. Expected Amoy ({AMOY_CHAIN_ID}).")
+    return w3
+
 # --- Web3 Provider Functions ---
 
-# FIX: Add robust retry logic with exponential backoff
+# The provider is built once per worker process and reused by every request.
+# lru_cache does not cache exceptions, so a failed startup is retried on the next call.
+@lru_cache(maxsize=1)
 @backoff.on_exception(backoff.expo, (Web3Exception, ConnectionError), max_tries=3, max_time=60)
 def get_web3_provider() -> Web3:
     """
-    Initializes and returns a Web3 provider connected to the primary RPC URL.
-    Includes validation, connection checks, and retry logic.
+    Returns the process-wide Web3 provider. Requests are routed across all valid
+    RPC URLs by latency and health; see `rpc_router`.
     """
-    logger.info(f"Attempting to connect to primary Web3 provider at {RPC_URL}")
+    logger.info(f"Connecting Web3 provider across RPC endpoints: {VALID_RPC_URLS}")
     try:
-        w3 = Web3(Web3.HTTPProvider(RPC_URL, request_kwargs={'timeout': 30}))
-        
-        # FIX: Add connection and chain ID validation
-        if not w3.is_connected():
-            logger.error(f"Failed to connect to Web3 provider at {RPC_URL}")
-            raise ConnectionError(f"Failed to connect to Web3 provider at {RPC_URL}.")
-        
-        chain_id = w3.eth.chain_id
-        if chain_id != AMOY_CHAIN_ID:
-            logger.error(f"Connected to incorrect chain ID {chain_id} at {RPC_URL}. Expected {AMOY_CHAIN_ID}.")
-            raise ConnectionError(f"Connected to incorrect chain ID {chain_id}. Expected Amoy ({AMOY_CHAIN_ID}).")
-        
-        logger.info(f"Successfully connected to Web3 provider at {RPC_URL}, Chain ID: {chain_id}")
+        w3 = _connect()
+        logger.info(f"Successfully connected Web3 provider, Chain ID: {AMOY_CHAIN_ID}")
         return w3
     except Exception as e:
-        logger.error(f"Web3 provider connection failed for {RPC_URL}: {e}")
+        logger.error(f"Web3 provider connection failed: {e}")
         raise ConnectionError(f"Could not connect to Web3 provider: {e}")
 
 
-@backoff.on_exception(backoff.expo, (Web3Exception, ConnectionError), max_tries=3, max_time=60)
 def get_web3_provider_with_fallback() -> Web3:
     """
-    Tries multiple RPC providers in order of preference, with validation and retries.
-    This is the recommended function for all services to use for maximum reliability.
+    Returns the process-wide Web3 provider. Fallback between RPC URLs now happens
+    per request inside the router, so this is the same instance as `get_web3_provider`.
     """
-    for provider_url in VALID_RPC_URLS:
+    return get_web3_provider()
+
+
+def reset_web3_providers():
+    """Drops the cached provider so the next call reconnects (e.g. after an RPC outage)."""
+    get_web3_provider.cache_clear()
+
+
+# --- Async Web3 Provider ---
+# `async def` route handlers must not block the event loop on RPC calls, so they use
+# an AsyncWeb3 instance backed by a pooled aiohttp session instead.
+
+class PooledAsyncHTTPProvider(AsyncHTTPProvider):
+    """
+    An AsyncHTTPProvider that owns a single pooled aiohttp session. The session is
+    created lazily because it must be bound to the running event loop.
+    """
+
+    def __init__(self, endpoint_uri: str, pool_size: int = RPC_POOL_SIZE):
+        super().__init__(endpoint_uri)
+        self._pool_size = pool_size
+        self._session = None
+
+    def _get_session(self) -> ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = ClientSession(
+                connector=TCPConnector(limit=self._pool_size),
+                timeout=ClientTimeout(total=RPC_TIMEOUT),
+                raise_for_status=True,
+            )
+        return self._session
+
+    async def make_request(self, method, params):
+        request_data = self.encode_rpc_request(method, params)
+        async with self._get_session().post(
+            self.endpoint_uri, data=request_data, headers=self.get_request_headers()
+        ) as response:
+            raw_response = await response.read()
+        return self.decode_rpc_response(raw_response)
+
+    async def disconnect(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+
+class BatchingAsyncHTTPProvider(PooledAsyncHTTPProvider):
+    """
+    A pooled async provider that gathers concurrent `eth_call` and
+    `eth_getBlockByNumber` requests issued within a short window into one
+    JSON-RPC batch POST, then routes each response back to its caller by id.
+    All other methods are sent individually.
+    """
+
+    def __init__(
+        self,
+        endpoint_uri: str,
+        pool_size: int = RPC_POOL_SIZE,
+        window: float = RPC_BATCH_WINDOW,
+        max_batch_size: int = RPC_BATCH_MAX_SIZE,
+    ):
+        super().__init__(endpoint_uri, pool_size)
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self._pending = []
+        self._flush_handle = None
+        # In-flight batch sends; the loop only keeps weak references to tasks
+        self._tasks = set()
+
+    async def make_request(self, method, params):
+        if method not in BATCHABLE_RPC_METHODS:
+            return await super().make_request(method, params)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        rpc_request = {"jsonrpc": "2.0", "method": method, "params": params or [], "id": next(self.request_counter)}
+        self._pending.append((rpc_request, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._send_batch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send_batch(self, batch):
         try:
-            logger.info(f"Trying to connect to fallback provider: {provider_url}")
-            w3 = Web3(Web3.HTTPProvider(provider_url, request_kwargs={'timeout': 30}))
-            
-            if w3.is_connected():
-                chain_id = w3.eth.chain_id
-                # FIX: Add chain ID validation within the loop
-                if chain_id != AMOY_CHAIN_ID:
-                    logger.warning(f"Connected to incorrect chain ID {chain_id} at {provider_url}. Skipping.")
+            payload = FriendlyJsonSerde().json_encode([rpc_request for rpc_request, _ in batch], cls=Web3JsonEncoder)
+            async with self._get_session().post(
+                self.endpoint_uri, data=payload.encode(), headers=self.get_request_headers()
+            ) as response:
+                raw_response = await response.read()
+            responses = self.decode_rpc_response(raw_response)
+            if not isinstance(responses, list):
+                raise ValueError(f"Endpoint {self.endpoint_uri} did not return a JSON-RPC batch response: {responses}")
+
+            responses_by_id = {rpc_response.get("id"): rpc_response for rpc_response in responses}
+            for rpc_request, future in batch:
+                if future.done():
                     continue
-                
-                logger.info(f"Successfully connected to {provider_url}, Chain ID: {chain_id}")
-                return w3
-            else:
-                logger.warning(f"Connection failed to {provider_url}")
-                
+                rpc_response = responses_by_id.get(rpc_request["id"])
+                if rpc_response is None:
+                    future.set_exception(ValueError(f"Missing response for batched {rpc_request['method']} request"))
+                else:
+                    future.set_result(rpc_response)
+        except Exception as e:
+            logger.error(f"JSON-RPC batch of {len(batch)} requests to {self.endpoint_uri} failed: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+
+class RoutedAsyncHTTPProvider(AsyncHTTPProvider):
+    """
+    Async counterpart of `RoutedHTTPProvider`. Latency-critical reads are hedged:
+    if the best endpoint has not answered within its p95 latency, the same request
+    is sent to the runner-up and whichever answers first wins. Requests made under
+    an `rpc_budget` wait for that budget's per-endpoint rate limit.
+    """
+
+    def __init__(self, router: RPCRouter):
+        super().__init__(next(iter(router.endpoints)))
+        self.router = router
+        self._providers = {
+            url: (BatchingAsyncHTTPProvider if url in RPC_BATCH_URLS else PooledAsyncHTTPProvider)(url)
+            for url in router.endpoints
+        }
+        self._verified = set()
+
+    async def _attempt(self, url: str, method, params):
+        budget = rpc_budget.get()
+        if budget is not None:
+            await budget.acquire(url)
+        started = time.monotonic()
+        try:
+            if url not in self._verified:
+                _check_chain_id(self.router, url, await self._providers[url].make_request("eth_chainId", []))
+                self._verified.add(url)
+                started = time.monotonic()
+            response = await self._providers[url].make_request(method, params)
+        except asyncio.CancelledError:
+            self.router.record_latency(url, time.monotonic() - started)
+            raise
         except Exception as e:
-            logger.error(f"Error connecting to {provider_url}: {e}")
-            continue
-    
-    # This will only be reached if all providers fail
-    raise ConnectionError("Could not connect to any of the configured Web3 providers.")
+            self.router.record_failure(url, rate_limited=isinstance(e, ClientResponseError) and e.status == 429)
+            raise
+        if _is_rate_limited_response(response):
+            self.router.record_failure(url, rate_limited=True)
+            raise RateLimitedError(f"{url} rate limited {method}: {response['error']}")
+        self.router.record_success(url, time.monotonic() - started)
+        return response
+
+    async def _hedged_request(self, primary: str, secondary: str, method, params, attempted: set, errors: list):
+        """Returns the first successful response from `primary` or the hedge to `secondary`, or None."""
+        attempted.add(primary)
+        tasks = {asyncio.ensure_future(self._attempt(primary, method, params))}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.router.hedge_delay(primary))
+            if not done:
+                self.router.hedged_requests += 1
+                attempted.add(secondary)
+                tasks.add(asyncio.ensure_future(self._attempt(secondary, method, params)))
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    errors.append(task.exception())
+            return None
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def make_request(self, method, params):
+        if method not in COALESCED_RPC_METHODS:
+            return await self._route_request(method, params)
+        # The encoded params identify the contract, calldata (function + args) and block tag.
+        # The flight runs under its first caller's rate budget, so only callers sharing
+        # that budget (or with none) may join it.
+        key = (method, FriendlyJsonSerde().json_encode(params, cls=Web3JsonEncoder), rpc_budget.get())
+        response = await rpc_single_flight.do(key, lambda: self._route_request(method, params))
+        # Each caller gets its own copy, as middlewares may modify the response
+        return dict(response)
+
+    async def _route_request(self, method, params):
+        ranked = self.router.ranked()
+        attempted, errors = set(), []
+        # Budgeted (background) requests are not latency-critical, so they are never hedged
+        if method in HEDGED_RPC_METHODS and len(ranked) > 1 and rpc_budget.get() is None:
+            response = await self._hedged_request(ranked[0], ranked[1], method, params, attempted, errors)
+            if response is not None:
+                return response
+
+        for url in ranked:
+            if url in attempted:
+                continue
+            try:
+                return await self._attempt(url, method, params)
+            except Exception as e:
+                logger.warning(f"RPC {method} failed on {url}: {e}")
+                errors.append(e)
+        raise ConnectionError(f"All RPC endpoints failed for {method}: {errors}")
+
+    async def disconnect(self):
+        for provider in self._providers.values():
+            await provider.disconnect()
+
+
+async def _connect_async() -> AsyncWeb3:
+    """Async counterpart of `_connect`: builds a routed AsyncWeb3 and validates the chain ID once."""
+    w3 = AsyncWeb3(RoutedAsyncHTTPProvider(rpc_router))
+    w3.middleware_onion.inject(async_geth_poa_middleware, layer=0)
+    w3.middleware_onion.add(
+        await async_construct_simple_cache_middleware(rpc_whitelist=CHAIN_ID_CACHE_WHITELIST), "chain_id_cache"
+    )
+
+    chain_id = await w3.eth.chain_id
+    if chain_id != AMOY_CHAIN_ID:
+        await w3.provider.disconnect()
+        raise ConnectionError(f"Connected to incorrect chain ID {chain_id}. Expected Amoy ({AMOY_CHAIN_ID}).")
+    return w3
+
+
+_async_web3 = None
+_async_web3_lock = asyncio.Lock()
+
+
+@backoff.on_exception(backoff.expo, (Web3Exception, ConnectionError), max_tries=3, max_time=60)
+async def get_async_web3_provider() -> AsyncWeb3:
+    """
+    Returns the process-wide AsyncWeb3 provider, routed across all valid RPC URLs.
+    This is the provider all `async def` route handlers should use.
+    """
+    global _async_web3
+    if _async_web3 is not None:
+        return _async_web3
+
+    async with _async_web3_lock:
+        if _async_web3 is not None:
+            return _async_web3
+        try:
+            _async_web3 = await _connect_async()
+            logger.info(f"Successfully connected async provider, Chain ID: {AMOY_CHAIN_ID}")
+            return _async_web3
+        except Exception as e:
+            logger.error(f"Async Web3 provider connection failed: {e}")
+            raise ConnectionError(f"Could not connect to any of the configured Web3 providers: {e}")
+
+
+async def close_async_web3_provider():
+    """Closes the pooled async session. Called from the application shutdown hook."""
+    global _async_web3
+    if _async_web3 is not None:
+        await _async_web3.provider.disconnect()
+        _async_web3 = None
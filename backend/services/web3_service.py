@@ -6,7 +6,6 @@ import logging
 from typing import Any
 import backoff
 from web3 import Web3
-from web3.middleware import geth_poa_middleware
 from web3.exceptions import ContractLogicError, Web3Exception
 
 from .web3_client import get_web3_provider_with_fallback as get_web3_provider
@@ -32,7 +31,6 @@ def send_admin_transaction(function_call: Any) -> str:
     """
     logger.info(f"Initiating admin transaction for function: {function_call.fn_name}")
     w3 = get_web3_provider()
-    w3.middleware_onion.inject(geth_poa_middleware, layer=0)
     
     try:
         admin_account = w3.eth.account.from_key(ADMIN_PRIVATE_KEY)
@@ -2,13 +2,20 @@
 
 import asyncio
 import logging
+import time
+from contextlib import aclosing
+from datetime import datetime, timezone
 from decimal import Decimal
-from web3 import Web3
+from typing import Tuple
 
 # It's crucial that this task uses the same services and configs as the main app
-from services.supabase_client import get_supabase_admin_client
-from services.web3_client import get_web3_provider_with_fallback as get_web3_provider
-from utils.utils import load_contract_abi
+from services.supabase_client import get_supabase_admin_client, paginate
+from services.web3_client import get_async_web3_provider
+from services.contract_service import MulticallReader, MULTICALL_CHUNK_SIZE
+from services.rpc_router import RateBudget, rpc_budget
+from services.collateral_registry import collateral_registry
+from services.vault_writer import user_vault_writer, UserVaultWriteError
+from services.vault_dirty_set import mark_dirty, iter_dirty, clear_dirty, ALL_COLLATERALS
 import os
 
 # --- Setup ---
@@ -19,71 +26,163 @@ logger = logging.getLogger(__name__)
 COLLATERAL_VAULT_ADDRESS = os.getenv("COLLATERAL_VAULT_ADDRESS")
 if not COLLATERAL_VAULT_ADDRESS:
     raise RuntimeError("Task setup failed: COLLATERAL_VAULT_ADDRESS is not set.")
-COLLATERAL_VAULT_ABI = load_contract_abi("abi/CollateralVault.json")
 TGHSX_DECIMALS = 6
 
+# Seconds between sync cycles. Each cycle only re-reads the (wallet, collateral) pairs marked
+# dirty by the event listener or /vault/save-wallet since the previous cycle...
+VAULT_SYNC_INTERVAL = float(os.getenv("VAULT_SYNC_INTERVAL", "120"))
+# ...plus every collateral of this many wallets, taken in turn, so rows that missed an event
+# are still corrected eventually.
+VAULT_SYNC_COLD_WALLETS = int(os.getenv("VAULT_SYNC_COLD_WALLETS", "50"))
+# Pairs are read (one Multicall3 request) and written in batches, this many at a time.
+VAULT_SYNC_CONCURRENCY = int(os.getenv("VAULT_SYNC_CONCURRENCY", "4"))
+VAULT_SYNC_BATCH_SIZE = MULTICALL_CHUNK_SIZE
+# Requests per second the sync may send to each RPC endpoint (0 = unlimited), leaving the
+# rest of the plan to user traffic.
+VAULT_SYNC_RPC_RPS = float(os.getenv("VAULT_SYNC_RPC_RPS", "5"))
+
+PROFILE_LOOKUP_CHUNK_SIZE = 100
+
+def _has_wallet(query):
+    return query.neq("wallet_address", "null")
+
+def _lookup_profiles(supabase, wallets: list) -> dict:
+    """Returns {lowercase wallet: profile} for the given wallets that have a profile. Blocking."""
+    profiles = {}
+    for i in range(0, len(wallets), PROFILE_LOOKUP_CHUNK_SIZE):
+        # ilike keeps the match case-insensitive, as wallets may be stored checksummed
+        condition = ",".join(f"wallet_address.ilike.{wallet}" for wallet in wallets[i:i + PROFILE_LOOKUP_CHUNK_SIZE])
+        for profile in supabase.table("profiles").select("id, wallet_address").or_(condition).execute().data:
+            profiles[profile["wallet_address"].lower()] = profile
+    return profiles
+
+async def _sync_batch(reader: MulticallReader, batch: list, profiles: dict, configs: dict, semaphore: asyncio.Semaphore) -> Tuple[int, list]:
+    """
+    Reads and writes one batch of pairs. Only positions that changed since they were
+    last written reach the database. Returns the number of rows written and the pairs
+    that could not be read or written. A flush also writes other batches' rows, so a
+    failed one reports every row it left buffered, whichever batch added it.
+    """
+    async with semaphore:
+        positions = await reader.get_user_positions(batch)
+
+        failed = []
+        synced_at = datetime.now(timezone.utc).isoformat()
+        for wallet_address, collateral_address in batch:
+            position = positions.get((wallet_address, collateral_address))
+            if position is None:
+                logger.error(f"Failed to sync vault for wallet {wallet_address}, collateral {collateral_address}: on-chain read failed")
+                failed.append((wallet_address, collateral_address))
+                continue
+            collateral_decimals = configs[collateral_address]["decimals"]
+
+            # Convert to human-readable format for storage
+            user_vault_writer.add({
+                "user_id": profiles[wallet_address.lower()]["id"],
+                "wallet_address": wallet_address,
+                "collateral_address": collateral_address,
+                "eth_collateral": str(Decimal(position[0]) / Decimal(10**collateral_decimals)),
+                "tghsx_minted": str(Decimal(position[1]) / Decimal(10**TGHSX_DECIMALS)),
+                "last_synced": synced_at
+            })
+
+        # Database writes run in a thread so they never block the web worker's event loop
+        try:
+            return await user_vault_writer.flush(), failed
+        except UserVaultWriteError as e:
+            # The rows stay buffered in this process only, so keep their pairs dirty too
+            return 0, failed + [(row["wallet_address"], row["collateral_address"]) for row in e.rows if row.get("wallet_address")]
+
+async def _sync_pairs(reader: MulticallReader, pairs: list, profiles: dict, configs: dict, semaphore: asyncio.Semaphore, stats: dict):
+    """Syncs `pairs` in batches through the shared worker pool, accumulating into `stats`."""
+    batches = [pairs[i:i + VAULT_SYNC_BATCH_SIZE] for i in range(0, len(pairs), VAULT_SYNC_BATCH_SIZE)]
+    # Every batch runs to completion even if another fails, so none is left running unowned
+    results = await asyncio.gather(
+        *(_sync_batch(reader, batch, profiles, configs, semaphore) for batch in batches), return_exceptions=True
+    )
+    for batch, result in zip(batches, results):
+        if isinstance(result, BaseException):
+            logger.error(f"Vault sync batch of {len(batch)} pairs failed; they stay dirty: {result}")
+            result = (0, list(batch))
+        batch_written, batch_failed = result
+        stats["written"] += batch_written
+        stats["failed"].extend(batch_failed)
+        stats["batches"] += 1
+    logger.info(f"Vault sync progress: {stats['batches']} batches, {stats['written']} changed positions written.")
+
 async def sync_user_vaults():
     """
-    A background task that periodically fetches on-chain vault data for all users
-    and updates the `user_vaults` table in Supabase to ensure data consistency.
+    A background task that periodically refreshes the `user_vaults` rows whose
+    on-chain positions may have changed, plus a rolling slice of the other
+    wallets, so that Supabase stays consistent with the chain.
+
+    Chain reads and database writes go through a bounded pool of
+    VAULT_SYNC_CONCURRENCY batches, and every RPC the task sends counts against
+    a VAULT_SYNC_RPC_RPS budget per endpoint, so a large scan cannot starve the
+    API requests served by the same worker. Dirty pairs and profiles are
+    streamed a page at a time, so memory does not grow with the user base.
     """
+    rpc_budget.set(RateBudget(VAULT_SYNC_RPC_RPS))
+    # Profile id after which the next slice of cold wallets starts
+    cold_cursor = None
     while True:
-        logger.info("Starting periodic sync of user vaults with on-chain data...")
+        logger.info("Starting incremental sync of user vaults with on-chain data...")
+        started = time.monotonic()
         try:
             supabase = get_supabase_admin_client()
-            w3 = get_web3_provider()
-            vault_contract = w3.eth.contract(address=Web3.to_checksum_address(COLLATERAL_VAULT_ADDRESS), abi=COLLATERAL_VAULT_ABI)
-            
-            # Get all profiles that have a registered wallet address
-            profiles_res = supabase.table("profiles").select("id, wallet_address").neq("wallet_address", "null").execute()
-            if not profiles_res.data:
-                logger.info("Sync task: No user profiles with wallets found.")
-                await asyncio.sleep(3600) # Wait for an hour before trying again
-                continue
+            w3 = await get_async_web3_provider()
+            reader = MulticallReader(w3, concurrency=VAULT_SYNC_CONCURRENCY)
 
-            all_collaterals = vault_contract.functions.getAllCollateralTokens().call()
+            configs = {collateral["address"]: collateral for collateral in await collateral_registry.all()}
+            all_collaterals = list(configs)
             if not all_collaterals:
                 logger.warning("Sync task: No collateral tokens found in the vault contract.")
-                await asyncio.sleep(3600)
+                await asyncio.sleep(VAULT_SYNC_INTERVAL)
                 continue
 
-            for profile in profiles_res.data:
-                user_id = profile["id"]
-                wallet_address = profile["wallet_address"]
-                
-                for collateral_address in all_collaterals:
-                    try:
-                        position = vault_contract.functions.getUserPosition(
-                            Web3.to_checksum_address(wallet_address),
-                            Web3.to_checksum_address(collateral_address)
-                        ).call()
-                        
-                        config = vault_contract.functions.collateralConfigs(Web3.to_checksum_address(collateral_address)).call()
-                        collateral_decimals = config[5]
-
-                        # Convert to human-readable format for storage
-                        collateral_amount = str(Decimal(position[0]) / Decimal(10**collateral_decimals))
-                        minted_amount = str(Decimal(position[1]) / Decimal(10**TGHSX_DECIMALS))
-
-                        # Upsert the synchronized data into the user_vaults table
-                        # This creates or updates the record based on a composite primary key (user_id, collateral_address)
-                        supabase.table("user_vaults").upsert({
-                            "user_id": user_id,
-                            "collateral_address": collateral_address,
-                            "eth_collateral": collateral_amount, # Column name might need adjustment
-                            "tghsx_minted": minted_amount,
-                            "last_synced": "now()"
-                        }).execute()
-                        logger.info(f"Synced vault for user {user_id} with collateral {collateral_address}")
-
-                    except Exception as e:
-                        logger.error(f"Failed to sync vault for user {user_id}, wallet {wallet_address}, collateral {collateral_address}: {e}")
+            semaphore = asyncio.Semaphore(VAULT_SYNC_CONCURRENCY)
+            stats = {"written": 0, "failed": [], "batches": 0}
+
+            # Pairs touched since the last cycle; wallets without a profile have no user_vaults rows
+            marked_before = datetime.now(timezone.utc).isoformat()
+            dirty_count = 0
+            async for dirty in iter_dirty(supabase, marked_before):
+                profiles = await asyncio.to_thread(_lookup_profiles, supabase, sorted({row["wallet_address"] for row in dirty}))
+                pairs = set()
+                for row in dirty:
+                    profile = profiles.get(row["wallet_address"])
+                    if profile is None:
+                        continue
+                    if row["collateral_address"] == ALL_COLLATERALS:
+                        pairs.update((profile["wallet_address"], collateral) for collateral in all_collaterals)
+                    elif row["collateral_address"] in configs:
+                        pairs.add((profile["wallet_address"], row["collateral_address"]))
+                dirty_count += len(pairs)
+                await _sync_pairs(reader, list(pairs), profiles, configs, semaphore, stats)
+
+            # The next slice of cold wallets, wrapping around to the start of the table
+            async with aclosing(paginate("profiles", "id, wallet_address", page_size=VAULT_SYNC_COLD_WALLETS,
+                                         filters=_has_wallet, after=cold_cursor, client=supabase)) as pages:
+                cold = await anext(pages, [])
+            cold_cursor = cold[-1]["id"] if len(cold) == VAULT_SYNC_COLD_WALLETS else None
+            if not cold and not dirty_count:
+                logger.info("Sync task: No user profiles with wallets found.")
+            profiles = {profile["wallet_address"].lower(): profile for profile in cold}
+            pairs = [(profile["wallet_address"], collateral) for profile in cold for collateral in all_collaterals]
+            await _sync_pairs(reader, pairs, profiles, configs, semaphore, stats)
+
+            # Pairs that could not be read or written stay dirty for the next cycle
+            await asyncio.to_thread(clear_dirty, supabase, marked_before)
+            await asyncio.to_thread(mark_dirty, supabase, stats["failed"])
+            logger.info(
+                f"Synced {dirty_count + len(pairs)} vault positions ({dirty_count} dirty, {len(cold)} cold wallets) in "
+                f"{time.monotonic() - started:.1f}s; {stats['written']} changed, {len(stats['failed'])} failed."
+            )
         
         except Exception as e:
             logger.error(f"A critical error occurred during the user vault sync task: {str(e)}")
         
-        # Wait for 1 hour before the next sync cycle
-        await asyncio.sleep(3600)
+        await asyncio.sleep(VAULT_SYNC_INTERVAL)
 
 # To run this task, you would typically start it in your main application file (e.g., main.py)
 # using asyncio.create_task(sync_user_vaults()) within an async context.
@@ -0,0 +1,158 @@
+# In /backend/worker.py
+
+import os
+import time
+import signal
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List
+
+from aiohttp import web
+from fastapi_cache import FastAPICache
+
+from services.job_lease import run_exclusive
+from services.web3_client import close_async_web3_provider
+from services.cache_backend import create_cache_backend, build_cache_key
+
+# --- Setup ---
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# Comma-separated jobs to run; all of them by default.
+WORKER_JOBS = os.getenv("WORKER_JOBS", "event_listener,sync_user_vaults,liquidation_keeper")
+WORKER_HEALTH_PORT = int(os.getenv("WORKER_HEALTH_PORT", os.getenv("PORT", "8081")))
+# A crashed job is restarted after a delay that doubles on each consecutive crash...
+WORKER_RESTART_MIN_DELAY = float(os.getenv("WORKER_RESTART_MIN_DELAY", "1"))
+WORKER_RESTART_MAX_DELAY = float(os.getenv("WORKER_RESTART_MAX_DELAY", "300"))
+# ...and reset once it has stayed up this long.
+WORKER_RESTART_RESET_AFTER = float(os.getenv("WORKER_RESTART_RESET_AFTER", "600"))
+
+# --- Jobs ---
+# Services are imported inside each job, so a job whose module fails to import is retried
+# by the supervisor without taking the other jobs down. Modules connect on first use, not on
+# import, so importing them never blocks the supervisor's event loop.
+
+async def run_event_listener():
+    from services.event_listener import run_listener
+    await run_listener()
+
+async def run_user_vault_sync():
+    from services.position_mirror import POSITION_MIRROR_ENABLED
+    if POSITION_MIRROR_ENABLED:
+        logger.info("User vaults are kept in sync by the event listener's position mirror; vault sync is idle.")
+        await asyncio.Event().wait()
+    from tasks import sync_user_vaults
+    await sync_user_vaults()
+
+async def run_keeper():
+    from services.liquidation_keeper import run_liquidation_keeper
+    await run_liquidation_keeper()
+
+JOBS: Dict[str, Callable[[], Awaitable]] = {
+    "event_listener": run_event_listener,
+    # Same lease name as the web app's copy of the job, so only one of them runs it
+    "sync_user_vaults": run_user_vault_sync,
+    "liquidation_keeper": run_keeper,
+}
+
+# --- Supervisor ---
+
+class JobSupervisor:
+    """
+    Runs each job in its own task and restarts it with exponential backoff when it
+    crashes or returns. Each job also runs under a lease (see services/job_lease.py),
+    so another process holding the same lease stands by instead of duplicating it.
+    The default file lease only covers processes on one host; a second worker
+    instance on another host needs JOB_LEASE_BACKEND=supabase. Job concurrency
+    is bounded inside each job by its own settings (VAULT_SYNC_CONCURRENCY,
+    KEEPER_CONCURRENCY, ...), so one job's load cannot starve another.
+    """
+
+    def __init__(self, jobs: Dict[str, Callable[[], Awaitable]]):
+        self.jobs = jobs
+        self.status = {
+            name: {"state": "standby", "restarts": 0, "last_error": None, "started_at": None}
+            for name in jobs
+        }
+        self._tasks: List[asyncio.Task] = []
+
+    async def _supervise(self, name: str):
+        """Runs the job for as long as this worker holds its lease, restarting it on failure."""
+        job, status = self.jobs[name], self.status[name]
+        delay = WORKER_RESTART_MIN_DELAY
+        try:
+            while True:
+                status.update(state="running", started_at=time.time())
+                started = time.monotonic()
+                try:
+                    await job()
+                    status["last_error"] = "job returned"
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.exception(f"Job {name} crashed")
+                    status["last_error"] = repr(e)
+                if time.monotonic() - started >= WORKER_RESTART_RESET_AFTER:
+                    delay = WORKER_RESTART_MIN_DELAY
+                status.update(state="restarting", restarts=status["restarts"] + 1)
+                logger.warning(f"Restarting job {name} in {delay:.1f}s.")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, WORKER_RESTART_MAX_DELAY)
+        finally:
+            status["state"] = "standby"
+
+    def healthy(self) -> bool:
+        return all(status["state"] != "restarting" for status in self.status.values())
+
+    async def _health(self, request):
+        body = {"healthy": self.healthy(), "jobs": self.status}
+        return web.json_response(body, status=200 if body["healthy"] else 503)
+
+    async def run(self):
+        app = web.Application()
+        app.router.add_get("/health", self._health)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "0.0.0.0", WORKER_HEALTH_PORT).start()
+        logger.info(f"Worker health endpoint listening on port {WORKER_HEALTH_PORT}.")
+
+        self._tasks = [
+            asyncio.create_task(run_exclusive(name, lambda name=name: self._supervise(name)))
+            for name in self.jobs
+        ]
+        try:
+            await asyncio.gather(*self._tasks)
+        finally:
+            await runner.cleanup()
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+
+
+async def run_worker():
+    names = [name.strip() for name in WORKER_JOBS.split(",") if name.strip()]
+    unknown = [name for name in names if name not in JOBS]
+    if unknown:
+        raise RuntimeError(f"Unknown WORKER_JOBS {unknown}; expected any of {list(JOBS)}.")
+
+    # The keeper's risk index clears cached /liquidations/at-risk responses when a price change
+    # moves positions across the threshold; with a Redis CACHE_BACKEND_URL that is the web cache
+    FastAPICache.init(create_cache_backend(), prefix="fastapi-cache", key_builder=build_cache_key)
+
+    supervisor = JobSupervisor({name: JOBS[name] for name in names})
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, supervisor.stop)
+    logger.info(f"Starting background worker with jobs: {', '.join(names)}")
+    try:
+        await supervisor.run()
+    except asyncio.CancelledError:
+        pass
+    finally:
+        await close_async_web3_provider()
+        logger.info("Background worker stopped.")
+
+if __name__ == "__main__":
+    asyncio.run(run_worker())